@@ -0,0 +1,49 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks run against a throw-away SQLite database in a temporary
+directory, never against db.sqlite3.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    """Point Django at a temporary database, migrate it and return its path"""
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+
+    from django.conf import settings
+    db_path = Path(tempfile.mkdtemp(prefix='restaurant-bench-')) / 'bench.sqlite3'
+    settings.DATABASES['default']['NAME'] = db_path
+    settings.LOGGING['loggers']['restaurant']['level'] = 'WARNING'
+    settings.LOGGING['root']['level'] = 'WARNING'
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return db_path
+
+
+def timed(func, repeat):
+    """Run func `repeat` times and return the latencies in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"p50={statistics.median(samples):8.2f}ms  p95={p95:8.2f}ms"
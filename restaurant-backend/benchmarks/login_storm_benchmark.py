@@ -0,0 +1,107 @@
+"""
+Latency of a non-login endpoint during a login storm, served through the
+ASGI application (project/asgi.py).
+
+A probe requests the category list back to back while a burst of
+concurrent logins runs. ``pool`` is the shipped path (hashing in the process
+pool, 429 past LOGIN_MAX_PENDING); ``inline`` hashes on the event loop like
+``User.acheck_password`` does, for comparison.
+
+Usage: python benchmarks/login_storm_benchmark.py [--logins 200] [--concurrency 50] [--modes baseline inline pool]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from common import setup_django, summarize
+
+
+def populate(count):
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from restaurant.models import Category, Customer
+
+    Category.objects.bulk_create([Category(name=f'Category {i}', slug=f'category-{i}') for i in range(8)])
+    password = make_password('storm-password')
+    users = User.objects.bulk_create([
+        User(username=f'storm{i}', email=f'storm{i}@example.com', password=password) for i in range(count)
+    ])
+    Customer.objects.bulk_create([Customer(user=user, phone='', address='') for user in users])
+
+
+def p99(samples):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+
+async def run(mode, logins, concurrency):
+    import httpx
+    from project.asgi import application
+
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+        await client.get('/api/categories/')  # warm-up (caches, pool)
+        if mode != 'baseline':
+            await client.post('/api/login/', json={'identity': 'storm0', 'password': 'storm-password'})
+
+        samples, statuses = [], Counter()
+        stop = asyncio.Event()
+
+        async def probe():
+            while not stop.is_set():
+                start = time.perf_counter()
+                await client.get('/api/categories/')
+                samples.append((time.perf_counter() - start) * 1000)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def login(i):
+            async with semaphore:
+                response = await client.post(
+                    '/api/login/', json={'identity': f'storm{i}', 'password': 'storm-password'}
+                )
+                statuses[response.status_code] += 1
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        if mode == 'baseline':
+            await asyncio.sleep(2)
+        else:
+            await asyncio.gather(*(login(i) for i in range(logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+    return samples, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--modes', nargs='+', default=['baseline', 'inline', 'pool'])
+    args = parser.parse_args()
+
+    setup_django()
+    logging.disable(logging.WARNING)  # 401/429 من العاصفة نفسها
+    from django.contrib.auth.hashers import verify_password
+    from restaurant import views
+
+    populate(args.logins)
+    shipped = views.acheck_user_password
+
+    async def inline_check(user, password):
+        return verify_password(password, user.password)[0]
+
+    print(f"GET /api/categories/ during {args.logins} logins ({args.concurrency} concurrent)\n")
+    for mode in args.modes:
+        views.acheck_user_password = inline_check if mode == 'inline' else shipped
+        samples, statuses, elapsed = asyncio.run(run(mode, args.logins, args.concurrency))
+        logins = ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))
+        print(f"{mode:8}  {summarize(samples)}  p99={p99(samples):8.2f}ms  "
+              f"({len(samples)} probes, {elapsed:.1f}s{', logins ' + logins if logins else ''})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Dish search latency: LIKE '%x%' scan versus the FTS5 index.
+
+Usage: python benchmarks/search_benchmark.py [--dishes 100000] [--repeat 30]
+"""
+import argparse
+import random
+from decimal import Decimal
+
+from common import setup_django, summarize, timed
+
+WORDS = [
+    'margherita', 'pepperoni', 'tiramisu', 'burger', 'salad', 'penne', 'arrabbiata',
+    'mozzarella', 'basil', 'tomato', 'garlic', 'chicken', 'bacon', 'cheddar', 'mango',
+    'smoothie', 'chocolate', 'vanilla', 'caesar', 'greek', 'feta', 'olive', 'spicy',
+    'grilled', 'crispy', 'fresh', 'classic', 'homemade', 'truffle', 'mushroom',
+]
+QUERIES = ['marg', 'tiramisu', 'chicken bacon', 'truff mush', 'spicy garlic tomato', 'zzz']
+
+
+def vocabulary(rng, size=5000):
+    """Menu words plus synthetic filler so term frequencies look like a real catalog"""
+    syllables = ['ka', 'lo', 'mi', 'ten', 'ra', 'su', 'vel', 'do', 'pri', 'zan', 'cho', 'fu']
+    filler = {''.join(rng.choices(syllables, k=3)) for _ in range(size)}
+    return WORDS + sorted(filler)
+
+
+def populate(count):
+    from restaurant.models import Category, Dish
+
+    rng = random.Random(42)
+    words = vocabulary(rng)
+    category = Category.objects.create(name='Benchmark')
+    batch = []
+    for i in range(count):
+        batch.append(Dish(
+            name=' '.join(rng.sample(words, 2)).title() + f' {i}',
+            slug=f'dish-{i}',
+            description=' '.join(rng.choices(words, k=12)),
+            ingredients=', '.join(rng.choices(words, k=5)),
+            price=Decimal(rng.randint(100, 5000)) / 100,
+            category=category,
+            stock_quantity=10,
+        ))
+        if len(batch) == 5000:
+            Dish.objects.bulk_create(batch)
+            batch = []
+    Dish.objects.bulk_create(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dishes', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db.models import Q
+    from restaurant.models import Dish
+    from restaurant.search import search_dishes
+
+    populate(args.dishes)
+    print(f"{args.dishes} dishes, COUNT + first page of 20 (as the list endpoint does), "
+          f"{args.repeat} runs per query\n")
+
+    base = Dish.objects.filter(is_available=True)
+    for text in QUERIES:
+        def like():
+            queryset = base.filter(
+                Q(name__icontains=text) | Q(description__icontains=text) | Q(ingredients__icontains=text)
+            ).order_by('name')
+            queryset.count()
+            list(queryset[:20])
+
+        def fts():
+            queryset = search_dishes(base, text).order_by('search_rank', 'name')
+            queryset.count()
+            list(queryset[:20])
+
+        print(f"{text!r:24} LIKE {summarize(timed(like, args.repeat))}")
+        print(f"{'':24} FTS5 {summarize(timed(fts, args.repeat))}")
+
+
+if __name__ == '__main__':
+    main()
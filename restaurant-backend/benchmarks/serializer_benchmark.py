@@ -0,0 +1,76 @@
+"""
+Dish list serialization: DishSerializer versus the compiled values() path.
+
+Each run fetches the rows and renders them to JSON, as the list endpoint
+does, and checks that both paths produce the same bytes.
+
+Usage: python benchmarks/serializer_benchmark.py [--rows 20 100 1000] [--repeat 30]
+"""
+import argparse
+import random
+from decimal import Decimal
+
+from common import setup_django, summarize, timed
+
+
+def populate(count):
+    from restaurant.models import Category, Dish
+
+    rng = random.Random(42)
+    categories = [Category.objects.create(name=f'Category {i}') for i in range(8)]
+    Dish.objects.bulk_create([
+        Dish(
+            name=f'Dish {i}',
+            slug=f'dish-{i}',
+            description='Slow cooked with fresh herbs and a secret sauce. ' * 4,
+            ingredients='tomato, basil, garlic, olive oil, mozzarella',
+            price=Decimal(rng.randint(100, 5000)) / 100,
+            category=rng.choice(categories),
+            image=f'dishes/dish-{i}.jpg' if i % 2 else '',
+            stock_quantity=rng.randint(0, 40),
+            calories=rng.randint(100, 1200),
+        )
+        for i in range(count)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[20, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from restaurant.fast_serializers import CompiledDishSerializer
+    from restaurant.models import Dish
+    from restaurant.serializers import DishSerializer
+
+    populate(max(args.rows))
+    request = Request(APIRequestFactory().get('/api/dishes/', HTTP_HOST='localhost'))
+    renderer = JSONRenderer()
+    print(f"Fetch + serialize + render, {args.repeat} runs per size\n")
+
+    for rows in args.rows:
+        queryset = Dish.objects.select_related('category').order_by('name')[:rows]
+
+        def drf():
+            return renderer.render(DishSerializer(queryset, many=True, context={'request': request}).data)
+
+        def compiled():
+            serializer = CompiledDishSerializer({'request': request})
+            values = serializer.values(Dish.objects.order_by('name'))[:rows]
+            return renderer.render(serializer.serialize(values))
+
+        assert drf() == compiled(), 'compiled output differs from DishSerializer'
+        drf_samples = timed(drf, args.repeat)
+        compiled_samples = timed(compiled, args.repeat)
+        speedup = sorted(drf_samples)[len(drf_samples) // 2] / sorted(compiled_samples)[len(compiled_samples) // 2]
+        print(f"{rows:5} rows  DishSerializer {summarize(drf_samples)}")
+        print(f"{'':5}       compiled       {summarize(compiled_samples)}  ({speedup:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
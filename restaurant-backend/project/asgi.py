@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The login views are async (password hashing runs in a process pool, see
+restaurant/passwords.py); serve this entry point under load, e.g.
+``uvicorn project.asgi:application --workers 2``.
 """
 
 import os
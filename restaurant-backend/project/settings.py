@@ -36,7 +36,6 @@ INSTALLED_APPS = [
     'rest_framework',
     'corsheaders',
     'restaurant',
-    # 'django_ratelimit',  # تعطيل مؤقتاً لحين إعداد Redis
     'django_filters',
     'drf_spectacular',
     'fcm_django',
@@ -119,6 +118,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'restaurant.authentication.SessionKeyAuthentication',
+        'restaurant.authentication.SignedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
@@ -133,6 +133,9 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # عدد الـ reverse proxies أمام الخادم. 0: عنوان العميل هو REMOTE_ADDR ويُتجاهل X-Forwarded-For
+    # الذي يرسله العميل (حدود الطلبات لكل IP في restaurant/ratelimit.py). خلف proxy واحد: 1
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
 }
 
 SPECTACULAR_SETTINGS = {
@@ -204,23 +207,80 @@ CSRF_COOKIE_SAMESITE = 'Lax'
 SESSION_COOKIE_AGE = 86400  # 24 hours
 SESSION_COOKIE_SAMESITE = 'Lax'
 SESSION_COOKIE_SECURE = False  # Always False for development
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = True  # انتهاء متجدد - الكتابة الفعلية يقررها SESSION_ENGINE
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_NAME = 'sessionid'
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_ENGINE = 'restaurant.sessions'  # لا يكتب الجلسات غير المعدلة (restaurant/sessions.py)
+# تمديد الانتهاء فقط عندما يبقى أقل من نصف العمر. مهلة الخمول الفعلية إذن بين
+# SESSION_REFRESH_FRACTION * SESSION_COOKIE_AGE (12 ساعة) و SESSION_COOKIE_AGE (24 ساعة)
+# بعد آخر طلب، مع أن الـ cookie يصدر دائماً بالعمر الكامل
+SESSION_REFRESH_FRACTION = 0.5
+SESSION_EXPIRY_FLUSH_INTERVAL = 5  # seconds - تجميع تمديدات الانتهاء في UPDATE واحد (timer لكل worker)
+SESSION_EXPIRY_BATCH_SIZE = 100
+SESSION_PRINCIPAL_CACHE_TIMEOUT = 60  # seconds - مستخدم الجلسة المخزن في الـ cache (restaurant/identity.py)
+SESSION_PRINCIPAL_CACHE = 'shared'  # وليس L1 كل worker: تسجيل الخروج يظهر لكل الـ workers فوراً
+
+# Signed access/refresh tokens (restaurant/tokens.py) - اختياري بجانب الجلسات
+AUTH_TOKENS_ENABLED = os.getenv('AUTH_TOKENS_ENABLED', 'False').lower() in ('true', '1', 'yes')
+AUTH_ACCESS_TOKEN_LIFETIME = 300  # 5 minutes
+AUTH_REFRESH_TOKEN_LIFETIME = 7 * 24 * 3600  # 7 days
+
+# Login password hashing (restaurant/passwords.py)
+LOGIN_HASH_PROCESSES = int(os.getenv('LOGIN_HASH_PROCESSES', '2'))  # 0 = hash in a thread
+LOGIN_MAX_PENDING = int(os.getenv('LOGIN_MAX_PENDING', '16'))  # أكثر من ذلك = 429
+
+# Rate limiting (restaurant/ratelimit.py) - نوافذ منزلقة لكل IP أو مستخدم
+RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'True').lower() in ('true', '1', 'yes')
+RATELIMIT_BACKEND = 'restaurant.ratelimit.CacheBackend'  # أو LocalBackend لـ worker واحد
+RATELIMIT_CACHE = 'shared'  # مباشرة على SQLite: العدادات لا تحتمل نسخة قديمة في L1
+RATELIMIT_RATES = {
+    'login': '20/m',  # customer_login, admin_login - لكل IP
+    'register': '10/h',
+    'verification': '10/10m',  # إرسال والتحقق من رمز البريد
+    'rating': '30/m',  # لكل مستخدم
+    'checkout': '10/m',
+}
+
+# الاختبارات تعمل على نسخة مؤقتة من الـ caches (restaurant/testing.py)
+TEST_RUNNER = 'restaurant.testing.TestRunner'
 
 # Cache Configuration
 CACHES = {
+    # L1 في ذاكرة كل worker أمام الـ cache المشترك (انظر restaurant/cache_backends.py)
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': BASE_DIR / 'cache',
+        'BACKEND': 'restaurant.cache_backends.TieredCache',
+        'TIMEOUT': 3600,  # 1 hour
+        'OPTIONS': {
+            'L2': 'shared',
+            'MAX_BYTES': 8 * 1024 * 1024,
+            'L1_TIMEOUT': 30,
+            # إبطال وسم في worker آخر يظهر هنا خلال ثانية (انظر restaurant/caching.py)
+            'L1_TIMEOUTS': {'tag_generation:': 1},
+            'METRICS_LABEL': 'default',  # اسم الـ cache في restaurant/cache_metrics.py
+        },
+    },
+    # ملف SQLite واحد (WAL) مشترك بين كل الـ workers على نفس الجهاز
+    'shared': {
+        'BACKEND': 'restaurant.cache_backends.SQLiteCache',
+        'LOCATION': BASE_DIR / 'cache' / 'cache.sqlite3',
         'TIMEOUT': 3600,  # 1 hour
         'OPTIONS': {
             'MAX_ENTRIES': 1000,
+            'METRICS_LABEL': 'shared',
         },
-    }
+    },
 }
 
+# Cache warm-up (python manage.py warm_caches، أو عند تشغيل كل worker)
+CACHE_WARMUP_ON_STARTUP = os.getenv('CACHE_WARMUP_ON_STARTUP', 'False').lower() in ('true', '1', 'yes')
+CACHE_WARMUP_BUDGET_SECONDS = 5  # لا ننتظر التسخين أكثر من ذلك
+CACHE_WARMUP_ORIGINS = ['http://localhost:8000']  # نسخ الـ menu snapshot التي تُبنى مسبقاً
+
+# Fuzzy dish search (in-memory trigram index)
+FUZZY_SEARCH_BUDGET_MS = 50  # latency budget per query
+FUZZY_SEARCH_MIN_SIMILARITY = 0.3
+FUZZY_SEARCH_MAX_RESULTS = 50
+
 # Stripe Configuration - SECURE WITH ENVIRONMENT VARIABLES
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
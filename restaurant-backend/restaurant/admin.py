@@ -17,11 +17,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Dish)
 class DishAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'is_available', 'is_spicy', 'is_vegetarian']
+    list_display = ['name', 'category', 'price', 'is_available', 'is_spicy', 'is_vegetarian', 'average_rating']
     list_filter = ['category', 'is_available', 'is_spicy', 'is_vegetarian', 'created_at']
     search_fields = ['name', 'description', 'ingredients']
     list_editable = ['is_available', 'price']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['rating_count', 'average_rating', 'created_at', 'updated_at']
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
@@ -1,6 +1,29 @@
 from django.apps import AppConfig
+import os
+import sys
 
 
 class RestaurantConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'restaurant'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_migrate
+        from . import signals
+
+        post_migrate.connect(signals.ensure_search_index, sender=self)
+
+        if settings.CACHE_WARMUP_ON_STARTUP and self.is_serving():
+            from .warmup import warm_caches_on_startup
+            warm_caches_on_startup()
+
+    @staticmethod
+    def is_serving():
+        """False for management commands and the runserver autoreloader parent"""
+        if os.path.basename(sys.argv[0]) != 'manage.py':
+            return True
+        command = sys.argv[1:2]
+        if command != ['runserver']:
+            return False
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
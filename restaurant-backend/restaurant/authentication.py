@@ -1,10 +1,11 @@
-from django.contrib.auth import get_user_model
-from django.contrib.sessions.models import Session
+from django.core import signing
 from rest_framework import authentication, exceptions
 import logging
 
+from .identity import get_identity, user_from_principal
+from .tokens import access_principal, tokens_enabled, verify_access_token
+
 logger = logging.getLogger(__name__)
-User = get_user_model()
 
 class SessionKeyAuthentication(authentication.BaseAuthentication):
     """
@@ -12,40 +13,45 @@ class SessionKeyAuthentication(authentication.BaseAuthentication):
     passed in the 'X-Session-Key' header.
     """
     def authenticate(self, request):
-        session_key = request.headers.get('X-Session-Key')
+        if not request.headers.get('X-Session-Key'):
+            return None
 
-        if not session_key:
+        # نفس الـ identity المحفوظة على الطلب تستخدمها الـ views أيضاً
+        identity = get_identity(request)
+        if identity.source != 'header':
+            # An invalid or expired key is not an error: returning None lets
+            # the other authentication classes (session cookie, basic) try.
             return None
+        return (identity.user, None)
 
-        try:
-            session = Session.objects.get(session_key=session_key)
-            session_data = session.get_decoded()
-            user_id = session_data.get('_auth_user_id')
-
-            if not user_id:
-                logger.warning(f"No user_id found in session data for key {session_key[:6]}...")
-                return None
-
-            user = User.objects.get(id=user_id)
-            
-        except Session.DoesNotExist:
-            # This is not necessarily an error, just an invalid session.
-            # Raising an exception would cause a 403 error for any invalid key,
-            # which might not be desirable. Returning None lets other auth methods try.
-            logger.info(f"Session with key {session_key[:6]}... is invalid or expired.")
+    def authenticate_header(self, request):
+        return 'Session'
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    """
+    'Authorization: Bearer <access token>' from restaurant.tokens. The token
+    is verified by its signature alone - no database or session access.
+    Disabled unless AUTH_TOKENS_ENABLED is set.
+    """
+    keyword = b'bearer'
+
+    def authenticate(self, request):
+        if not tokens_enabled():
+            return None
+
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword:
             return None
-        except User.DoesNotExist:
-            logger.error(f"User with id {user_id} from session does not exist.")
-            # This is a server error, but from a client perspective, it's an auth failure.
-            raise exceptions.AuthenticationFailed('User for session not found.')
-        except Exception as e:
-            logger.error(f"An unexpected error occurred during session authentication: {e}")
-            raise exceptions.AuthenticationFailed('Session authentication failed due to a server error.')
-
-        # If we get here, authentication was successful.
-        # Set the user on the request for other parts of Django/DRF to use.
-        request.user = user
-        return (user, None)
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            payload = verify_access_token(auth[1].decode())
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Access token expired.')
+        except (signing.BadSignature, UnicodeError, ValueError):
+            raise exceptions.AuthenticationFailed('Invalid access token.')
+        return (user_from_principal(access_principal(payload)), payload)
 
     def authenticate_header(self, request):
-        return 'Session' 
\ No newline at end of file
+        return 'Bearer'
@@ -0,0 +1,483 @@
+"""
+Cache backends.
+
+``TieredCache`` keeps a small per-process LRU (L1) in front of a shared
+cache alias (L2, normally ``SQLiteCache``). Reads of hot keys are served
+from memory; L2 is only consulted on an L1 miss.
+
+Writes go to L2 and update this process' L1. Other processes are not
+notified; their copy of a key lives at most its L1 timeout: ``L1_TIMEOUT``
+seconds, or less for keys matching a prefix in ``L1_TIMEOUTS`` (``0``
+keeps such keys out of L1). Tagged entries (``restaurant.caching``) carry
+the generations of their tags and are checked against them on every read,
+so giving the tag generation keys a short L1 timeout bounds how long an
+invalidation in another worker takes to be seen here, without dropping
+anything else from L1.
+
+Every lookup and write of both backends is also counted per key family in
+``restaurant.cache_metrics``, under the ``METRICS_LABEL`` option.
+
+Example::
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'restaurant.cache_backends.TieredCache',
+            'OPTIONS': {
+                'L2': 'shared',
+                'MAX_BYTES': 8 * 1024 * 1024,
+                'L1_TIMEOUTS': {'tag_generation:': 1},
+            },
+        },
+        'shared': {...},
+    }
+"""
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from .cache_metrics import metrics
+
+_missing = object()
+
+
+class TieredCache(BaseCache):
+    """Per-process LRU with a byte budget and TTL in front of another cache alias"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self.max_bytes = int(options.get('MAX_BYTES', 8 * 1024 * 1024))
+        self.l1_timeout = float(options.get('L1_TIMEOUT', 30))
+        self.metrics_label = options.get('METRICS_LABEL', 'default')
+        self.l1_timeouts = tuple(
+            (prefix, float(timeout)) for prefix, timeout in options.get('L1_TIMEOUTS', {}).items()
+        )
+
+        self._entries = OrderedDict()  # key -> (expires_at, pickled value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ['hits', 'misses', 'l2_hits', 'l2_misses', 'sets', 'evictions', 'flushes'], 0
+        )
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    # ----- L1 -----
+
+    def _l1_ceiling(self, key):
+        """Longest time ``key`` may stay in L1"""
+        for prefix, timeout in self.l1_timeouts:
+            if key.startswith(prefix):
+                return timeout
+        return self.l1_timeout
+
+    def _l1_store(self, key, version, value, timeout, stat):
+        """Keep ``value`` in L1 and count it under ``stat``; returns its pickled size"""
+        l1_key = self.make_and_validate_key(key, version)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        ceiling = self._l1_ceiling(key)
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            timeout = ceiling
+        with self._lock:
+            self._stats[stat] += 1
+            old = self._entries.pop(l1_key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            if len(data) > self.max_bytes or min(timeout, ceiling) <= 0:
+                return len(data)
+            self._entries[l1_key] = (time.monotonic() + min(timeout, ceiling), data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._stats['evictions'] += 1
+        return len(data)
+
+    def _l1_fetch(self, key):
+        """Pickled value of ``key`` in L1, or ``_missing``; counts the hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self._bytes -= len(entry[1])
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return _missing
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+        return entry[1]
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def _l1_discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+
+    def _l1_flush(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._stats['flushes'] += 1
+
+    # ----- cache API -----
+
+    def get(self, key, default=None, version=None):
+        start = time.perf_counter()
+        l1_key = self.make_and_validate_key(key, version)
+        data = self._l1_fetch(l1_key)
+        if data is not _missing:
+            value = pickle.loads(data)
+            metrics.record_get(key, True, len(data), time.perf_counter() - start, self.metrics_label)
+            return value
+
+        value = self.l2.get(key, _missing, version)
+        if value is _missing:
+            self._count('l2_misses')
+            metrics.record_get(key, False, 0, time.perf_counter() - start, self.metrics_label)
+            return default
+        size = self._l1_store(key, version, value, DEFAULT_TIMEOUT, 'l2_hits')
+        metrics.record_get(key, True, size, time.perf_counter() - start, self.metrics_label)
+        return value
+
+    def get_many(self, keys, version=None):
+        start = time.perf_counter()
+        found = {}
+        sizes = {}
+        remaining = []
+        for key in keys:
+            data = self._l1_fetch(self.make_and_validate_key(key, version))
+            if data is _missing:
+                remaining.append(key)
+            else:
+                found[key] = pickle.loads(data)
+                sizes[key] = len(data)
+        if remaining:
+            from_l2 = self.l2.get_many(remaining, version)
+            if len(remaining) > len(from_l2):
+                self._count('l2_misses', len(remaining) - len(from_l2))
+            for key, value in from_l2.items():
+                sizes[key] = self._l1_store(key, version, value, DEFAULT_TIMEOUT, 'l2_hits')
+            found.update(from_l2)
+
+        # زمن الاستعلام المجمع يُوزع بالتساوي على المفاتيح
+        elapsed = (time.perf_counter() - start) / max(len(keys), 1)
+        for key in keys:
+            metrics.record_get(key, key in found, sizes.get(key, 0), elapsed, self.metrics_label)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        start = time.perf_counter()
+        self.l2.set(key, value, timeout, version)
+        size = self._l1_store(key, version, value, timeout, 'sets')
+        metrics.record_set(key, size, time.perf_counter() - start, self.metrics_label)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        start = time.perf_counter()
+        failed = self.l2.set_many(data, timeout, version)
+        sizes = {}
+        for key, value in data.items():
+            if key not in failed:
+                sizes[key] = self._l1_store(key, version, value, timeout, 'sets')
+        elapsed = (time.perf_counter() - start) / max(len(data), 1)
+        for key, size in sizes.items():
+            metrics.record_set(key, size, elapsed, self.metrics_label)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        start = time.perf_counter()
+        added = self.l2.add(key, value, timeout, version)
+        if added:
+            size = self._l1_store(key, version, value, timeout, 'sets')
+            metrics.record_set(key, size, time.perf_counter() - start, self.metrics_label)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_discard(self.make_and_validate_key(key, version))
+        return self.l2.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self._l1_discard(self.make_and_validate_key(key, version))
+        return self.l2.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_discard(self.make_and_validate_key(key, version))
+        self.l2.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version) is not _missing
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_discard(self.make_and_validate_key(key, version))
+        return self.l2.incr(key, delta, version)
+
+    def clear(self):
+        self.l2.clear()
+        self._l1_flush()
+
+    def stats(self):
+        """Hit/miss/eviction counters of this process' L1"""
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+class SQLiteCache(BaseCache):
+    """
+    Shared cache stored in one SQLite database file in WAL mode.
+
+    Safe for several worker processes on one host: readers never block the
+    writer, writers serialize on SQLite's lock (``busy_timeout``), and
+    read-modify-write operations (``add``, ``incr``) run in ``BEGIN
+    IMMEDIATE`` transactions. Expiry and last access are indexed, so
+    removing expired entries and LRU culling are single indexed DELETEs
+    instead of a directory scan.
+
+    ``LOCATION`` is the database file. Options: ``MAX_ENTRIES`` and
+    ``CULL_FREQUENCY`` as for Django's backends, ``BUSY_TIMEOUT`` (seconds),
+    ``ACCESS_UPDATE_INTERVAL`` (seconds between last-access writes for a key
+    on reads, so hot reads do not turn into writes) and ``METRICS_LABEL``.
+    """
+
+    # حد عدد المتغيرات في استعلام واحد (IN (...))
+    BATCH_SIZE = 500
+
+    _SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            expires REAL,
+            accessed REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires)",
+        "CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed)",
+    ]
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.path = str(location)
+        self.busy_timeout = float(options.get('BUSY_TIMEOUT', 5))
+        self.access_update_interval = float(options.get('ACCESS_UPDATE_INTERVAL', 60))
+        self.metrics_label = options.get('METRICS_LABEL', 'shared')
+        self._local = threading.local()
+
+    # ----- connection -----
+
+    def _connection(self):
+        """One connection per thread, reopened after fork"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in self._SCHEMA:
+            connection.execute(statement)
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _batches(items, size):
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+    # ----- reads -----
+
+    def _fetch(self, keys):
+        """``{key: (value, accessed, pickled size)}`` for live entries"""
+        now = time.time()
+        connection = self._connection()
+        rows = {}
+        for batch in self._batches(keys, self.BATCH_SIZE):
+            placeholders = ', '.join('?' * len(batch))
+            rows.update(
+                (key, (pickle.loads(value), accessed, len(value)))
+                for key, value, accessed in connection.execute(
+                    f"SELECT key, value, accessed FROM cache_entries WHERE key IN ({placeholders}) "
+                    "AND (expires IS NULL OR expires > ?)",
+                    [*batch, now],
+                )
+            )
+        stale = [key for key, (_, accessed, _) in rows.items() if accessed < now - self.access_update_interval]
+        if stale:
+            for batch in self._batches(stale, self.BATCH_SIZE):
+                placeholders = ', '.join('?' * len(batch))
+                connection.execute(
+                    f"UPDATE cache_entries SET accessed = ? WHERE key IN ({placeholders})", [now, *batch]
+                )
+        return rows
+
+    def get(self, key, default=None, version=None):
+        start = time.perf_counter()
+        made_key = self.make_and_validate_key(key, version)
+        row = self._fetch([made_key]).get(made_key)
+        metrics.record_get(
+            key, row is not None, 0 if row is None else row[2], time.perf_counter() - start, self.metrics_label
+        )
+        return default if row is None else row[0]
+
+    def get_many(self, keys, version=None):
+        start = time.perf_counter()
+        mapping = {self.make_and_validate_key(key, version): key for key in keys}
+        rows = {mapping[key]: row for key, row in self._fetch(list(mapping)).items()}
+        elapsed = (time.perf_counter() - start) / max(len(mapping), 1)
+        for key in mapping.values():
+            row = rows.get(key)
+            metrics.record_get(key, row is not None, 0 if row is None else row[2], elapsed, self.metrics_label)
+        return {key: value for key, (value, _, _) in rows.items()}
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version)
+        return self._connection().execute(
+            "SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            [key, time.time()],
+        ).fetchone() is not None
+
+    # ----- writes -----
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        start = time.perf_counter()
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        rows = [
+            (self.make_and_validate_key(key, version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires, now)
+            for key, value in data.items()
+        ]
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                "INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                "expires = excluded.expires, accessed = excluded.accessed",
+                rows,
+            )
+            self._cull(connection, now)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        elapsed = (time.perf_counter() - start) / max(len(rows), 1)
+        for key, (_, value, _, _) in zip(data, rows):
+            metrics.record_set(key, len(value), elapsed, self.metrics_label)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        start = time.perf_counter()
+        raw_key, key = key, self.make_and_validate_key(key, version)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # يُستبدل المفتاح الموجود فقط إذا انتهت صلاحيته
+            cursor = connection.execute(
+                "INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                "expires = excluded.expires, accessed = excluded.accessed "
+                "WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?",
+                [key, data, self.get_backend_timeout(timeout), now, now],
+            )
+            added = cursor.rowcount == 1
+            if added:
+                self._cull(connection, now)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if added:
+            metrics.record_set(raw_key, len(data), time.perf_counter() - start, self.metrics_label)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version)
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE cache_entries SET expires = ?, accessed = ? "
+            "WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            [self.get_backend_timeout(timeout), now, key, now],
+        )
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        start = time.perf_counter()
+        raw_key, key = key, self.make_and_validate_key(key, version)
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                [key, now],
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            connection.execute(
+                "UPDATE cache_entries SET value = ?, accessed = ? WHERE key = ?", [data, now, key]
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        metrics.record_set(raw_key, len(data), time.perf_counter() - start, self.metrics_label)
+        return value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version)
+        cursor = self._connection().execute("DELETE FROM cache_entries WHERE key = ?", [key])
+        return cursor.rowcount == 1
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version) for key in keys]
+        connection = self._connection()
+        for batch in self._batches(keys, self.BATCH_SIZE):
+            placeholders = ', '.join('?' * len(batch))
+            connection.execute(f"DELETE FROM cache_entries WHERE key IN ({placeholders})", batch)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def _cull(self, connection, now):
+        """Drop expired entries, then the least recently used ones beyond MAX_ENTRIES"""
+        count = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if count <= self._max_entries:
+            return
+        connection.execute("DELETE FROM cache_entries WHERE expires <= ?", [now])
+        count = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if count <= self._max_entries:
+            return
+        excess = count - self._max_entries
+        if self._cull_frequency:
+            excess = max(excess, count // self._cull_frequency)
+        else:
+            excess = count
+        connection.execute(
+            "DELETE FROM cache_entries WHERE key IN "
+            "(SELECT key FROM cache_entries ORDER BY accessed LIMIT ?)",
+            [excess],
+        )
@@ -0,0 +1,103 @@
+"""
+Per key family cache metrics.
+
+Both cache backends (``TieredCache`` and ``SQLiteCache``) record every
+lookup and write here, labelled with the cache they went through (the
+``METRICS_LABEL`` option, normally the alias): ``default`` counts what the
+code asks of the tiered cache, ``shared`` every access to the SQLite file -
+L1 misses of the tiered cache as well as the callers that use it directly
+(rate limiter, session principals). Keys are grouped into families by
+replacing each ``_``/``:`` separated part that contains a digit with ``*``
+(``popular_dishes_10`` -> ``popular_dishes_*``, ``tag_generation:dish:7``
+-> ``tag_generation:dish:*``), so the numbers can be used to tune the TTL
+of each kind of entry.
+
+Counters live in the memory of the current process, like the L1 itself.
+"""
+from functools import lru_cache
+import re
+import threading
+
+_ID_PART = re.compile(r'[^_:]*\d[^_:]*')
+
+FIELDS = ('hits', 'misses', 'sets', 'bytes_read', 'bytes_written', 'get_seconds', 'set_seconds')
+
+
+@lru_cache(maxsize=4096)
+def key_family(key):
+    return _ID_PART.sub('*', str(key))
+
+
+class CacheMetrics:
+    """Thread-safe counters per cache and key family"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}  # (cache, family) -> counters
+
+    def _counters(self, cache, key):
+        family = (cache, key_family(key))
+        counters = self._families.get(family)
+        if counters is None:
+            counters = self._families[family] = dict.fromkeys(FIELDS, 0)
+        return counters
+
+    def record_get(self, key, hit, nbytes, seconds, cache='default'):
+        with self._lock:
+            counters = self._counters(cache, key)
+            counters['hits' if hit else 'misses'] += 1
+            counters['bytes_read'] += nbytes
+            counters['get_seconds'] += seconds
+
+    def record_set(self, key, nbytes, seconds, cache='default'):
+        with self._lock:
+            counters = self._counters(cache, key)
+            counters['sets'] += 1
+            counters['bytes_written'] += nbytes
+            counters['set_seconds'] += seconds
+
+    def snapshot(self):
+        """``{cache: {family: counters}}`` with the hit ratio and average latencies in ms"""
+        with self._lock:
+            families = {family: dict(counters) for family, counters in self._families.items()}
+        caches = {}
+        for (cache, family), counters in sorted(families.items()):
+            lookups = counters['hits'] + counters['misses']
+            counters['hit_ratio'] = round(counters['hits'] / lookups, 4) if lookups else 0.0
+            counters['avg_get_ms'] = round(counters['get_seconds'] * 1000 / lookups, 3) if lookups else 0.0
+            counters['avg_set_ms'] = round(counters['set_seconds'] * 1000 / counters['sets'], 3) if counters['sets'] else 0.0
+            caches.setdefault(cache, {})[family] = counters
+        return caches
+
+    def reset(self):
+        with self._lock:
+            self._families.clear()
+
+
+metrics = CacheMetrics()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text(caches):
+    """The metrics of ``snapshot()`` in the Prometheus text exposition format"""
+    lines = []
+    for field, kind, help_text in [
+        ('hits', 'counter', 'Cache lookups served'),
+        ('misses', 'counter', 'Cache lookups that found nothing'),
+        ('sets', 'counter', 'Cache writes'),
+        ('bytes_read', 'counter', 'Pickled bytes returned by cache hits'),
+        ('bytes_written', 'counter', 'Pickled bytes written to the cache'),
+        ('get_seconds', 'counter', 'Time spent in cache lookups'),
+        ('set_seconds', 'counter', 'Time spent in cache writes'),
+    ]:
+        name = f'restaurant_cache_{field}_total'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for cache, families in caches.items():
+            for family, counters in families.items():
+                lines.append(f'{name}{{cache="{_label(cache)}",family="{_label(family)}"}} {counters[field]}')
+    return '\n'.join(lines) + '\n'
+
@@ -0,0 +1,158 @@
+"""
+Tag-based invalidation on top of Django's cache.
+
+Entries are stored together with the current generation of each of their
+tags (``menu``, ``dish:<id>``, ``category:<id>``, ``ratings:<dish id>``,
+``order_items``, ``orders``). Invalidating a tag writes a new generation
+for it - one cache write, however many entries carry the tag - and an entry
+whose stored generations no longer match is treated as a miss. Signals in
+``signals.py`` invalidate the tags of every changed Dish, Category,
+DishRating, Order and OrderItem.
+
+Tagged entries may live in another cache alias (``using``); the tag
+generations always live in the default cache.
+
+``cached_computation`` adds single-flight recomputation, stale-while-
+revalidate and probabilistic early refresh for expensive aggregates.
+"""
+from django.core.cache import cache, caches
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger('restaurant')
+
+TAG_KEY_PREFIX = 'tag_generation:'
+
+_missing = object()
+
+
+def _tag_key(tag):
+    return f'{TAG_KEY_PREFIX}{tag}'
+
+
+def get_tag_generations(tags):
+    """
+    Current generation of every tag: ``{tag: generation}``.
+
+    A tag seen for the first time (or evicted from the cache) starts at the
+    current time in nanoseconds, so it can never match a generation stored
+    before the eviction.
+    """
+    keys = {tag: _tag_key(tag) for tag in tags}
+    found = cache.get_many(list(keys.values()))
+    generations = {}
+    for tag, key in keys.items():
+        generation = found.get(key)
+        if generation is None:
+            cache.add(key, time.time_ns(), None)
+            generation = cache.get(key)
+        generations[tag] = generation
+    return generations
+
+
+def get_tag_generation(tag):
+    return get_tag_generations([tag])[tag]
+
+
+def invalidate_tags(*tags):
+    """Make every entry tagged with any of ``tags`` stale"""
+    if not tags:
+        return
+    # قيمة زمنية وليس incr: نسخة الكتالوج (وسم menu) تُستخدم أيضاً كـ Last-Modified
+    generation = time.time_ns()
+    cache.set_many({_tag_key(tag): generation for tag in tags}, None)
+    logger.debug(f"Cache tags invalidated: {', '.join(tags)}")
+
+
+def _store(using):
+    return cache if using is None else caches[using]
+
+
+def _read(key, using=None):
+    """``(value, current)`` of a tagged entry (``current`` is False once a tag moved on), or None"""
+    entry = _store(using).get(key)
+    if entry is None:
+        return None
+    stored, value = entry
+    return value, not stored or get_tag_generations(list(stored)) == stored
+
+
+def get_cached(key, default=None, using=None):
+    """Value of a tagged entry, or ``default`` if it is missing or stale"""
+    entry = _read(key, using)
+    if entry is None or not entry[1]:
+        return default
+    return entry[0]
+
+
+def set_cached(key, value, timeout, tags=(), using=None, generations=None):
+    """
+    Store ``value`` under ``key``, valid until ``timeout`` or any tag is
+    invalidated. ``generations`` are the tag generations read *before* the
+    value was computed (``get_tag_generations(tags)``): an invalidation that
+    lands during the computation then leaves the stored value stale instead
+    of stamping the old data with the new generation.
+    """
+    if generations is None:
+        generations = get_tag_generations(tags)
+    _store(using).set(key, (generations, value), timeout)
+
+
+def _refresh_early(fresh_until, delta, beta):
+    """
+    XFetch: recompute before expiry with a probability that grows as expiry
+    nears and with how long the computation takes (``delta`` seconds).
+    """
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= fresh_until
+
+
+def cached_computation(key, compute, timeout, tags=(), stale_timeout=None, lock_timeout=10, beta=1.0):
+    """
+    Return ``compute()`` cached under ``key`` for ``timeout`` seconds.
+
+    - Only one caller at a time (across processes, through a ``cache.add``
+      lock) recomputes a missing, expired or invalidated value.
+    - While it does, other callers keep getting the previous value for up to
+      ``stale_timeout`` seconds past expiry (default: ``timeout``).
+    - Refresh starts early with probabilistic early expiration (XFetch), so
+      hot keys are usually recomputed before they ever go stale.
+    - Callers with no value at all wait up to ``lock_timeout`` seconds for
+      the lock holder, then compute it themselves.
+    """
+    if stale_timeout is None:
+        stale_timeout = timeout
+
+    entry = _read(key)
+    if entry is not None:
+        (value, fresh_until, delta), current = entry
+        if current and not _refresh_early(fresh_until, delta, beta):
+            return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, True, lock_timeout):
+        try:
+            generations = get_tag_generations(tags)
+            start = time.perf_counter()
+            value = compute()
+            delta = time.perf_counter() - start
+            set_cached(
+                key, (value, time.time() + timeout, delta), timeout + stale_timeout, generations=generations
+            )
+            logger.debug(f"Recomputed {key} in {delta * 1000:.1f}ms")
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        # قيمة قديمة أثناء إعادة الحساب في worker آخر
+        return entry[0][0]
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = _read(key)
+        if entry is not None and entry[1]:
+            return entry[0][0]
+    return compute()
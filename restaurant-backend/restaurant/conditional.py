@@ -0,0 +1,91 @@
+"""
+Conditional GET (ETag / Last-Modified) for the catalog endpoints.
+
+Validators are computed before any serializer runs, from the shared catalog
+version plus ``COUNT(*)`` and ``MAX(updated_at)`` of the backing tables, so a
+client revalidating with ``If-None-Match`` or ``If-Modified-Since`` gets a
+304 for the price of one small aggregate query.
+"""
+from django.db.models import Count, IntegerField, Max, Value
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+import hashlib
+
+from .utils import get_catalog_version
+
+
+def catalog_validators(request, *querysets):
+    """
+    Return ``(etag, last_modified)`` for a catalog response.
+
+    The ETag covers everything the body depends on: catalog version, the
+    row count and newest ``updated_at`` of every queryset, and the absolute
+    URL (query string and host, since image URLs are absolute) and Accept
+    header. Deletes do not move ``MAX(updated_at)``, so Last-Modified is
+    never older than the catalog version, which they do bump.
+    """
+    version = get_catalog_version()
+    parts = [version, request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', '')]
+    try:
+        last_modified = int(version) / 1e9
+    except (TypeError, ValueError):
+        last_modified = 0
+
+    # استعلام واحد (UNION ALL) لكل الجداول بدلاً من استعلام لكل جدول
+    stats = [
+        queryset.order_by()
+        .annotate(_position=Value(position, output_field=IntegerField()))
+        .values('_position')
+        .annotate(count=Count('pk'), last=Max('updated_at'))
+        .values_list('_position', 'count', 'last')
+        for position, queryset in enumerate(querysets)
+    ]
+    if stats:
+        rows = stats[0].union(*stats[1:], all=True) if len(stats) > 1 else stats[0]
+        for _, count, last in sorted(rows, key=lambda row: row[0]):
+            parts += [count, last.isoformat() if last else '']
+            if last:
+                last_modified = max(last_modified, last.timestamp())
+
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'"{digest}"', int(last_modified)
+
+
+def not_modified_response(request, etag, last_modified):
+    """A 304 response if the client's validators still match, otherwise None"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code == 200:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Answer ``list``/``retrieve`` with 304 Not Modified when nothing changed.
+
+    ``get_validator_querysets`` returns the querysets whose changes affect
+    the response (defaults to the view's unfiltered queryset).
+    """
+
+    def get_validator_querysets(self):
+        return [self.get_queryset()]
+
+    def _conditional(self, handler, request, *args, **kwargs):
+        etag, last_modified = catalog_validators(request, *self.get_validator_querysets())
+        response = not_modified_response(request, etag, last_modified)
+        if response is not None:
+            return response
+        return set_validators(handler(request, *args, **kwargs), etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(super().retrieve, request, *args, **kwargs)
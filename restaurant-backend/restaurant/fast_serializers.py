@@ -0,0 +1,204 @@
+"""
+Compiled read-only serializers built on ``values_list()`` rows.
+
+``DishSerializer`` instantiates a model per row and walks DRF's field
+machinery for every attribute, which dominates list endpoints. The classes
+here inspect the DRF serializer once, turn each readable field into a column
+plus a precomputed getter, and then build every representation straight from
+the row tuples. The result renders to exactly the same JSON as the DRF
+serializer (same keys, order and value formatting); anything that cannot be
+compiled (e.g. ``?fields=`` sparse responses) stays on the DRF path.
+"""
+from operator import itemgetter
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.encoding import filepath_to_uri
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import ISO_8601, api_settings
+
+from .serializers import CategorySerializer, DishSerializer
+from .utils import get_category_dish_counts
+
+# الحقول التي تعيد قيمة قاعدة البيانات كما هي
+_PASSTHROUGH = (
+    serializers.CharField, serializers.SlugField, serializers.IntegerField,
+    serializers.BooleanField, serializers.FloatField, serializers.ReadOnlyField,
+)
+
+
+def _convert(index, to_representation):
+    def get(row):
+        value = row[index]
+        return None if value is None else to_representation(value)
+    return get
+
+
+class CompiledSerializer:
+    """
+    Base class: subclasses set ``serializer_class`` and may define
+    ``compile_<field>(field)`` returning a row getter for fields that are not
+    plain model columns. ``supported`` is False when the request asks for a
+    shape only the DRF serializer produces (``?fields=``).
+    """
+    serializer_class = None
+
+    def __init__(self, context=None, prefix='', columns=None):
+        self.context = context if context is not None else {}
+        self.prefix = prefix
+        self.columns = columns if columns is not None else []
+        self._indexes = {}
+        self.steps = []
+        serializer = self.serializer_class(context=self.context)
+        self.supported = getattr(serializer, 'get_sparse_selection', lambda: None)() is None
+        if not self.supported:
+            return
+        for name, field in self.readable_fields():
+            compile_field = getattr(self, f'compile_{name}', None)
+            if compile_field is not None:
+                getter = compile_field(field)
+            elif isinstance(field, serializers.ImageField):
+                getter = self.image_getter(field.source)
+            elif isinstance(field, serializers.DateTimeField):
+                getter = self.datetime_getter(field)
+            elif type(field) in _PASSTHROUGH:
+                getter = itemgetter(self.column(field.source))
+            else:
+                getter = _convert(self.column(field.source), field.to_representation)
+            self.steps.append((name, getter))
+
+    @classmethod
+    def readable_fields(cls):
+        """The DRF serializer's readable fields, built once per class"""
+        fields = cls.__dict__.get('_readable_fields')
+        if fields is None:
+            fields = [
+                (name, field) for name, field in cls.serializer_class().fields.items()
+                if not field.write_only
+            ]
+            cls._readable_fields = fields
+        return fields
+
+    def column(self, source):
+        """Index of ``source`` (relative to this serializer) in the row, added if needed"""
+        path = f'{self.prefix}{source}'
+        if path not in self._indexes:
+            self._indexes[path] = len(self.columns)
+            self.columns.append(path)
+        return self._indexes[path]
+
+    def image_getter(self, source):
+        """
+        Absolute media URL like ``request.build_absolute_uri(field.url)``.
+
+        For local storage the ``scheme://host/media/`` prefix is resolved once
+        and only the file name is quoted per row.
+        """
+        index = self.column(source)
+        storage = self.serializer_class.Meta.model._meta.get_field(source).storage
+        request = self.context.get('request')
+        base_url = getattr(storage, 'base_url', '') if isinstance(storage, FileSystemStorage) else ''
+
+        if base_url.startswith('/') and base_url.endswith('/'):
+            prefix = request.build_absolute_uri(base_url) if request else base_url
+
+            def get(row):
+                name = row[index]
+                return prefix + filepath_to_uri(name).lstrip('/') if name else None
+        else:
+            def get(row):
+                name = row[index]
+                if not name:
+                    return None
+                url = storage.url(name)
+                return request.build_absolute_uri(url) if request else url
+        return get
+
+    def datetime_getter(self, field):
+        """
+        ``DateTimeField.to_representation`` with the output timezone resolved
+        once instead of per value.
+        """
+        index = self.column(field.source)
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        if timezone is None or output_format is None or output_format.lower() != ISO_8601:
+            return _convert(index, field.to_representation)
+
+        def get(row):
+            value = row[index]
+            if not value:
+                return None
+            value = value.astimezone(timezone).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return get
+
+    def to_representation(self, row):
+        return {name: get(row) for name, get in self.steps}
+
+    def values(self, queryset):
+        """The queryset as row tuples carrying every compiled column"""
+        return queryset.values_list(*self.columns)
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+
+class CompiledCategorySerializer(CompiledSerializer):
+    serializer_class = CategorySerializer
+
+    def _counts(self):
+        # نفس مفتاح الـ context الذي يستخدمه CategorySerializer
+        counts = self.context.get('category_dish_counts')
+        if counts is None:
+            counts = get_category_dish_counts()
+            self.context['category_dish_counts'] = counts
+        return counts
+
+    def compile_dishes_count(self, field):
+        index = self.column('id')
+        return lambda row: self._counts().get(row[index], (0, 0))[0]
+
+    def compile_available_dishes_count(self, field):
+        index = self.column('id')
+        return lambda row: self._counts().get(row[index], (0, 0))[1]
+
+
+class CompiledDishSerializer(CompiledSerializer):
+    """``DishSerializer`` output from ``values_list()`` rows"""
+    serializer_class = DishSerializer
+
+    def compile_category(self, field):
+        category = CompiledCategorySerializer(self.context, f'{self.prefix}category__', self.columns)
+        return category.to_representation
+
+    def compile_is_in_stock(self, field):
+        stock = self.column('stock_quantity')
+        return lambda row: row[stock] > 0
+
+    def compile_is_low_stock(self, field):
+        stock = self.column('stock_quantity')
+        threshold = self.column('low_stock_threshold')
+        return lambda row: row[stock] <= row[threshold]
+
+
+class CompiledListMixin:
+    """
+    ViewSet mixin serving ``list`` through ``compiled_serializer_class``.
+
+    Filtering, ordering and pagination run on the model queryset exactly as
+    before; only the rows handed to the serializer are ``values_list()``
+    tuples.
+    """
+    compiled_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.compiled_serializer_class(self.get_serializer_context())
+        if not compiled.supported:
+            return super().list(request, *args, **kwargs)
+
+        rows = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(page))
+        return Response(compiled.serialize(rows))
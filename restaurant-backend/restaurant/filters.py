@@ -1,7 +1,9 @@
 import django_filters
 from django_filters import rest_framework as filters
-from django.db.models import Q, F
+from django.db.models import Count, Q, F
+from rest_framework.filters import OrderingFilter
 from .models import Dish, Category, Order, DishRating
+from .search import search_dishes, fuzzy_search_dishes, is_search_ranked
 
 class DishFilter(filters.FilterSet):
     """فلاتر متقدمة للأطباق"""
@@ -18,8 +20,9 @@ class DishFilter(filters.FilterSet):
     # فلترة حسب وقت التحضير
     prep_time_max = filters.NumberFilter(field_name="preparation_time", lookup_expr='lte')
     
-    # بحث في النص
+    # بحث في النص (fuzzy=true للبحث المتسامح مع الأخطاء الإملائية)
     search = filters.CharFilter(method='filter_search')
+    fuzzy = filters.BooleanFilter(method='filter_fuzzy')
     
     # فلترة حسب التوفر والمخزون
     in_stock = filters.BooleanFilter(method='filter_in_stock')
@@ -28,6 +31,19 @@ class DishFilter(filters.FilterSet):
     # فلترة حسب التقييم
     min_rating = filters.NumberFilter(method='filter_min_rating')
     
+    # facets=true يضيف أعداد كل فئة/خيار إلى الاستجابة
+    facets = filters.BooleanFilter(method='filter_facets')
+    
+    # الفلاتر التي يملكها كل facet - لا تُطبق على أعداد الـ facet نفسه
+    FACET_FILTERS = {
+        'category': ['category'],
+        'is_vegetarian': ['is_vegetarian'],
+        'is_spicy': ['is_spicy'],
+        'price': ['price_min', 'price_max', 'price_range'],
+        'in_stock': ['in_stock'],
+    }
+    PRICE_BUCKETS = [(None, 10), (10, 20), (20, 50), (50, None)]
+    
     class Meta:
         model = Dish
         fields = {
@@ -39,12 +55,14 @@ class DishFilter(filters.FilterSet):
         }
     
     def filter_search(self, queryset, name, value):
-        """بحث في اسم الطبق والمكونات والوصف"""
-        return queryset.filter(
-            Q(name__icontains=value) |
-            Q(description__icontains=value) |
-            Q(ingredients__icontains=value)
-        )
+        """بحث في اسم الطبق والمكونات والوصف (فهرس FTS5 مع ترتيب BM25)"""
+        if self.form.cleaned_data.get('fuzzy'):
+            return fuzzy_search_dishes(queryset, value)
+        return search_dishes(queryset, value)
+    
+    def filter_fuzzy(self, queryset, name, value):
+        """مجرد خيار لـ search - لا يفلتر بمفرده"""
+        return queryset
     
     def filter_in_stock(self, queryset, name, value):
         """فلترة الأطباق المتوفرة في المخزون"""
@@ -59,11 +77,114 @@ class DishFilter(filters.FilterSet):
         return queryset
     
     def filter_min_rating(self, queryset, name, value):
-        """فلترة حسب الحد الأدنى للتقييم"""
-        from django.db.models import Avg
-        return queryset.annotate(
-            avg_rating=Avg('dishrating__rating')
-        ).filter(avg_rating__gte=value)
+        """فلترة حسب الحد الأدنى للتقييم (على العمود المخزن والمفهرس)"""
+        return queryset.filter(average_rating__gte=value)
+    
+    def filter_facets(self, queryset, name, value):
+        """مجرد خيار للاستجابة - لا يفلتر"""
+        return queryset
+    
+    def facet_condition(self, facet):
+        """The active filter of one facet as a Q object (empty Q when inactive)"""
+        data = self.form.cleaned_data
+        condition = Q()
+        if facet in ('category', 'is_vegetarian', 'is_spicy'):
+            if data.get(facet) is not None:
+                condition = Q(**{facet: data[facet]})
+        elif facet == 'price':
+            price_range = data.get('price_range')
+            for lookup, value in [
+                ('gte', data.get('price_min')), ('lte', data.get('price_max')),
+                ('gte', price_range.start if price_range else None),
+                ('lte', price_range.stop if price_range else None),
+            ]:
+                if value is not None:
+                    condition &= Q(**{f'price__{lookup}': value})
+        elif facet == 'in_stock' and data.get('in_stock') is not None:
+            condition = Q(stock_quantity__gt=0) if data['in_stock'] else Q(stock_quantity=0)
+        return condition
+    
+    def facet_buckets(self):
+        """(facet, key, Q) for every counted value except categories"""
+        for facet in ('is_vegetarian', 'is_spicy'):
+            yield facet, 'true', Q(**{facet: True})
+            yield facet, 'false', Q(**{facet: False})
+        for low, high in self.PRICE_BUCKETS:
+            condition = Q()
+            if low is not None:
+                condition &= Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            yield 'price', (low, high), condition
+        yield 'in_stock', 'true', Q(stock_quantity__gt=0)
+        yield 'in_stock', 'false', Q(stock_quantity=0)
+    
+    def get_facets(self):
+        """
+        Counts per category, vegetarian, spicy, price bucket and stock for the
+        current search, each ignoring its own filter but honouring all others.
+        
+        Everything comes from one query grouped by category: the non-facet
+        filters (search, calories, ...) form the WHERE clause and every bucket
+        is a conditional COUNT filtered by the other facets' conditions. The
+        category filter is applied in Python by summing the matching groups.
+        """
+        owned = {name for names in self.FACET_FILTERS.values() for name in names}
+        queryset = self.queryset
+        for name, value in self.form.cleaned_data.items():
+            if name not in owned:
+                queryset = self.filters[name].filter(queryset, value)
+        
+        conditions = {facet: self.facet_condition(facet) for facet in self.FACET_FILTERS}
+        
+        def others(facet):
+            condition = Q()
+            for other, other_condition in conditions.items():
+                if other not in (facet, 'category'):
+                    condition &= other_condition
+            return condition
+        
+        category_filter = others('category')
+        aggregates = {'_category': Count('pk', filter=category_filter or None)}
+        buckets = []
+        for position, (facet, key, bucket) in enumerate(self.facet_buckets()):
+            aggregates[f'_bucket{position}'] = Count('pk', filter=others(facet) & bucket)
+            buckets.append((facet, key, f'_bucket{position}'))
+        
+        rows = list(
+            queryset.order_by()
+            .values('category_id', 'category__name')
+            .annotate(**aggregates)
+            .order_by('category__name')
+        )
+        
+        selected_category = self.form.cleaned_data.get('category')
+        in_category = [
+            row for row in rows
+            if selected_category is None or row['category_id'] == selected_category.pk
+        ]
+        facets = {
+            'category': [
+                {'id': row['category_id'], 'name': row['category__name'], 'count': row['_category']}
+                for row in rows if row['_category']
+            ],
+            'is_vegetarian': {}, 'is_spicy': {}, 'price': [], 'in_stock': {},
+        }
+        for facet, key, alias in buckets:
+            count = sum(row[alias] for row in in_category)
+            if facet == 'price':
+                facets['price'].append({'min': key[0], 'max': key[1], 'count': count})
+            else:
+                facets[facet][key] = count
+        return facets
+
+class SearchRankOrderingFilter(OrderingFilter):
+    """ترتيب نتائج البحث حسب الصلة عندما لا يطلب العميل ترتيباً آخر"""
+    
+    def get_ordering(self, request, queryset, view):
+        if not request.query_params.get(self.ordering_param) and is_search_ranked(queryset):
+            return ['search_rank', 'name']
+        return super().get_ordering(request, queryset, view)
 
 class CategoryFilter(filters.FilterSet):
     """فلاتر للفئات"""
@@ -0,0 +1,230 @@
+"""
+Per-request identity resolution.
+
+A request is authenticated by a Django session: the ``X-Session-Key`` header
+first, then the session cookie. ``get_identity`` loads that session and the
+user together with its Customer and AdminProfile (one joined query) at most
+once per request and keeps the result on the underlying ``HttpRequest``, so
+the authentication class, the middleware and the views all share it.
+
+Across requests, a compact principal of each session (user columns,
+customer id, admin profile) is cached for ``SESSION_PRINCIPAL_CACHE_TIMEOUT``
+seconds, never past the session's expiry, under the ``user:<id>`` tag. The
+principals live directly in the ``SESSION_PRINCIPAL_CACHE`` alias (the
+shared SQLite cache), not in the per-worker memory tier, so a logout in one
+worker is seen by all of them at once. The steady-state cost of
+authenticating is then one read of that cache; the session row is only read
+when a view touches session data. Logout drops the entry and any change to
+the user or its profiles invalidates the tag (see ``signals.py``), which
+covers password changes.
+"""
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.crypto import constant_time_compare
+from importlib import import_module
+import logging
+import time
+
+from .caching import get_cached, get_tag_generations, set_cached
+
+logger = logging.getLogger('restaurant')
+User = get_user_model()
+
+_IDENTITY_ATTR = '_restaurant_identity'
+
+PRINCIPAL_KEY_PREFIX = 'session_principal:'
+PRINCIPAL_USER_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name', 'is_staff', 'is_superuser', 'is_active',
+)
+
+
+class Identity:
+    """
+    The user behind one request and the session that identified it.
+    ``source`` is ``'header'``, ``'cookie'`` or None for anonymous requests.
+    """
+
+    def __init__(self, user=None, session=None, source=None):
+        self.user = user
+        self.session = session
+        self.source = source
+
+    @property
+    def is_authenticated(self):
+        return self.user is not None
+
+    @property
+    def session_key(self):
+        return self.session.session_key if self.session is not None else None
+
+    @property
+    def customer(self):
+        return getattr(self.user, 'customer', None)
+
+    @property
+    def admin_profile(self):
+        return getattr(self.user, 'adminprofile', None)
+
+    @property
+    def is_admin(self):
+        return self.user is not None and (self.admin_profile is not None or self.user.is_superuser)
+
+
+def load_session(session_key):
+    """Session store for ``session_key`` (empty if the session is missing or expired)"""
+    engine = import_module(settings.SESSION_ENGINE)
+    return engine.SessionStore(session_key)
+
+
+def _load_user(session):
+    user_id = session.get(SESSION_KEY) or session.get('user_id')
+    if not user_id:
+        return None
+
+    user = User.objects.select_related('customer', 'adminprofile').filter(pk=user_id).first()
+    if user is None or not user.is_active:
+        logger.warning(f"User {user_id} of session {str(session.session_key)[:6]}... not found or inactive")
+        return None
+
+    # مثل django.contrib.auth.get_user: تغيير كلمة المرور يبطل الجلسات القديمة
+    session_hash = session.get(HASH_SESSION_KEY)
+    if session_hash and not constant_time_compare(session_hash, user.get_session_auth_hash()):
+        logger.info(f"Session {str(session.session_key)[:6]}... predates a password change")
+        return None
+    return user
+
+
+def _session_expiry(session):
+    """Expiry timestamp of the stored session (the row for database backends)"""
+    # restaurant.sessions يحتفظ بتاريخ الصف الذي قرأه
+    expire_date = getattr(session, 'expire_date', None)
+    if expire_date is None and hasattr(session, 'model'):
+        expire_date = (
+            session.model.objects.filter(session_key=session.session_key)
+            .values_list('expire_date', flat=True).first()
+        )
+    if expire_date is None:
+        expire_date = session.get_expiry_date()
+    return expire_date.timestamp()
+
+
+def _from_values(model, values):
+    """Model instance from a subset of its columns (the rest stay deferred)"""
+    names = [f.attname for f in model._meta.concrete_fields if f.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, names, [values[name] for name in names])
+
+
+def build_principal(user, admin_profile=None):
+    """Compact JSON-able description of ``user`` and its profiles"""
+    customer = getattr(user, 'customer', None)
+    if admin_profile is None:
+        admin_profile = getattr(user, 'adminprofile', None)
+    return {
+        'user': {name: getattr(user, name) for name in PRINCIPAL_USER_FIELDS},
+        'customer_id': customer.pk if customer is not None else None,
+        'admin_profile': {
+            'id': admin_profile.pk,
+            'admin_email': admin_profile.admin_email,
+            'is_super_admin': admin_profile.is_super_admin,
+        } if admin_profile is not None else None,
+    }
+
+
+def user_from_principal(principal):
+    """
+    User (other columns deferred) with its customer and admin profile already
+    cached on it, like the joined query would leave them.
+    """
+    from .models import AdminProfile, Customer
+
+    user = _from_values(User, principal['user'])
+    customer = None
+    if principal['customer_id'] is not None:
+        customer = _from_values(Customer, {'id': principal['customer_id'], 'user_id': user.pk})
+        Customer.user.field.set_cached_value(customer, user)
+    User.customer.related.set_cached_value(user, customer)
+
+    admin_profile = None
+    if principal['admin_profile'] is not None:
+        admin_profile = _from_values(AdminProfile, {**principal['admin_profile'], 'user_id': user.pk})
+        AdminProfile.user.field.set_cached_value(admin_profile, user)
+    User.adminprofile.related.set_cached_value(user, admin_profile)
+    return user
+
+
+def user_for_session(session):
+    """The active user of ``session`` with customer and adminprofile loaded, or None"""
+    session_key = session.session_key
+    if session_key:
+        principal = get_cached(f'{PRINCIPAL_KEY_PREFIX}{session_key}', using=settings.SESSION_PRINCIPAL_CACHE)
+        if principal is not None and principal['expires'] > time.time():
+            return user_from_principal(principal)
+
+    # جيل وسم المستخدم قبل قراءته: تغيير أثناء التحميل يترك المدخل المخزن قديماً
+    user_id = session.get(SESSION_KEY) or session.get('user_id')
+    generations = get_tag_generations([f'user:{user_id}']) if user_id and session_key else None
+    user = _load_user(session)
+    if user is not None and generations is not None and f'user:{user.pk}' in generations:
+        principal = {**build_principal(user), 'expires': _session_expiry(session)}
+        timeout = min(settings.SESSION_PRINCIPAL_CACHE_TIMEOUT, principal['expires'] - time.time())
+        if timeout > 0:
+            set_cached(
+                f'{PRINCIPAL_KEY_PREFIX}{session_key}', principal, timeout,
+                using=settings.SESSION_PRINCIPAL_CACHE, generations=generations,
+            )
+    return user
+
+
+def forget_session(session_key):
+    """Drop the cached principal of a session (logout)"""
+    if session_key:
+        caches[settings.SESSION_PRINCIPAL_CACHE].delete(f'{PRINCIPAL_KEY_PREFIX}{session_key}')
+
+
+def _resolve(request):
+    session_key = request.headers.get('X-Session-Key')
+    if session_key:
+        session = load_session(session_key)
+        user = user_for_session(session)
+        if user is not None:
+            return Identity(user, session, 'header')
+        logger.info(f"Session with key {session_key[:6]}... is invalid or expired.")
+
+    session = getattr(request, 'session', None)
+    if session is not None:
+        user = user_for_session(session)
+        if user is not None:
+            # AuthenticationMiddleware لن يحتاج لاستعلام آخر عن نفس المستخدم
+            request.user = user
+            return Identity(user, session, 'cookie')
+    return Identity()
+
+
+def get_identity(request):
+    """The memoized ``Identity`` of a Django or DRF request"""
+    http_request = getattr(request, '_request', request)
+    identity = http_request.__dict__.get(_IDENTITY_ATTR)
+    if identity is None:
+        identity = _resolve(http_request)
+        setattr(http_request, _IDENTITY_ATTR, identity)
+    return identity
+
+
+def get_request_user(request):
+    """``request.user`` when authenticated (any DRF authenticator), else the session user or None"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    return get_identity(request).user
+
+
+def get_or_create_customer(user, **defaults):
+    """Customer profile of ``user`` - usually already joined by the identity query"""
+    from .models import Customer
+
+    customer = getattr(user, 'customer', None)
+    if customer is None:
+        customer, _ = Customer.objects.get_or_create(user=user, defaults={'phone': '', 'address': '', **defaults})
+    return customer
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from restaurant.models import Dish
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored rating count, sum and average of every dish from DishRating'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dish', type=int, action='append', dest='dish_ids',
+            help='Only rebuild the given dish id (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        queryset = Dish.objects.all()
+        if options['dish_ids']:
+            queryset = queryset.filter(pk__in=options['dish_ids'])
+
+        with transaction.atomic():
+            updated = Dish.rebuild_rating_aggregates(queryset)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} dishes'))
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurant.warmup import WARMERS, warm_caches
+
+
+class Command(BaseCommand):
+    help = 'Precompute the popular dishes, category stats and OpenAPI schema into the shared cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only', action='append', choices=list(WARMERS), dest='names',
+            help='Only run the given warmer (can be repeated)',
+        )
+        parser.add_argument(
+            '--budget', type=float, default=getattr(settings, 'CACHE_WARMUP_BUDGET_SECONDS', 5),
+            help='Stop waiting after this many seconds (default: CACHE_WARMUP_BUDGET_SECONDS)',
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Warmers run in parallel')
+
+    def handle(self, *args, **options):
+        # الـ menu snapshot يعيش في ذاكرة كل worker - يُسخن عند التشغيل وليس من هنا
+        names = options['names'] or [name for name, (_, per_worker) in WARMERS.items() if not per_worker]
+        results = warm_caches(names, budget=options['budget'], max_workers=options['workers'])
+
+        for result in results:
+            line = f"{result['name']:<16} {result['status']:<8} {result['seconds'] * 1000:8.1f}ms"
+            if result['error']:
+                line += f"  {result['error']}"
+            style = self.style.SUCCESS if result['status'] == 'ok' else self.style.WARNING
+            self.stdout.write(style(line))
+
+        total = max((result['seconds'] for result in results), default=0)
+        self.stdout.write(f"Warmed {sum(r['status'] == 'ok' for r in results)}/{len(results)} caches in {total * 1000:.1f}ms")
+        if any(result['status'] == 'failed' for result in results):
+            raise CommandError('Some caches could not be warmed')
@@ -0,0 +1,92 @@
+"""
+Precompiled menu snapshot.
+
+The whole public menu (active categories and available dishes) is
+serialized once into a single JSON document and kept in memory as encoded
+bytes plus a gzip variant. Each worker rebuilds its copy only when the
+shared catalog version (the ``menu`` cache tag) changes, so serving the
+menu costs one cache read and no database queries.
+
+Snapshots are per origin (absolute image URLs) and the ``Host`` header is
+client-controlled - ``ALLOWED_HOSTS`` ignores the port - so at most
+``MAX_ORIGINS`` are kept, the least recently built dropped first.
+"""
+from collections import OrderedDict
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+import gzip
+import hashlib
+import logging
+import threading
+import time
+
+from .models import Category, Dish
+from .utils import annotate_dish_counts, get_catalog_version
+
+logger = logging.getLogger('restaurant')
+
+
+class MenuSnapshot:
+    """One encoded version of the menu for one origin (scheme + host)"""
+
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"menu-{digest}"'
+        self.gzip_etag = f'"menu-{digest}-gz"'
+
+
+# أقصى عدد من الـ origins التي نحتفظ بنسختها في ذاكرة هذا الـ worker
+MAX_ORIGINS = 8
+
+_snapshots = OrderedDict()  # origin -> MenuSnapshot
+_lock = threading.Lock()
+
+
+def build_menu_document(request=None):
+    """Serialize the menu with the same serializers as the API endpoints"""
+    from .serializers import CategorySerializer, DishSerializer
+
+    context = {'request': request}
+    categories = annotate_dish_counts(Category.objects.filter(is_active=True)).order_by('name')
+    dishes = Dish.objects.filter(is_available=True).select_related('category').order_by('name')
+    return {
+        'generated_at': timezone.now(),
+        'categories': CategorySerializer(categories, many=True, context=context).data,
+        'dishes': DishSerializer(dishes, many=True, context=context).data,
+    }
+
+
+def get_menu_snapshot(request):
+    """Return the current snapshot for the request's origin, rebuilding it if stale"""
+    version = get_catalog_version()
+    origin = f'{request.scheme}://{request.get_host()}'
+
+    snapshot = _snapshots.get(origin)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _lock:
+        snapshot = _snapshots.get(origin)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        start = time.perf_counter()
+        document = {'version': version, **build_menu_document(request)}
+        snapshot = MenuSnapshot(version, JSONRenderer().render(document))
+        _snapshots.pop(origin, None)
+        _snapshots[origin] = snapshot
+        while len(_snapshots) > MAX_ORIGINS:
+            _snapshots.popitem(last=False)
+        logger.info(
+            f"Menu snapshot rebuilt for {origin}: version {version}, {len(snapshot.body)} bytes "
+            f"({len(snapshot.gzip_body)} gzipped) in {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+    return snapshot
+
+
+def clear_menu_snapshots():
+    with _lock:
+        _snapshots.clear()
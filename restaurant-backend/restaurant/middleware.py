@@ -1,11 +1,8 @@
-from django.contrib.sessions.models import Session
-from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import get_user_model
-from django.contrib.sessions.backends.db import SessionStore
 import re
 import logging
 
-User = get_user_model()
+from .identity import get_identity
+
 logger = logging.getLogger(__name__)
 
 class CSRFExemptMiddleware:
@@ -38,39 +35,18 @@ class SessionKeyMiddleware:
 
     def __call__(self, request):
         try:
-            # Check for session key in headers
-            session_key = request.headers.get('X-Session-Key')
-            
             # Make sure request.user exists (should be set by AuthenticationMiddleware)
             if not hasattr(request, 'user'):
                 logger.warning("No user attribute on request")
                 response = self.get_response(request)
                 return response
             
-            if session_key and not request.user.is_authenticated:
-                try:
-                    session = Session.objects.get(session_key=session_key)
-                    session_data = session.get_decoded()
-                    user_id = session_data.get('_auth_user_id')
-                    
-                    if user_id:
-                        try:
-                            user = User.objects.get(id=user_id)
-                            
-                            # Set user with authentication backend
-                            user.backend = 'django.contrib.auth.backends.ModelBackend'
-                            request.user = user
-                            
-                            # Properly restore the session
-                            request.session = SessionStore(session_key=session_key)
-                            request.session.load()
-                            
-                        except User.DoesNotExist:
-                            logger.warning(f"User with id {user_id} not found")
-                            pass
-                except Session.DoesNotExist:
-                    logger.warning(f"Session with key {session_key} not found")
-                    pass
+            # X-Session-Key أو الـ cookie - يُحل مرة واحدة ويُحفظ على الطلب
+            identity = get_identity(request)
+            if identity.source == 'header':
+                identity.user.backend = 'django.contrib.auth.backends.ModelBackend'
+                request.user = identity.user
+                request.session = identity.session
 
             response = self.get_response(request)
             
@@ -87,4 +63,4 @@ class SessionKeyMiddleware:
             traceback.print_exc()  # Print full traceback for debugging
             # If middleware fails, continue with normal flow
             response = self.get_response(request)
-            return response 
\ No newline at end of file
+            return response 
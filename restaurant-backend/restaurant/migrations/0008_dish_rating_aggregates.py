@@ -0,0 +1,46 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:43
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Dish = apps.get_model('restaurant', 'Dish')
+    DishRating = apps.get_model('restaurant', 'DishRating')
+    rows = DishRating.objects.values('dish_id').annotate(count=Count('id'), total=Sum('rating'))
+    for row in rows:
+        Dish.objects.filter(pk=row['dish_id']).update(
+            rating_count=row['count'],
+            rating_sum=row['total'],
+            average_rating=row['total'] / row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0007_customer_email_verification_code_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='average_rating',
+            field=models.FloatField(default=0, editable=False, verbose_name='Average Rating'),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Rating Count'),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Rating Sum'),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['average_rating'], name='restaurant__average_f4e462_idx'),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
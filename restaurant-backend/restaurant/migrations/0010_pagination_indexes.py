@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 04:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurant', '0009_catalog_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dishrating',
+            index=models.Index(fields=['dish', 'created_at'], name='restaurant__dish_id_a8a7ad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at'], name='restaurant__user_id_9af61d_idx'),
+        ),
+    ]
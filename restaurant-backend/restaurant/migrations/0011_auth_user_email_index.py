@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:12
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    auth_user.email is looked up on every login (customer_login by email,
+    admin_login) but the auth app does not index it.
+    """
+
+    dependencies = [
+        ('restaurant', '0010_pagination_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX IF NOT EXISTS restaurant_auth_user_email_idx ON auth_user (email);',
+            reverse_sql='DROP INDEX IF EXISTS restaurant_auth_user_email_idx;',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.1 on 2026-10-18 06:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('restaurant', '0011_auth_user_email_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Version')),
+            ],
+            options={
+                'verbose_name': 'Token Version',
+                'verbose_name_plural': 'Token Versions',
+            },
+        ),
+    ]
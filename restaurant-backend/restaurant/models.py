@@ -1,13 +1,23 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Q, Value, When
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.exceptions import ValidationError
+from decimal import Decimal
 import logging
 
+from .caching import invalidate_tags
+
 # إعداد الـ logger
 logger = logging.getLogger('restaurant')
 
+
+class _StockShortage(Exception):
+    """Rolls back a partial stock reservation"""
+
+
 # Admin Profile for managing admin users
 class AdminProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="User")
@@ -34,6 +44,7 @@ class Category(models.Model):
     image = models.ImageField(upload_to='categories/', blank=True, null=True, verbose_name="Category Image")
     is_active = models.BooleanField(default=True, verbose_name="Active")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Category"
@@ -75,6 +86,10 @@ class Dish(models.Model):
     calories = models.PositiveIntegerField(blank=True, null=True, verbose_name="Calories")
     is_spicy = models.BooleanField(default=False, verbose_name="Spicy")
     is_vegetarian = models.BooleanField(default=False, verbose_name="Vegetarian")
+    # تجميعات التقييم المخزنة - يتم تحديثها عند كل كتابة على DishRating
+    rating_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Rating Count")
+    rating_sum = models.PositiveIntegerField(default=0, editable=False, verbose_name="Rating Sum")
+    average_rating = models.FloatField(default=0, editable=False, verbose_name="Average Rating")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -89,6 +104,8 @@ class Dish(models.Model):
             models.Index(fields=['price']),
             models.Index(fields=['slug']),
             models.Index(fields=['stock_quantity']),
+            models.Index(fields=['average_rating']),
+            models.Index(fields=['updated_at']),
         ]
 
     def save(self, *args, **kwargs):
@@ -114,25 +131,99 @@ class Dish(models.Model):
         return self.stock_quantity > 0
 
     def reduce_stock(self, quantity):
-        """Reduce stock when order is placed"""
-        if self.stock_quantity >= quantity:
-            self.stock_quantity -= quantity
-            self.save()
+        """Reduce stock when order is placed (conditional UPDATE, see reserve_stock)"""
+        dishes = Dish.reserve_stock({self.pk: quantity})
+        if dishes is not None:
+            self.stock_quantity = dishes[self.pk].stock_quantity
+            self.updated_at = dishes[self.pk].updated_at
             logger.info(f"Stock reduced for {self.name}: {quantity} units")
             return True
         else:
+            self.refresh_from_db(fields=['stock_quantity'])
             logger.warning(f"Insufficient stock for {self.name}. Available: {self.stock_quantity}, Requested: {quantity}")
             return False
 
+    @classmethod
+    def reserve_stock(cls, quantities):
+        """
+        Take ``{dish_id: quantity}`` out of stock, all or nothing, with one
+        ``UPDATE ... SET stock_quantity = stock_quantity - n WHERE
+        stock_quantity >= n`` for every dish at once. The database checks and
+        decrements in the same statement, so concurrent orders cannot
+        oversell. Returns the dishes as they are after the update
+        (``{id: Dish}``), or None - nothing changed - if any dish is short.
+        """
+        from .signals import cache_tags_for
+
+        quantities = {dish_id: quantity for dish_id, quantity in quantities.items() if quantity}
+        if not quantities:
+            return {}
+
+        enough = Q()
+        for dish_id, quantity in quantities.items():
+            enough |= Q(pk=dish_id, stock_quantity__gte=quantity)
+        new_stock = Case(
+            *[When(pk=dish_id, then=F('stock_quantity') - quantity) for dish_id, quantity in quantities.items()],
+            output_field=models.PositiveIntegerField(),
+        )
+
+        try:
+            with transaction.atomic():
+                # updated_at يتغير كما في save(): الـ Last-Modified للكتالوج يعتمد عليه
+                updated = cls.objects.filter(enough).update(stock_quantity=new_stock, updated_at=timezone.now())
+                if updated != len(quantities):
+                    raise _StockShortage
+                # حالة الصفوف بعد التحديث داخل نفس الـ transaction
+                dishes = cls.objects.in_bulk(list(quantities))
+        except _StockShortage:
+            logger.warning(f"Insufficient stock, nothing reserved: {quantities}")
+            return None
+
+        # update() لا يرسل post_save - نبطل نفس الوسوم التي تبطلها الإشارات
+        tags = sorted({tag for dish in dishes.values() for tag in cache_tags_for(dish)})
+        transaction.on_commit(lambda: invalidate_tags(*tags))
+        return dishes
+
     def __str__(self):
         return f"{self.name} - ${self.price}"
 
-    @property
-    def average_rating(self):
-        ratings = self.dishrating_set.all()
-        if ratings:
-            return sum([r.rating for r in ratings]) / len(ratings)
-        return 0
+    @classmethod
+    def apply_rating_delta(cls, dish_id, count_delta, sum_delta):
+        """Atomically adjust the stored rating aggregates of a dish in one UPDATE"""
+        new_count = F('rating_count') + count_delta
+        new_sum = F('rating_sum') + sum_delta
+        return cls.objects.filter(pk=dish_id).update(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            average_rating=Case(
+                When(rating_count__lte=-count_delta, then=Value(0.0)),
+                default=ExpressionWrapper(new_sum * 1.0 / new_count, output_field=FloatField()),
+                output_field=FloatField(),
+            ),
+        )
+
+    @classmethod
+    def rebuild_rating_aggregates(cls, queryset=None):
+        """Recompute the stored rating aggregates from the DishRating table"""
+        from django.db.models import Count, OuterRef, Subquery, Sum
+        from django.db.models.functions import Coalesce
+
+        ratings = DishRating.objects.filter(dish=OuterRef('pk')).order_by().values('dish')
+        count_sq = Subquery(ratings.annotate(c=Count('id')).values('c'))
+        sum_sq = Subquery(ratings.annotate(s=Sum('rating')).values('s'))
+        queryset = cls.objects.all() if queryset is None else queryset
+        updated = queryset.update(
+            rating_count=Coalesce(count_sq, 0),
+            rating_sum=Coalesce(sum_sq, 0),
+        )
+        queryset.update(
+            average_rating=Case(
+                When(rating_count=0, then=Value(0.0)),
+                default=ExpressionWrapper(F('rating_sum') * 1.0 / F('rating_count'), output_field=FloatField()),
+                output_field=FloatField(),
+            )
+        )
+        return updated
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="User")
@@ -153,6 +244,18 @@ class Customer(models.Model):
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}"
 
+# نسخة رموز التجديد لكل مستخدم (restaurant/tokens.py) - زيادتها تبطل كل رموز التجديد الصادرة
+class TokenVersion(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, verbose_name="User")
+    version = models.PositiveIntegerField(default=0, verbose_name="Version")
+
+    class Meta:
+        verbose_name = "Token Version"
+        verbose_name_plural = "Token Versions"
+
+    def __str__(self):
+        return f"{self.user.username}: v{self.version}"
+
 class Order(models.Model):
     ORDER_STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -196,6 +299,35 @@ class Order(models.Model):
         logger.info(f"Order saved: #{self.id} - Customer: {self.customer} - Total: ${self.total_amount}")
         super().save(*args, **kwargs)
 
+    @classmethod
+    def create_with_items(cls, lines, total_amount=None, **fields):
+        """
+        Create an order and its items in one transaction: one INSERT for the
+        order and one bulk INSERT for the items, however many lines.
+        ``lines`` are ``(dish, quantity, special_instructions)``; every item
+        costs its dish's current price and the total is computed in memory
+        unless ``total_amount`` is given (an amount already paid).
+        """
+        from .signals import cache_tags_for
+
+        items = [
+            OrderItem(dish=dish, quantity=quantity, price=dish.price, special_instructions=special_instructions)
+            for dish, quantity, special_instructions in lines
+        ]
+        if total_amount is None:
+            total_amount = sum((item.total_price for item in items), Decimal('0'))
+
+        with transaction.atomic():
+            order = cls.objects.create(total_amount=total_amount, **fields)
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+            # bulk_create لا يرسل post_save - نبطل نفس الوسوم التي تبطلها الإشارات
+            tags = sorted({tag for item in items for tag in cache_tags_for(item)})
+            transaction.on_commit(lambda: invalidate_tags(*tags))
+
+        return order
+
     def __str__(self):
         return f"Order #{self.id} - {self.customer} - ${self.total_amount}"
 
@@ -231,10 +363,41 @@ class DishRating(models.Model):
         verbose_name = "Dish Rating"
         verbose_name_plural = "Dish Ratings"
         # Removed unique_together to allow multiple ratings from same customer
+        indexes = [
+            models.Index(fields=['dish', 'created_at']),
+        ]
 
     def __str__(self):
         return f"{self.dish.name} - {self.rating} stars"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # نحتفظ بالقيم المحملة لحساب الفرق عند التحديث
+        instance._loaded_dish_id = instance.__dict__.get('dish_id')
+        instance._loaded_rating = instance.__dict__.get('rating')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Save the rating and keep the dish aggregates in sync in the same transaction"""
+        adding = self._state.adding
+        old_dish_id = getattr(self, '_loaded_dish_id', None)
+        old_rating = getattr(self, '_loaded_rating', None)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            rating = int(self.rating)
+            if adding or old_dish_id is None or old_rating is None:
+                Dish.apply_rating_delta(self.dish_id, 1, rating)
+            elif old_dish_id != self.dish_id:
+                Dish.apply_rating_delta(old_dish_id, -1, -old_rating)
+                Dish.apply_rating_delta(self.dish_id, 1, rating)
+            elif old_rating != rating:
+                Dish.apply_rating_delta(self.dish_id, 0, rating - old_rating)
+
+        self._loaded_dish_id = self.dish_id
+        self._loaded_rating = rating
+
 class Restaurant(models.Model):
     name = models.CharField(max_length=100, verbose_name="Restaurant Name")
     address = models.TextField(verbose_name="Address")
@@ -245,6 +408,7 @@ class Restaurant(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="Active")
     description = models.TextField(blank=True, verbose_name="Description")
     logo = models.ImageField(upload_to='restaurant/', blank=True, null=True, verbose_name="Logo")
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Restaurant"
@@ -281,6 +445,7 @@ class Notification(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['user', 'is_read']),
+            models.Index(fields=['user', 'created_at']),
             models.Index(fields=['created_at']),
             models.Index(fields=['notification_type']),
         ]
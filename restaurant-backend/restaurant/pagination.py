@@ -0,0 +1,63 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.settings import api_settings
+
+
+class CursorOrPageNumberPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination for clients that ask for it, page numbers for
+    everyone else.
+
+    ``?pagination=cursor`` (or any request carrying ``?cursor=``) pages with
+    ``WHERE <ordering field> < last seen value`` on an indexed column, so the
+    cost of a page does not depend on how deep it is and no ``COUNT(*)`` is
+    issued. Requests without it keep the ``count/next/previous/results``
+    page-number responses that existing clients rely on.
+    """
+    page_size = api_settings.PAGE_SIZE
+    mode_query_param = 'pagination'
+
+    def use_cursor(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.page_number_pagination = None
+            return super().paginate_queryset(queryset, request, view)
+        self.page_number_pagination = PageNumberPagination()
+        return self.page_number_pagination.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.page_number_pagination is not None:
+            return self.page_number_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.page_number_pagination is not None:
+            return self.page_number_pagination.to_html()
+        return super().to_html()
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.mode_query_param,
+            'required': False,
+            'in': 'query',
+            'description': "Set to 'cursor' to use keyset pagination instead of page numbers.",
+            'schema': {'type': 'string', 'enum': ['cursor']},
+        })
+        return parameters + PageNumberPagination().get_schema_operation_parameters(view)
+
+
+class OrderPagination(CursorOrPageNumberPagination):
+    ordering = ('-order_date', '-id')
+
+
+class NotificationPagination(CursorOrPageNumberPagination):
+    ordering = ('-created_at', '-id')
+
+
+class DishRatingPagination(CursorOrPageNumberPagination):
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,118 @@
+"""
+Password verification off the request thread.
+
+PBKDF2 is deliberately slow, and Django's ``acheck_password`` still hashes
+on the event loop. ``acheck_user_password`` runs the hash in a pool of
+``LOGIN_HASH_PROCESSES`` worker processes, so a burst of logins uses those
+cores only while other requests keep being served. At most
+``LOGIN_MAX_PENDING`` verifications are in flight per server process
+(hashing or queued for a worker); past that ``LoginBusy`` is raised and
+the login views answer 429.
+
+With ``LOGIN_HASH_PROCESSES = 0`` the hash runs in a thread instead.
+"""
+from asgiref.sync import sync_to_async
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from django.conf import settings
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger('restaurant')
+
+_lock = threading.Lock()
+_in_flight = 0
+_pool = None
+
+
+class LoginBusy(Exception):
+    """Too many password verifications already in flight"""
+
+
+def _init_worker(settings_module):
+    # الـ hashers تحتاج الإعدادات فقط - لا django.setup() ولا اتصال بقاعدة البيانات
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+
+def _verify(password, encoded):
+    """``(is_correct, must_update)`` - runs in a worker process"""
+    from django.contrib.auth.hashers import verify_password
+    return verify_password(password, encoded)
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn وليس fork: الخادم فيه threads (event loop، warm-up)
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.LOGIN_HASH_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'project.settings'),),
+            )
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    """Stop the worker processes (tests, graceful shutdown)"""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+@contextmanager
+def _login_slot():
+    global _in_flight
+    with _lock:
+        if _in_flight >= settings.LOGIN_MAX_PENDING:
+            raise LoginBusy
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+
+async def _verify_in_pool(password, encoded):
+    pool = _get_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, _verify, password, encoded)
+    except BrokenProcessPool:
+        logger.exception("Password hashing pool broke, verifying in a thread")
+        _reset_pool(pool)
+        return await sync_to_async(_verify, thread_sensitive=False)(password, encoded)
+
+
+def _upgrade_hash(user, password):
+    # مثل AbstractBaseUser.check_password: تحديث الـ hash ليس تغييراً لكلمة المرور
+    user.set_password(password)
+    user._password = None
+    user.save(update_fields=['password'])
+
+
+async def acheck_user_password(user, password):
+    """``user.check_password(password)`` without hashing on the caller's thread; may raise ``LoginBusy``"""
+    with _login_slot():
+        if settings.LOGIN_HASH_PROCESSES:
+            is_correct, must_update = await _verify_in_pool(password, user.password)
+        else:
+            is_correct, must_update = await sync_to_async(_verify, thread_sensitive=False)(password, user.password)
+    if is_correct and must_update:
+        await sync_to_async(_upgrade_hash)(user, password)
+    return is_correct
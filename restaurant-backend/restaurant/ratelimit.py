@@ -0,0 +1,252 @@
+"""
+Sliding-window rate limiting for the auth, rating and checkout endpoints.
+
+Each scope has a rate in ``RATELIMIT_RATES`` (``'10/m'``, ``'5/10m'``,
+``'100/h'``...). Hits are counted per client - the IP address or the
+authenticated user - in fixed buckets of one window. The previous bucket
+is weighted by how much of it still overlaps the sliding window:
+
+    estimate = previous * (1 - elapsed / window) + current
+
+an approximation of the count in the last window (it assumes the previous
+bucket's hits were spread evenly) that stores only two counters per client.
+A burst at the end of one bucket can therefore let somewhat more than the
+rate through in a window that straddles two buckets. Rejected requests are
+counted too, so a client has to actually back off.
+
+The client address is ``REMOTE_ADDR``. ``X-Forwarded-For`` is only trusted
+for the ``NUM_PROXIES`` proxies configured in ``REST_FRAMEWORK`` (0 by
+default), otherwise a client could pick a new identity per request.
+
+Counters live in the ``RATELIMIT_BACKEND``:
+
+* ``LocalBackend`` - a dict in the memory of the current process
+  (development, a single worker);
+* ``CacheBackend`` - atomic ``incr`` on the ``RATELIMIT_CACHE`` cache,
+  shared by every worker (the default, on the SQLite cache).
+
+DRF views use the throttle classes, the plain Django views the
+``ratelimit`` decorator. ``RATELIMIT_ENABLED = False`` turns everything off.
+"""
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+from functools import lru_cache, wraps
+from rest_framework.throttling import BaseThrottle
+import logging
+import math
+import re
+import threading
+import time
+
+logger = logging.getLogger('restaurant')
+
+KEY_PREFIX = 'ratelimit:'
+
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_RATE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+
+@lru_cache(maxsize=64)
+def parse_rate(rate):
+    """``'5/10m'`` -> ``(5, 600)``"""
+    match = _RATE.match(rate.strip())
+    if match is None:
+        raise ValueError(f"Invalid rate: {rate!r}")
+    limit, multiplier, period = match.groups()
+    return int(limit), int(multiplier or 1) * _PERIODS[period]
+
+
+class LocalBackend:
+    """Counters in the memory of this process, shared by its threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}  # key -> (count, expires)
+        self._next_prune = 0.0
+
+    def _prune(self, now):
+        if now >= self._next_prune:
+            self._counters = {k: v for k, v in self._counters.items() if v[1] > now}
+            self._next_prune = now + 60
+
+    def incr(self, key, timeout):
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            count, expires = self._counters.get(key, (0, now + timeout))
+            if expires <= now:
+                count, expires = 0, now + timeout
+            self._counters[key] = (count + 1, expires)
+            return count + 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            count, expires = self._counters.get(key, (0, now))
+            return count if expires > now else 0
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class CacheBackend:
+    """Counters in a Django cache (``RATELIMIT_CACHE``), shared by all workers"""
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'RATELIMIT_CACHE', 'default')]
+
+    def incr(self, key, timeout):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # انتهت صلاحية المفتاح بين add و incr
+            self.cache.set(key, 1, timeout)
+            return 1
+
+    def get(self, key):
+        return self.cache.get(key) or 0
+
+    def reset(self):
+        pass  # المفاتيح تنتهي خلال نافذتين
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend():
+    path = getattr(settings, 'RATELIMIT_BACKEND', 'restaurant.ratelimit.CacheBackend')
+    backend = _backends.get(path)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(path)
+            if backend is None:
+                backend = _backends[path] = import_string(path)()
+    return backend
+
+
+def hit(scope, ident, rate=None):
+    """
+    Count one request of ``ident`` in ``scope``. Returns ``(allowed, wait)``,
+    ``wait`` being the seconds until a request would be allowed again.
+    """
+    if not getattr(settings, 'RATELIMIT_ENABLED', True):
+        return True, 0
+    limit, window = parse_rate(rate or settings.RATELIMIT_RATES[scope])
+    backend = get_backend()
+
+    now = time.time()
+    bucket, elapsed = divmod(now, window)
+    key = f'{KEY_PREFIX}{scope}:{ident}:'
+    current = backend.incr(f'{key}{int(bucket)}', window * 2)
+    previous = backend.get(f'{key}{int(bucket) - 1}')
+    weight = 1 - elapsed / window
+    if previous * weight + current <= limit:
+        return True, 0
+
+    if current <= limit and previous:
+        # ينخفض التقدير عندما ينزلق الجزء المتبقي من الـ bucket السابق خارج النافذة
+        wait = (1 - (limit - current) / previous) * window - elapsed
+    else:
+        wait = window - elapsed
+    logger.warning(f"Rate limit of {scope} exceeded by {ident}")
+    return False, max(math.ceil(wait), 1)
+
+
+def client_ip(request):
+    """Client address: ``REMOTE_ADDR``, or the address added by the last of ``NUM_PROXIES`` trusted proxies"""
+    return BaseThrottle().get_ident(getattr(request, '_request', request))
+
+
+def ip_key(request):
+    return f'ip:{client_ip(request)}'
+
+
+def user_or_ip(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return ip_key(request)
+
+
+# ===== DRF =====
+
+class SlidingWindowThrottle(BaseThrottle):
+    """Base for the DRF throttles: set ``scope`` (a ``RATELIMIT_RATES`` key)"""
+    scope = None
+
+    def get_ident_key(self, request):
+        return ip_key(request)
+
+    def allow_request(self, request, view):
+        allowed, self._wait = hit(self.scope, self.get_ident_key(request))
+        return allowed
+
+    def wait(self):
+        return getattr(self, '_wait', None)
+
+
+class IPThrottle(SlidingWindowThrottle):
+    """Per client address"""
+
+
+class UserThrottle(SlidingWindowThrottle):
+    """Per authenticated user, per address for anonymous requests"""
+
+    def get_ident_key(self, request):
+        return user_or_ip(request)
+
+
+class RegisterThrottle(IPThrottle):
+    scope = 'register'
+
+
+class VerificationThrottle(IPThrottle):
+    scope = 'verification'
+
+
+class RatingThrottle(UserThrottle):
+    scope = 'rating'
+
+
+class CheckoutThrottle(UserThrottle):
+    scope = 'checkout'
+
+
+# ===== Django views =====
+
+def _limited_response(wait):
+    response = JsonResponse({'error': 'Too many requests, please retry later'}, status=429)
+    response['Retry-After'] = str(wait)
+    return response
+
+
+def ratelimit(scope, key=ip_key):
+    """
+    Rate-limit a plain (sync or async) Django view. ``key(request)`` gives
+    the client identity, the address by default.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                allowed, wait = await sync_to_async(hit)(scope, key(request))
+                if not allowed:
+                    return _limited_response(wait)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            allowed, wait = hit(scope, key(request))
+            if not allowed:
+                return _limited_response(wait)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,75 @@
+"""
+Cached admin roster.
+
+Who may use the admin views (``AdminProfile`` emails, super admins) and who
+receives admin notifications (staff users) changes rarely but is checked on
+every admin request and every order. The roster is loaded with two queries,
+cached under the ``admins`` tag and served from the in-memory cache tier;
+signals in ``signals.py`` invalidate the tag when an AdminProfile changes or
+a staff/superuser account is saved or deleted.
+"""
+from django.contrib.auth.models import User
+from django.db.models import Q
+import logging
+
+from .caching import get_cached, get_tag_generations, set_cached
+
+logger = logging.getLogger('restaurant')
+
+ROSTER_KEY = 'admin_roster'
+ROSTER_TAG = 'admins'
+ROSTER_TIMEOUT = 60 * 60  # الإبطال بالإشارات - المدة حد أقصى فقط
+
+
+def _load_roster():
+    from .models import AdminProfile
+
+    profiles = list(AdminProfile.objects.values_list('user_id', 'admin_email', 'is_super_admin'))
+    users = list(User.objects.filter(Q(is_staff=True) | Q(is_superuser=True)).values_list('id', 'is_staff', 'is_superuser'))
+    logger.info(f"Admin roster loaded: {len(profiles)} admin profiles, {len(users)} staff users and superusers")
+    return {
+        'admin_emails': frozenset(email for _, email, _ in profiles),
+        'super_admin_user_ids': frozenset(user_id for user_id, _, is_super in profiles if is_super),
+        'staff_user_ids': sorted(user_id for user_id, is_staff, _ in users if is_staff),
+        'superuser_ids': frozenset(user_id for user_id, _, is_superuser in users if is_superuser),
+    }
+
+
+def get_admin_roster():
+    """
+    ``{'admin_emails', 'super_admin_user_ids', 'staff_user_ids',
+    'superuser_ids'}``. Not ``cached_computation``: a permission check must
+    never be answered from a roster that was already invalidated.
+    """
+    roster = get_cached(ROSTER_KEY)
+    if roster is None:
+        # الأجيال قبل القراءة: إبطال أثناء التحميل يترك النسخة المخزنة قديمة
+        generations = get_tag_generations([ROSTER_TAG])
+        roster = _load_roster()
+        set_cached(ROSTER_KEY, roster, ROSTER_TIMEOUT, generations=generations)
+    return roster
+
+
+def is_admin_email(email):
+    """Like ``AdminProfile.is_admin_email`` without the query"""
+    return bool(email) and email in get_admin_roster()['admin_emails']
+
+
+def is_restaurant_admin(user):
+    if user is None or not user.is_authenticated:
+        return False
+    return user.is_superuser or is_admin_email(user.email)
+
+
+def staff_user_ids():
+    """Ids of the users that receive admin notifications (``is_staff``)"""
+    return get_admin_roster()['staff_user_ids']
+
+
+def roster_affected_by(user):
+    """Whether saving or deleting ``user`` may change the roster"""
+    if user.is_staff or user.is_superuser:
+        return True
+    roster = get_cached(ROSTER_KEY)
+    # لا نعرف نسخة الـ workers الآخرين - الإبطال أسلم
+    return roster is None or user.pk in roster['staff_user_ids'] or user.pk in roster['superuser_ids']
@@ -0,0 +1,47 @@
+"""
+Cached OpenAPI schema.
+
+Generating the schema walks every view and serializer and takes far longer
+than any API request. It only changes with the code, so it is generated once
+per deploy (``warm_caches`` refreshes it) and served from the cache.
+"""
+from django.core.cache import cache
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.views import SpectacularAPIView
+from rest_framework.response import Response
+import logging
+import time
+
+logger = logging.getLogger('restaurant')
+
+SCHEMA_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def schema_cache_key(version=None):
+    return f'openapi_schema:{spectacular_settings.VERSION}:{version or ""}'
+
+
+def get_openapi_schema(request=None, version=None, refresh=False):
+    """The public OpenAPI schema, generated on a miss or when ``refresh`` is set"""
+    key = schema_cache_key(version)
+    schema = None if refresh else cache.get(key)
+    if schema is None:
+        start = time.perf_counter()
+        generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(api_version=version)
+        schema = generator.get_schema(request=request, public=True)
+        cache.set(key, schema, SCHEMA_CACHE_TIMEOUT)
+        logger.info(f"OpenAPI schema generated in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return schema
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """``SpectacularAPIView`` serving the cached schema"""
+
+    def _get_schema_response(self, request):
+        if self.urlconf is not None or self.patterns is not None or not self.serve_public:
+            return super()._get_schema_response(request)
+        version = self.api_version or request.version or self._get_version_parameter(request)
+        return Response(
+            data=get_openapi_schema(request, version),
+            headers={"Content-Disposition": f'inline; filename="{self._get_filename(request, version)}"'}
+        )
@@ -0,0 +1,345 @@
+"""
+Full-text search for dishes.
+
+On SQLite the dishes are indexed in an external-content FTS5 table that is
+kept in sync with ``restaurant_dish`` by triggers, so every insert, update and
+delete (including bulk ``update()``/``delete()`` calls) reaches the index.
+Other database backends fall back to ``icontains`` matching.
+
+Typo-tolerant (``fuzzy``) search uses an in-process trigram index over dish
+names and ingredients, see ``TrigramIndex``. Each worker builds its index
+at startup (``warmup.py``) and rebuilds it whenever the shared catalog
+version (the ``menu`` cache tag) moved on, so dishes added or renamed
+through any worker are found by all of them.
+"""
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, FloatField, Q, Value, When
+import heapq
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger('restaurant')
+
+FTS_TABLE = 'restaurant_dish_fts'
+DISH_TABLE = 'restaurant_dish'
+
+# أوزان BM25 للأعمدة: name, description, ingredients
+BM25_WEIGHTS = (10.0, 1.0, 3.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, ingredients,
+        content='{DISH_TABLE}', content_rowid='id',
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {DISH_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, ingredients)
+        VALUES (new.id, new.name, new.description, new.ingredients);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {DISH_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, ingredients)
+        VALUES ('delete', old.id, old.name, old.description, old.ingredients);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description, ingredients ON {DISH_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, ingredients)
+        VALUES ('delete', old.id, old.name, old.description, old.ingredients);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, ingredients)
+        VALUES (new.id, new.name, new.description, new.ingredients);
+    END
+    """,
+]
+
+# alias -> bool (هل جدول FTS متاح على هذا الاتصال)
+_fts_available = {}
+
+
+def ensure_dish_search_index(using='default'):
+    """
+    Create the FTS5 table and its triggers if they are missing.
+
+    SQLite migrations that remake ``restaurant_dish`` drop its triggers, so
+    this runs after every ``migrate`` and rebuilds the index whenever any
+    piece had to be (re)created.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND tbl_name = %s)",
+            [FTS_TABLE, DISH_TABLE],
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        expected = {FTS_TABLE, f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au'}
+        if expected <= existing:
+            _fts_available[using] = True
+            return False
+
+        try:
+            for statement in _FTS_SCHEMA:
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        except Exception as e:
+            # SQLite مبني بدون FTS5 - نستخدم icontains
+            logger.warning(f"FTS5 dish search index unavailable: {e}")
+            _fts_available[using] = False
+            return False
+
+    _fts_available[using] = True
+    logger.info("Dish full-text search index rebuilt")
+    return True
+
+
+def is_fts_available(using='default'):
+    if using not in _fts_available:
+        connection = connections[using]
+        available = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+                available = cursor.fetchone() is not None
+        _fts_available[using] = available
+    return _fts_available[using]
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression: every word must match,
+    and each word is treated as a prefix (``"marg"* AND "pizz"*``).
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    return ' AND '.join(f'"{token}"*' for token in tokens)
+
+
+def search_dishes(queryset, text):
+    """
+    Filter a Dish queryset by free text.
+
+    With FTS5 the queryset is joined to the index and annotated with a
+    ``search_rank`` column (BM25, lower is better); otherwise it falls back
+    to ``icontains`` over name, description and ingredients.
+    """
+    match = build_match_query(text)
+    if match and is_fts_available(queryset.db):
+        weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+        return queryset.extra(
+            select={'search_rank': f'bm25({FTS_TABLE}, {weights})'},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE} MATCH %s', f'{FTS_TABLE}.rowid = {DISH_TABLE}.id'],
+            params=[match],
+        )
+
+    return queryset.filter(
+        Q(name__icontains=text) |
+        Q(description__icontains=text) |
+        Q(ingredients__icontains=text)
+    )
+
+
+def is_search_ranked(queryset):
+    """Whether the queryset carries a ``search_rank`` column to order by"""
+    return 'search_rank' in queryset.query.extra_select or 'search_rank' in queryset.query.annotations
+
+
+# ===== FUZZY (TRIGRAM) SEARCH =====
+
+def normalize_text(text):
+    """Lowercase and strip accents so that "crème" and "creme" share trigrams"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def word_trigrams(word):
+    """Trigrams of one word, padded like pg_trgm ("  w", " wo", ..., "rd ")"""
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def text_words(text):
+    return _TOKEN_RE.findall(normalize_text(text or ''))
+
+
+def similarity(a, b):
+    """Jaccard similarity of two trigram sets"""
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared) if shared else 0.0
+
+
+class TrigramIndex:
+    """
+    In-memory trigram index over dish names and ingredients.
+
+    Postings map every trigram to the ids of the dishes containing it, so a
+    query only touches the dishes sharing at least one trigram with it. The
+    best candidates are then scored word by word: each query word takes its
+    best similarity against any indexed word (ingredients weigh less than the
+    name) and the dish score is the mean over query words.
+    """
+
+    FIELD_WEIGHTS = {'name': 1.0, 'ingredients': 0.8}
+
+    def __init__(self, max_candidates=200):
+        self.max_candidates = max_candidates
+        self._postings = defaultdict(set)
+        self._documents = {}  # dish_id -> [(weight, trigram set), ...]
+        self._lock = threading.RLock()
+        self.built = False
+        self.version = None  # نسخة الكتالوج التي بُني منها الفهرس
+
+    def __len__(self):
+        return len(self._documents)
+
+    def _document(self, name, ingredients):
+        words = {}
+        for field, text in (('name', name), ('ingredients', ingredients)):
+            weight = self.FIELD_WEIGHTS[field]
+            for word in text_words(text):
+                tris = word_trigrams(word)
+                words[tris] = max(weight, words.get(tris, 0))
+        return [(weight, tris) for tris, weight in words.items()]
+
+    def build(self, rows, version=None):
+        """Replace the index content with ``rows`` of (id, name, ingredients) read at catalog ``version``"""
+        postings = defaultdict(set)
+        documents = {}
+        for dish_id, name, ingredients in rows:
+            document = self._document(name, ingredients)
+            documents[dish_id] = document
+            for _, tris in document:
+                for tri in tris:
+                    postings[tri].add(dish_id)
+        with self._lock:
+            self._postings = postings
+            self._documents = documents
+            self.version = version
+            self.built = True
+
+    def remove(self, dish_id):
+        with self._lock:
+            document = self._documents.pop(dish_id, None)
+            if not document:
+                return
+            for _, tris in document:
+                for tri in tris:
+                    ids = self._postings.get(tri)
+                    if ids is not None:
+                        ids.discard(dish_id)
+                        if not ids:
+                            del self._postings[tri]
+
+    def upsert(self, dish_id, name, ingredients):
+        document = self._document(name, ingredients)
+        with self._lock:
+            self.remove(dish_id)
+            self._documents[dish_id] = document
+            for _, tris in document:
+                for tri in tris:
+                    self._postings[tri].add(dish_id)
+
+    def search(self, text, limit=50, min_similarity=0.3, budget_ms=50):
+        """
+        Return ``[(dish_id, score), ...]`` best first.
+
+        Work stops once ``budget_ms`` is spent and the best matches found so
+        far are returned, so a pathological query cannot stall a worker.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000
+        query = [word_trigrams(word) for word in text_words(text)]
+        if not query:
+            return []
+
+        with self._lock:
+            shared = Counter()
+            for tri in set().union(*query):
+                shared.update(self._postings.get(tri, ()))
+                if time.perf_counter() > deadline:
+                    break
+
+            candidates = heapq.nlargest(self.max_candidates, shared, key=shared.__getitem__)
+            results = []
+            for dish_id in candidates:
+                document = self._documents.get(dish_id)
+                if not document:
+                    continue
+                score = sum(
+                    max(weight * similarity(q, tris) for weight, tris in document)
+                    for q in query
+                ) / len(query)
+                if score >= min_similarity:
+                    results.append((dish_id, score))
+                if time.perf_counter() > deadline:
+                    break
+
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:limit]
+
+
+_dish_trigram_index = TrigramIndex()
+_dish_trigram_lock = threading.Lock()
+
+
+def get_dish_trigram_index():
+    """The process-wide trigram index, (re)built when the catalog version changed"""
+    from .utils import get_catalog_version
+
+    # النسخة قبل القراءة: تعديل أثناء البناء يفرض إعادة بناء أخرى
+    version = get_catalog_version()
+    index = _dish_trigram_index
+    if not index.built or index.version != version:
+        with _dish_trigram_lock:
+            if not index.built or index.version != version:
+                from .models import Dish
+                start = time.perf_counter()
+                index.build(Dish.objects.order_by().values_list('id', 'name', 'ingredients').iterator(), version)
+                logger.info(
+                    f"Dish trigram index built: {len(index)} dishes at catalog version {version} in "
+                    f"{(time.perf_counter() - start) * 1000:.1f}ms"
+                )
+    return index
+
+
+def reset_dish_trigram_index():
+    """Drop the index content; it is rebuilt from the database on next use"""
+    with _dish_trigram_lock:
+        _dish_trigram_index.build([])
+        _dish_trigram_index.built = False
+
+
+def fuzzy_search_dishes(queryset, text):
+    """
+    Filter a Dish queryset by trigram similarity to ``text``.
+
+    The matching ids come from the in-memory index; the database only sees a
+    primary key lookup, annotated with ``search_rank`` (negated similarity, so
+    that ascending order puts the best match first like BM25).
+    """
+    matches = get_dish_trigram_index().search(
+        text,
+        limit=getattr(settings, 'FUZZY_SEARCH_MAX_RESULTS', 50),
+        min_similarity=getattr(settings, 'FUZZY_SEARCH_MIN_SIMILARITY', 0.3),
+        budget_ms=getattr(settings, 'FUZZY_SEARCH_BUDGET_MS', 50),
+    )
+    if not matches:
+        return queryset.none()
+
+    return queryset.filter(pk__in=[dish_id for dish_id, _ in matches]).annotate(
+        search_rank=Case(
+            *[When(pk=dish_id, then=Value(-score)) for dish_id, score in matches],
+            output_field=FloatField(),
+        )
+    )
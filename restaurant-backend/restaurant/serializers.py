@@ -1,10 +1,15 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from .models import (
     Category, Dish, Customer, Order, OrderItem, 
     DishRating, Restaurant, AdminProfile, Notification, OrderAnalytics
 )
+from .sparse import SparseFieldsetMixin
+from .utils import get_category_dish_counts, send_stock_alert
+from functools import partial
 import logging
 
 logger = logging.getLogger('restaurant')
@@ -21,7 +26,7 @@ class AdminProfileSerializer(serializers.ModelSerializer):
         model = AdminProfile
         fields = ['id', 'user', 'admin_email', 'is_super_admin', 'created_at']
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     dishes_count = serializers.SerializerMethodField()
     available_dishes_count = serializers.SerializerMethodField()
     
@@ -31,31 +36,33 @@ class CategorySerializer(serializers.ModelSerializer):
             'id', 'name', 'slug', 'description', 'image', 'is_active', 
             'created_at', 'dishes_count', 'available_dishes_count'
         ]
+        sparse_field_sources = {'dishes_count': (), 'available_dishes_count': ()}
     
     def get_dishes_count(self, obj):
-        # استخدام cache للأداء
-        cache_key = f'category_dishes_count_{obj.id}'
-        count = cache.get(cache_key)
-        if count is None:
-            count = obj.dish_set.count()
-            cache.set(cache_key, count, 300)  # 5 minutes
-        return count
+        return self._get_dish_counts(obj)[0]
     
     def get_available_dishes_count(self, obj):
-        cache_key = f'category_available_dishes_count_{obj.id}'
-        count = cache.get(cache_key)
-        if count is None:
-            count = obj.dish_set.filter(is_available=True).count()
-            cache.set(cache_key, count, 300)  # 5 minutes
-        return count
+        return self._get_dish_counts(obj)[1]
+    
+    def _get_dish_counts(self, obj):
+        # القيم المضافة عبر annotate_dish_counts لا تحتاج أي استعلام إضافي
+        if hasattr(obj, 'dishes_count') and hasattr(obj, 'available_dishes_count'):
+            return obj.dishes_count, obj.available_dishes_count
+        # الاستخدام المتداخل (داخل DishSerializer): استعلام مجمع واحد لكل الطلب
+        # يُحفظ في الـ context المشترك بين كل الـ serializers الخاصة بنفس الطلب
+        counts = self.context.get('category_dish_counts')
+        if counts is None:
+            counts = get_category_dish_counts()
+            self.context['category_dish_counts'] = counts
+        return counts.get(obj.id, (0, 0))
 
-class DishSerializer(serializers.ModelSerializer):
+class DishSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(), source='category', write_only=True
     )
     average_rating = serializers.ReadOnlyField()
-    rating_count = serializers.SerializerMethodField()
+    rating_count = serializers.ReadOnlyField()
     is_in_stock = serializers.ReadOnlyField()
     is_low_stock = serializers.ReadOnlyField()
     image = serializers.ImageField(max_length=None, use_url=True, required=False)
@@ -70,18 +77,17 @@ class DishSerializer(serializers.ModelSerializer):
             'is_in_stock', 'is_low_stock', 'created_at', 'updated_at'
         ]
         read_only_fields = ('slug',)
+        expandable_fields = ('category',)
+        sparse_field_sources = {
+            'is_in_stock': ('stock_quantity',),
+            'is_low_stock': ('stock_quantity', 'low_stock_threshold'),
+        }
     
-    def get_rating_count(self, obj):
-        cache_key = f'dish_ratings_count_{obj.id}'
-        count = cache.get(cache_key)
-        if count is None:
-            count = obj.dishrating_set.count()
-            cache.set(cache_key, count, 300)  # 5 minutes
-        return count
-
     def to_representation(self, instance):
         """Convert `image` to a full URL."""
         representation = super().to_representation(instance)
+        if 'image' not in representation:
+            return representation
         if instance.image:
             request = self.context.get('request')
             if request:
@@ -132,8 +138,9 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['id', 'dish', 'dish_id', 'quantity', 'price', 'special_instructions', 'total_price']
+        read_only_fields = ['price']  # سعر الطبق وقت الطلب - لا يحدده العميل
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
     items = OrderItemSerializer(source='orderitem_set', many=True, read_only=True)
     
@@ -144,8 +151,15 @@ class OrderSerializer(serializers.ModelSerializer):
             'total_amount', 'delivery_address', 'special_instructions',
             'estimated_delivery_time', 'actual_delivery_time', 'items'
         ]
+        expandable_fields = ('customer', 'items')
+        sparse_field_sources = {'items': ()}
 
 class OrderCreateSerializer(serializers.ModelSerializer):
+    """
+    Order creation with a constant number of queries: every dish is fetched
+    by one in_bulk during validation and reused by create(), which writes the
+    order and all its items in one transaction (Order.create_with_items).
+    """
     items = OrderItemSerializer(many=True)
     
     class Meta:
@@ -154,20 +168,56 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             'delivery_address', 'special_instructions', 'items'
         ]
     
+    def validate_items(self, value):
+        if not value:
+            raise serializers.ValidationError("Order must contain at least one item")
+        
+        # كل الأطباق في استعلام واحد (مع فئاتها لاستجابة الطلب)
+        dishes = Dish.objects.select_related('category').in_bulk({item_data['dish_id'] for item_data in value})
+        quantities = {}
+        for item_data in value:
+            quantities[item_data['dish_id']] = quantities.get(item_data['dish_id'], 0) + item_data.get('quantity', 1)
+        
+        for dish_id, quantity in quantities.items():
+            dish = dishes.get(dish_id)
+            if dish is None:
+                raise serializers.ValidationError(f"Dish with id {dish_id} does not exist")
+            if not dish.is_available:
+                raise serializers.ValidationError(f"Dish '{dish.name}' is not available")
+            if not dish.is_in_stock:
+                raise serializers.ValidationError(f"Dish '{dish.name}' is out of stock")
+            if dish.stock_quantity < quantity:
+                raise serializers.ValidationError(
+                    f"Insufficient stock for '{dish.name}'. Available: {dish.stock_quantity}"
+                )
+        
+        self._dishes = dishes
+        return value
+    
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        
-        total_amount = 0
-        for item_data in items_data:
-            dish = Dish.objects.get(id=item_data['dish_id'])
-            item_data['price'] = dish.price
-            order_item = OrderItem.objects.create(order=order, **item_data)
-            total_amount += order_item.total_price
+        dishes = getattr(self, '_dishes', None)
+        if dishes is None:
+            dishes = self._dishes = Dish.objects.select_related('category').in_bulk(
+                {item_data['dish_id'] for item_data in items_data}
+            )
         
-        order.total_amount = total_amount
-        order.save()
+        order = Order.create_with_items(
+            [
+                (dishes[item_data['dish_id']], item_data.get('quantity', 1), item_data.get('special_instructions', ''))
+                for item_data in items_data
+            ],
+            **validated_data
+        )
+        logger.info(f"Order created successfully: #{order.id} - Total: ${order.total_amount}")
         return order
+    
+    def to_representation(self, instance):
+        # الاستجابة هي الطلب المنشأ كاملاً (رقم الطلب والمجموع والعناصر) - العناصر بأطباقها في استعلام واحد
+        prefetch_related_objects(
+            [instance], Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('dish__category'))
+        )
+        return OrderSerializer(instance, context=self.context).data
 
 class DishRatingSerializer(serializers.ModelSerializer):
     customer = CustomerSerializer(read_only=True)
@@ -207,55 +257,30 @@ class OrderAnalyticsSerializer(serializers.ModelSerializer):
             'popular_dishes', 'avg_order_value'
         ]
 
-# تحسين OrderCreateSerializer مع validation
-class EnhancedOrderCreateSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True)
-    
-    class Meta:
-        model = Order
-        fields = [
-            'delivery_address', 'special_instructions', 'items'
-        ]
-    
-    def validate_items(self, value):
-        if not value:
-            raise serializers.ValidationError("Order must contain at least one item")
-        
-        for item_data in value:
-            dish_id = item_data.get('dish_id')
-            quantity = item_data.get('quantity', 0)
-            
-            try:
-                dish = Dish.objects.get(id=dish_id)
-                if not dish.is_available:
-                    raise serializers.ValidationError(f"Dish '{dish.name}' is not available")
-                if not dish.is_in_stock:
-                    raise serializers.ValidationError(f"Dish '{dish.name}' is out of stock")
-                if dish.stock_quantity < quantity:
-                    raise serializers.ValidationError(
-                        f"Insufficient stock for '{dish.name}'. Available: {dish.stock_quantity}"
-                    )
-            except Dish.DoesNotExist:
-                raise serializers.ValidationError(f"Dish with id {dish_id} does not exist")
-        
-        return value
+# تحسين OrderCreateSerializer مع تقليل المخزون
+class EnhancedOrderCreateSerializer(OrderCreateSerializer):
+    """
+    Also takes the ordered quantities out of stock: one conditional UPDATE
+    for all dishes (Dish.reserve_stock) in the order's transaction, so
+    concurrent checkouts cannot oversell. Dishes that drop to their low-stock
+    threshold alert the admins once the order is committed.
+    """
     
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        
-        total_amount = 0
-        for item_data in items_data:
-            dish = Dish.objects.get(id=item_data['dish_id'])
-            item_data['price'] = dish.price
-            order_item = OrderItem.objects.create(order=order, **item_data)
-            total_amount += order_item.total_price
-            
-            # تقليل المخزون
-            dish.reduce_stock(item_data['quantity'])
+        quantities = {}
+        for item_data in validated_data['items']:
+            quantities[item_data['dish_id']] = quantities.get(item_data['dish_id'], 0) + item_data.get('quantity', 1)
         
-        order.total_amount = total_amount
-        order.save()
+        with transaction.atomic():
+            # المخزون قد يتغير بين validation والحفظ - القرار النهائي للـ UPDATE الشرطي
+            dishes = Dish.reserve_stock(quantities)
+            if dishes is None:
+                raise serializers.ValidationError({'items': ["Insufficient stock for one or more dishes"]})
+            order = super().create(validated_data)
         
-        logger.info(f"Order created successfully: #{order.id} - Total: ${total_amount}")
+        for dish_id, quantity in quantities.items():
+            dish = dishes[dish_id]
+            # تنبيه واحد عند عبور الحد وليس مع كل طلب بعده
+            if dish.is_low_stock and dish.stock_quantity + quantity > dish.low_stock_threshold:
+                transaction.on_commit(partial(send_stock_alert, dish))
         return order 
\ No newline at end of file
@@ -0,0 +1,210 @@
+"""
+Database session engine with coalesced writes.
+
+With ``SESSION_SAVE_EVERY_REQUEST`` Django's ``SessionMiddleware`` saves the
+session after every response, which on the stock database engine is an
+UPDATE of ``django_session`` - every catalog read then waits for the SQLite
+write lock. This engine only writes what changed:
+
+* session data is written when it was modified (login, cart, logout...);
+* otherwise only the expiry may move. It is extended lazily, once less than
+  ``SESSION_REFRESH_FRACTION`` of the lifetime remains, and the bumps are
+  queued and written together - one UPDATE per
+  ``SESSION_EXPIRY_FLUSH_INTERVAL`` seconds (a timer thread flushes the
+  queue that long after the first queued bump, even if no other request
+  comes) or ``SESSION_EXPIRY_BATCH_SIZE`` sessions, whichever comes first.
+
+Read-only requests on a session with enough lifetime left therefore write
+nothing. The expiry dates seen by this process are remembered, so most of
+those requests do not even read the session row.
+
+Because the expiry only moves in the last stretch, the idle timeout is no
+longer exactly ``SESSION_COOKIE_AGE``: a session left alone expires between
+``SESSION_REFRESH_FRACTION * SESSION_COOKIE_AGE`` and ``SESSION_COOKIE_AGE``
+after the last request (the cookie itself is still re-issued with the full
+age). A queued bump that is lost - the worker is killed before the flush -
+leaves the session at its previous expiry, which by then is less than the
+refresh fraction of the lifetime away.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.sessions.backends import db
+from django.db import connections
+from django.utils import timezone
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger('restaurant')
+
+# أقصى عدد من الجلسات التي نتذكر تاريخ انتهائها في ذاكرة هذا الـ worker
+KNOWN_EXPIRY_MAX_ENTRIES = 10000
+
+_lock = threading.Lock()
+_known_expiry = OrderedDict()  # session_key -> (expire_date, expiry_age)
+_pending_bumps = {}  # session_key -> expiry_age
+_last_flush = 0.0
+_timer = None
+
+
+def _remember(session_key, expire_date, age):
+    with _lock:
+        _known_expiry[session_key] = (expire_date, age)
+        _known_expiry.move_to_end(session_key)
+        while len(_known_expiry) > KNOWN_EXPIRY_MAX_ENTRIES:
+            _known_expiry.popitem(last=False)
+
+
+def _forget(session_key):
+    with _lock:
+        _known_expiry.pop(session_key, None)
+        _pending_bumps.pop(session_key, None)
+
+
+def _flush_due():
+    return (
+        len(_pending_bumps) >= settings.SESSION_EXPIRY_BATCH_SIZE
+        or time.monotonic() - _last_flush >= settings.SESSION_EXPIRY_FLUSH_INTERVAL
+    )
+
+
+def _schedule_flush():
+    """Start the flush timer unless one is pending (called with ``_lock`` held)"""
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(settings.SESSION_EXPIRY_FLUSH_INTERVAL, _flush_from_timer)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _flush_from_timer():
+    global _timer
+    with _lock:
+        _timer = None
+    try:
+        flush_expiry_bumps()
+    except Exception:
+        logger.exception("Could not write the queued session expiry bumps")
+    finally:
+        # اتصالات قاعدة البيانات خاصة بهذا الـ thread
+        connections.close_all()
+
+
+def flush_expiry_bumps():
+    """Write the queued expiry extensions; returns the number of sessions"""
+    global _last_flush
+    with _lock:
+        pending = dict(_pending_bumps)
+        _pending_bumps.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return 0
+
+    # جلسات بنفس العمر تحصل على نفس التاريخ - UPDATE واحد لكل مجموعة
+    by_age = {}
+    for session_key, age in pending.items():
+        by_age.setdefault(age, []).append(session_key)
+
+    model = SessionStore.get_model_class()
+    now = timezone.now()
+    for age, keys in by_age.items():
+        expire_date = now + timedelta(seconds=age)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            # الجلسات المحذوفة في هذه الأثناء لا تعود (UPDATE فقط)
+            model.objects.filter(session_key__in=batch, expire_date__gt=now).update(expire_date=expire_date)
+        for session_key in keys:
+            _remember(session_key, expire_date, age)
+    logger.debug(f"Extended the expiry of {len(pending)} sessions")
+    return len(pending)
+
+
+def pending_expiry_bumps():
+    with _lock:
+        return len(_pending_bumps)
+
+
+def reset_expiry_tracking():
+    """Forget remembered expiries, drop queued bumps and the flush timer (tests)"""
+    global _last_flush, _timer
+    with _lock:
+        _known_expiry.clear()
+        _pending_bumps.clear()
+        _last_flush = 0.0
+        if _timer is not None:
+            _timer.cancel()
+            _timer = None
+
+
+def _flush_at_exit():
+    try:
+        flush_expiry_bumps()
+    except Exception:
+        logger.exception("Could not write the queued session expiry bumps")
+
+
+atexit.register(_flush_at_exit)
+
+
+class SessionStore(db.SessionStore):
+    """``db.SessionStore`` that skips writes of unmodified sessions"""
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        # تاريخ انتهاء الصف كما قرأناه - identity.py يستخدمه بدل استعلام آخر
+        self.expire_date = None
+
+    def _get_session_from_db(self):
+        s = super()._get_session_from_db()
+        if s is not None:
+            self.expire_date = s.expire_date
+        return s
+
+    def load(self):
+        data = super().load()
+        if self.expire_date is not None and self.session_key:
+            _remember(self.session_key, self.expire_date, self.get_expiry_age(expiry=data.get('_session_expiry')))
+        return data
+
+    def save(self, must_create=False):
+        if must_create or self.modified or self.session_key is None:
+            super().save(must_create=must_create)
+            if self.session_key:
+                self.expire_date = self.get_expiry_date()
+                _remember(self.session_key, self.expire_date, self.get_expiry_age())
+                with _lock:
+                    _pending_bumps.pop(self.session_key, None)
+            return
+        self._touch()
+
+    def _touch(self):
+        """Queue an expiry extension if the session is in its last stretch"""
+        session_key = self.session_key
+        with _lock:
+            known = _known_expiry.get(session_key)
+        if known is None:
+            # أول مرة نرى هذه الجلسة في هذا الـ worker - قراءة واحدة للصف
+            self._get_session()
+            session_key = self.session_key
+            if not session_key or self.expire_date is None:
+                return
+            with _lock:
+                known = _known_expiry.get(session_key)
+            if known is None:
+                return
+
+        expire_date, age = known
+        remaining = (expire_date - timezone.now()).total_seconds()
+        with _lock:
+            if 0 < remaining < age * settings.SESSION_REFRESH_FRACTION:
+                _pending_bumps[session_key] = age
+                _schedule_flush()
+            due = bool(_pending_bumps) and _flush_due()
+        if due:
+            flush_expiry_bumps()
+
+    def delete(self, session_key=None):
+        _forget(session_key or self.session_key)
+        super().delete(session_key)
@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import invalidate_tags
+from .identity import forget_session, get_identity
+from .models import AdminProfile, Category, Customer, Dish, DishRating, Order, OrderItem, Restaurant
+from .roster import ROSTER_TAG, roster_affected_by
+from .search import ensure_dish_search_index
+
+
+@receiver(post_delete, sender=DishRating)
+def remove_rating_from_aggregates(sender, instance, **kwargs):
+    """إزالة التقييم المحذوف من تجميعات الطبق (يشمل الحذف المتتالي)"""
+    # Collector.delete يرسل الإشارة داخل نفس الـ transaction الخاصة بالحذف
+    Dish.apply_rating_delta(instance.dish_id, -1, -int(instance.rating))
+
+
+def cache_tags_for(instance):
+    """وسوم الـ cache التي يبطلها تعديل هذا الكائن"""
+    if isinstance(instance, Dish):
+        return ['menu', f'dish:{instance.pk}', f'category:{instance.category_id}']
+    if isinstance(instance, Category):
+        return ['menu', f'category:{instance.pk}']
+    if isinstance(instance, DishRating):
+        return ['menu', f'dish:{instance.dish_id}', f'ratings:{instance.dish_id}']
+    if isinstance(instance, OrderItem):
+        return ['order_items', f'dish:{instance.dish_id}']
+    if isinstance(instance, Order):
+        return ['orders']
+    return ['menu']
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_delete, sender=Dish)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=DishRating)
+@receiver(post_delete, sender=DishRating)
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_cache_tags(sender, instance, **kwargs):
+    """
+    إبطال وسوم الـ cache بعد تأكيد الـ transaction. وسم menu هو نسخة الكتالوج
+    (snapshot القائمة و ETag الاستجابات).
+    """
+    tags = cache_tags_for(instance)
+    transaction.on_commit(lambda: invalidate_tags(*tags))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+@receiver(post_save, sender=AdminProfile)
+@receiver(post_delete, sender=AdminProfile)
+def invalidate_session_principals(sender, instance, update_fields=None, **kwargs):
+    """إبطال مستخدم الجلسات المخزن (تغيير كلمة المرور أو الصلاحيات أو الملفات)"""
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return  # كل تسجيل دخول يحدث last_login - لا يغير شيئاً في الجلسات
+    user_id = instance.pk if isinstance(instance, User) else instance.user_id
+    transaction.on_commit(lambda: invalidate_tags(f'user:{user_id}'))
+
+
+@receiver(post_save, sender=AdminProfile)
+@receiver(post_delete, sender=AdminProfile)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_admin_roster(sender, instance, update_fields=None, **kwargs):
+    """إبطال قائمة المدراء المخزنة عند تغيير ملف مدير أو حساب staff/superuser"""
+    if isinstance(instance, User):
+        if update_fields is not None and set(update_fields) == {'last_login'}:
+            return
+        if not roster_affected_by(instance):
+            return  # تسجيل عميل جديد لا يغير القائمة
+    transaction.on_commit(lambda: invalidate_tags(ROSTER_TAG))
+
+
+@receiver(user_logged_out)
+def forget_logged_out_session(sender, request, user, **kwargs):
+    """حذف مستخدم الجلسة المخزن عند تسجيل الخروج (قبل حذف الجلسة نفسها)"""
+    forget_session(get_identity(request).session_key)
+    session = getattr(request, 'session', None)
+    if session is not None:
+        forget_session(session.session_key)
+
+
+def ensure_search_index(sender, using='default', **kwargs):
+    """إنشاء فهرس البحث النصي بعد migrate (يُربط في RestaurantConfig.ready)"""
+    ensure_dish_search_index(using)
@@ -0,0 +1,135 @@
+"""
+Sparse fieldsets (``?fields=`` / ``?expand=``) for the API serializers.
+
+``?fields=id,name,price,image`` limits a response to those fields. While a
+field list is given, nested relations (a dish's ``category``, an order's
+``customer`` and ``items``) are collapsed to their primary keys unless they
+are listed in ``?expand=``. The view side pushes the same selection down to
+the queryset with ``.only()``, so unrequested columns (long texts such as
+``description``) and unrequested joins are never loaded.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def _split_param(request, name):
+    query_params = getattr(request, 'query_params', None)
+    value = query_params.get(name, '') if query_params is not None else ''
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+def _select_related_paths(select_related, prefix=''):
+    """Flatten Django's nested ``query.select_related`` dict into lookup paths"""
+    paths = []
+    for name, children in select_related.items():
+        path = f'{prefix}{name}'
+        nested = _select_related_paths(children, f'{path}__')
+        paths += nested or [path]
+    return paths
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin honouring ``?fields=`` and ``?expand=``.
+
+    Only the top-level serializer of a response reads the query parameters;
+    the same serializer nested elsewhere (e.g. a dish inside an order item)
+    is rendered in full. Optional ``Meta`` attributes:
+
+    - ``expandable_fields``: nested relations collapsed to their pk unless expanded
+    - ``sparse_field_sources``: model fields needed by fields that are not
+      plain model fields (properties, method fields)
+    """
+
+    def _is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_sparse_selection(self):
+        """``(fields, expand)`` requested for this serializer, or None for everything"""
+        if not self._is_root():
+            return None
+        request = self.context.get('request')
+        fields = _split_param(request, 'fields')
+        if not fields:
+            return None
+        return fields, _split_param(request, 'expand')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.get_sparse_selection()
+        if selection is None:
+            return fields
+
+        wanted, expand = selection
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+        for name, field in list(fields.items()):
+            if field.write_only:
+                continue
+            if name not in wanted:
+                del fields[name]
+            elif name in expandable and name not in expand:
+                many = isinstance(field, serializers.ListSerializer)
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=many, source=field.source
+                )
+        return fields
+
+    @classmethod
+    def sparse_queryset(cls, queryset, context):
+        """
+        Apply the requested selection to ``queryset``: ``.only()`` the columns
+        the remaining fields read and drop ``select_related`` joins for
+        relations that are not expanded.
+        """
+        serializer = cls(context=context)
+        selection = serializer.get_sparse_selection()
+        if selection is None:
+            return queryset
+
+        _, expand = selection
+        model = queryset.model
+        sources = getattr(cls.Meta, 'sparse_field_sources', {})
+        expandable = getattr(cls.Meta, 'expandable_fields', ())
+        columns = {model._meta.pk.name}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in sources:
+                columns.update(sources[name])
+                continue
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                # مصدر غير معروف (خاصية بدون تصريح) - لا نقيّد الأعمدة
+                return queryset
+            if model_field.concrete:
+                columns.add(model_field.name)
+
+        select_related = queryset.query.select_related
+        if select_related:
+            expanded = {
+                serializer.fields[name].source
+                for name in expandable
+                if name in serializer.fields and name in expand
+            }
+            paths = [] if select_related is True else _select_related_paths(select_related)
+            queryset = queryset.select_related(None)
+            kept = [path for path in paths if path.split('__')[0] in expanded]
+            if kept:
+                queryset = queryset.select_related(*kept)
+
+        return queryset.only(*columns)
+
+
+class SparseQuerysetMixin:
+    """View mixin passing the serializer's sparse selection down to the queryset"""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if self.request.method in ('GET', 'HEAD') and issubclass(serializer_class, SparseFieldsetMixin):
+            queryset = serializer_class.sparse_queryset(queryset, self.get_serializer_context())
+        return queryset
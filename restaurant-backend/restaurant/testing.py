@@ -0,0 +1,43 @@
+"""
+Test runner keeping the tests away from the real caches.
+
+The ``shared`` cache is a SQLite file under ``BASE_DIR/cache`` and the
+tests clear the caches in their ``setUp``. Like Django's runner does for
+the e-mail backend, the caches are overridden for the whole run: every
+``SQLiteCache`` alias gets a database file in a temporary directory that
+is removed afterwards.
+"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+import os
+import shutil
+import tempfile
+
+SQLITE_CACHE_BACKEND = 'restaurant.cache_backends.SQLiteCache'
+
+
+def isolated_caches(directory):
+    """``settings.CACHES`` with every SQLite cache moved to ``directory``"""
+    caches = {}
+    for alias, config in settings.CACHES.items():
+        config = dict(config)
+        if config.get('BACKEND') == SQLITE_CACHE_BACKEND:
+            config['LOCATION'] = os.path.join(directory, f'{alias}.sqlite3')
+        caches[alias] = config
+    return caches
+
+
+class TestRunner(DiscoverRunner):
+    """``DiscoverRunner`` running the tests on caches in a temporary directory"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_directory = tempfile.mkdtemp(prefix='restaurant-test-cache-')
+        self._cache_override = override_settings(CACHES=isolated_caches(self._cache_directory))
+        self._cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_override.disable()
+        shutil.rmtree(self._cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,10 +1,43 @@
-from django.test import TestCase
-from rest_framework.test import APIClient, APITestCase
+from django.test import TestCase, TransactionTestCase
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.test import override_settings
 from decimal import Decimal
+from unittest import mock
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 
-from .models import Category, Dish, Customer, Order, OrderItem, DishRating
+from .models import AdminProfile, Category, Dish, Customer, Order, OrderItem, DishRating, Notification, Restaurant
+from .authentication import SignedTokenAuthentication
+from .cache_backends import SQLiteCache, TieredCache
+from .cache_metrics import key_family, metrics
+from .caching import cached_computation, get_cached, invalidate_tags, set_cached
+from .fast_serializers import CompiledDishSerializer
+from .identity import get_identity
+from .tokens import issue_tokens
+from .pagination import OrderPagination
+from .ratelimit import CacheBackend, get_backend, hit, ip_key, parse_rate
+from .roster import get_admin_roster, is_restaurant_admin, staff_user_ids
+from .schema import get_openapi_schema, schema_cache_key
+from .serializers import DishSerializer, EnhancedOrderCreateSerializer
+from .sessions import SessionStore, flush_expiry_bumps, pending_expiry_bumps, reset_expiry_tracking
+from .views import _create_order_from_stripe_session
+from .utils import get_category_stats, get_popular_dishes, send_notification_to_admins
+from .warmup import WARMERS, OriginRequest, warm_caches, warm_menu_snapshot
 
 
 class DishAPITestCase(APITestCase):
@@ -191,3 +224,1620 @@ class DishModelTestCase(TestCase):
             low_stock_threshold=5
         )
         self.assertTrue(dish.is_low_stock)
+
+
+class DishRatingAggregateTestCase(APITestCase):
+    """اختبار تجميعات التقييم المخزنة على الطبق"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='rater', password='testpass123')
+        self.customer = Customer.objects.create(user=self.user, phone='123456789', address='Test')
+        self.category = Category.objects.create(name="Test Category")
+        self.dish = Dish.objects.create(
+            name="Rated Dish",
+            price=Decimal('10.00'),
+            category=self.category,
+            stock_quantity=10
+        )
+        self.other_dish = Dish.objects.create(
+            name="Other Dish",
+            price=Decimal('12.00'),
+            category=self.category,
+            stock_quantity=10
+        )
+    
+    def test_create_update_delete_keep_aggregates(self):
+        """اختبار تحديث التجميعات عند الإضافة والتعديل والحذف"""
+        first = DishRating.objects.create(dish=self.dish, customer=self.customer, rating=4)
+        DishRating.objects.create(dish=self.dish, customer=self.customer, rating=2)
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.rating_count, 2)
+        self.assertEqual(self.dish.rating_sum, 6)
+        self.assertEqual(self.dish.average_rating, 3.0)
+        
+        rating = DishRating.objects.get(pk=first.pk)
+        rating.rating = 5
+        rating.save()
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.rating_sum, 7)
+        self.assertEqual(self.dish.average_rating, 3.5)
+        
+        rating.dish = self.other_dish
+        rating.save()
+        self.dish.refresh_from_db()
+        self.other_dish.refresh_from_db()
+        self.assertEqual((self.dish.rating_count, self.dish.rating_sum), (1, 2))
+        self.assertEqual((self.other_dish.rating_count, self.other_dish.average_rating), (1, 5.0))
+        
+        DishRating.objects.filter(dish=self.dish).delete()
+        self.dish.refresh_from_db()
+        self.assertEqual((self.dish.rating_count, self.dish.rating_sum, self.dish.average_rating), (0, 0, 0.0))
+    
+    def test_rebuild_command(self):
+        """اختبار أمر إعادة بناء التجميعات"""
+        DishRating.objects.create(dish=self.dish, customer=self.customer, rating=3)
+        Dish.objects.update(rating_count=0, rating_sum=0, average_rating=0)
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        self.dish.refresh_from_db()
+        self.other_dish.refresh_from_db()
+        self.assertEqual((self.dish.rating_count, self.dish.average_rating), (1, 3.0))
+        self.assertEqual(self.other_dish.rating_count, 0)
+    
+    def test_min_rating_filter_and_ordering(self):
+        """اختبار الفلترة والترتيب حسب متوسط التقييم"""
+        DishRating.objects.create(dish=self.dish, customer=self.customer, rating=2)
+        DishRating.objects.create(dish=self.other_dish, customer=self.customer, rating=5)
+        url = reverse('dish-list')
+        response = self.client.get(url, {'min_rating': 4})
+        self.assertEqual([d['name'] for d in response.data['results']], ["Other Dish"])
+        response = self.client.get(url, {'ordering': '-average_rating'})
+        self.assertEqual([d['name'] for d in response.data['results']], ["Other Dish", "Rated Dish"])
+        self.assertEqual(response.data['results'][0]['rating_count'], 1)
+    
+    def test_reviews_endpoint_updates_aggregates(self):
+        """اختبار إضافة مراجعة عبر reviews"""
+        self.client.force_authenticate(user=self.user)
+        url = reverse('dish-reviews', args=[self.dish.id])
+        response = self.client.post(url, {'rating': 4, 'comment': 'Good'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.dish.refresh_from_db()
+        self.assertEqual((self.dish.rating_count, self.dish.average_rating), (1, 4.0))
+
+
+class CategoryCountsTestCase(APITestCase):
+    """اختبار حساب أعداد الأطباق للفئات بعدد ثابت من الاستعلامات"""
+    
+    def setUp(self):
+        self.categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        for i in range(12):
+            Dish.objects.create(
+                name=f"Dish {i}",
+                price=Decimal('10.00'),
+                category=self.categories[i % 3],
+                is_available=i % 3 != 0,
+                stock_quantity=5
+            )
+    
+    def test_category_list_counts(self):
+        """اختبار الأعداد في قائمة الفئات"""
+        # validators (ETag) + count + page
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('category-list'))
+        counts = {c['name']: (c['dishes_count'], c['available_dishes_count']) for c in response.data['results']}
+        self.assertEqual(counts["Category 0"], (4, 0))
+        self.assertEqual(counts["Category 1"], (4, 4))
+    
+    def test_nested_counts_constant_queries(self):
+        """عدد الاستعلامات لا يزيد مع حجم الصفحة"""
+        # validators (ETag) + count + page + أعداد الفئات
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('dish-list'))
+        self.assertEqual(len(response.data['results']), 8)
+        first = response.data['results'][0]['category']
+        self.assertEqual(first['dishes_count'], 4)
+    
+    def test_menu_overview_counts(self):
+        """اختبار نظرة عامة على القائمة"""
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('menu-overview'))
+        self.assertEqual(len(response.data['categories']), 3)
+        self.assertEqual(len(response.data['featured_dishes']), 6)
+
+
+class DishFullTextSearchTestCase(APITestCase):
+    """اختبار البحث النصي في الأطباق"""
+    
+    def setUp(self):
+        self.category = Category.objects.create(name="Test Category")
+        self.pizza = Dish.objects.create(
+            name="Margherita Pizza", description="Classic with basil",
+            ingredients="tomato, mozzarella", price=Decimal('9.00'), category=self.category
+        )
+        self.pasta = Dish.objects.create(
+            name="Penne", description="Goes well after a margherita",
+            ingredients="tomato, garlic", price=Decimal('8.00'), category=self.category
+        )
+    
+    def search(self, text, **params):
+        response = self.client.get(reverse('dish-list'), {'search': text, **params})
+        self.assertEqual(response.status_code, 200)
+        return [d['name'] for d in response.data['results']]
+    
+    def test_prefix_and_ranking(self):
+        """اختبار البحث بالبادئة وترتيب النتائج حسب الصلة"""
+        self.assertEqual(self.search('marg'), ["Margherita Pizza", "Penne"])
+        self.assertEqual(self.search('tomato garl'), ["Penne"])
+        self.assertEqual(self.search('marg', ordering='price'), ["Penne", "Margherita Pizza"])
+    
+    def test_index_follows_updates_and_deletes(self):
+        """اختبار تحديث الفهرس عند تعديل وحذف الأطباق"""
+        self.pasta.name = "Rigatoni"
+        self.pasta.description = "Short pasta"
+        self.pasta.save()
+        self.assertEqual(self.search('margherita'), ["Margherita Pizza"])
+        self.assertEqual(self.search('rigat'), ["Rigatoni"])
+        Dish.objects.filter(pk=self.pizza.pk).delete()
+        self.assertEqual(self.search('margherita'), [])
+
+
+class DishFuzzySearchTestCase(APITestCase):
+    """اختبار البحث المتسامح مع الأخطاء الإملائية"""
+    
+    def setUp(self):
+        from .search import reset_dish_trigram_index
+        reset_dish_trigram_index()
+        self.category = Category.objects.create(name="Test Category")
+        for name, ingredients in [
+            ("Margherita Pizza", "tomato, mozzarella, basil"),
+            ("Tiramisu", "mascarpone, coffee, cocoa"),
+            ("Greek Salad", "feta, olives, cucumber"),
+        ]:
+            Dish.objects.create(name=name, ingredients=ingredients, price=Decimal('9.00'), category=self.category)
+    
+    def search(self, text):
+        response = self.client.get(reverse('dish-list'), {'search': text, 'fuzzy': 'true'})
+        self.assertEqual(response.status_code, 200)
+        return [d['name'] for d in response.data['results']]
+    
+    def test_misspelled_names(self):
+        """اختبار البحث بأسماء بها أخطاء إملائية"""
+        self.assertEqual(self.search('margarita'), ["Margherita Pizza"])
+        self.assertEqual(self.search('tiramsu'), ["Tiramisu"])
+        self.assertEqual(self.search('mozarela'), ["Margherita Pizza"])
+        self.assertEqual(self.search('xyzzy'), [])
+        # بدون fuzzy لا توجد نتائج للكلمة الخاطئة
+        response = self.client.get(reverse('dish-list'), {'search': 'margarita'})
+        self.assertEqual(response.data['results'], [])
+    
+    def test_index_follows_catalog_changes(self):
+        """اختبار تحديث الفهرس عند تعديل وحذف الأطباق"""
+        self.assertEqual(self.search('tiramsu'), ["Tiramisu"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Dish.objects.create(name="Panna Cotta", price=Decimal('7.00'), category=self.category)
+            Dish.objects.get(name="Tiramisu").delete()
+        self.assertEqual(self.search('pana cota'), ["Panna Cotta"])
+        self.assertEqual(self.search('tiramsu'), [])
+    
+    def test_change_in_other_worker_rebuilds_index(self):
+        """اختبار أن تعديلاً من worker آخر (دون إشارات هنا) يظهر بعد تغير نسخة الكتالوج"""
+        from .search import get_dish_trigram_index
+        self.assertEqual(self.search('tiramsu'), ["Tiramisu"])
+        Dish.objects.filter(name="Tiramisu").update(name="Cannoli")
+        self.assertEqual(self.search('canoli'), [])  # نفس النسخة: الفهرس الحالي
+        invalidate_tags('menu')
+        self.assertEqual(self.search('canoli'), ["Cannoli"])
+        with self.assertNumQueries(0):
+            get_dish_trigram_index()
+
+
+class MenuSnapshotTestCase(APITestCase):
+    """اختبار snapshot القائمة المحفوظ في الذاكرة"""
+    
+    def setUp(self):
+        from .menu_snapshot import clear_menu_snapshots
+        clear_menu_snapshots()
+        self.category = Category.objects.create(name="Pizza")
+        Category.objects.create(name="Hidden", is_active=False)
+        self.dish = Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=self.category)
+        Dish.objects.create(name="Sold Out", price=Decimal('5.00'), category=self.category, is_available=False)
+        self.url = reverse('menu-snapshot')
+    
+    def test_snapshot_content_and_no_queries(self):
+        """اختبار محتوى القائمة وعدم تنفيذ استعلامات بعد البناء"""
+        import json
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual([c['name'] for c in data['categories']], ["Pizza"])
+        self.assertEqual(data['categories'][0]['available_dishes_count'], 1)
+        self.assertEqual([d['name'] for d in data['dishes']], ["Margherita"])
+        self.assertEqual(data['dishes'][0]['price'], '9.50')
+        
+        with self.assertNumQueries(0):
+            again = self.client.get(self.url)
+        self.assertEqual(again.content, response.content)
+        self.assertEqual(again['ETag'], response['ETag'])
+    
+    def test_conditional_and_gzip(self):
+        """اختبار ETag و gzip"""
+        import gzip
+        response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        
+        zipped = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertNotEqual(zipped['ETag'], response['ETag'])
+        self.assertEqual(gzip.decompress(zipped.content), response.content)
+        
+        refused = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', refused)
+        self.assertEqual(refused.content, response.content)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT_ENCODING='br, *;q=0.5')['Content-Encoding'], 'gzip')
+    
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_snapshots_per_origin_are_bounded(self):
+        """اختبار أن منافذ Host المختلفة لا تنمي الذاكرة بلا حد"""
+        from . import menu_snapshot
+        for port in range(1, menu_snapshot.MAX_ORIGINS + 5):
+            self.assertEqual(self.client.get(self.url, HTTP_HOST=f'localhost:{port}').status_code, 200)
+        self.assertEqual(len(menu_snapshot._snapshots), menu_snapshot.MAX_ORIGINS)
+        self.assertNotIn('http://localhost:1', menu_snapshot._snapshots)
+    
+    def test_rebuilt_after_catalog_change(self):
+        """اختبار إعادة البناء بعد تعديل طبق"""
+        first = self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish.price = Decimal('11.00')
+            self.dish.save()
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertContains(second, '"11.00"')
+
+
+class ConditionalGetTestCase(APITestCase):
+    """اختبار ETag و Last-Modified لنقاط الكتالوج"""
+    
+    def setUp(self):
+        self.category = Category.objects.create(name="Pizza")
+        self.dish = Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=self.category)
+        Restaurant.objects.create(
+            name="Test Restaurant", address="Street", phone="123", email="r@example.com",
+            opening_time="09:00", closing_time="23:00"
+        )
+    
+    def assert_revalidates(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+        return response
+    
+    def test_catalog_endpoints_return_304(self):
+        """اختبار إرجاع 304 عند عدم تغير البيانات"""
+        for url in [reverse('dish-list'), reverse('dish-detail', args=[self.dish.id]),
+                    reverse('category-list'), reverse('restaurant-list'), reverse('restaurant-info')]:
+            self.assert_revalidates(url)
+    
+    def test_etag_changes_with_data_and_query(self):
+        """اختبار تغير ETag عند تعديل البيانات أو تغيير الاستعلام"""
+        url = reverse('dish-list')
+        response = self.client.get(url)
+        filtered = self.client.get(url, {'price_max': 5})
+        self.assertNotEqual(filtered['ETag'], response['ETag'])
+        
+        Dish.objects.create(name="Pepperoni", price=Decimal('10.00'), category=self.category)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, "Pepperoni")
+
+
+class CursorPaginationTestCase(APITestCase):
+    """اختبار الترقيم بالمؤشر للطلبات والإشعارات والتقييمات"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='pager', password='testpass123')
+        self.customer = Customer.objects.create(user=self.user, phone='1', address='Street')
+        self.category = Category.objects.create(name="Pizza")
+        self.dish = Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=self.category)
+        for i in range(45):
+            Order.objects.create(customer=self.customer, total_amount=Decimal('10.00'), delivery_address='Street')
+            DishRating.objects.create(dish=self.dish, customer=self.customer, rating=i % 5 + 1)
+        # نصف الطلبات بنفس الوقت للتأكد من ثبات الترتيب عند التساوي
+        tied = Order.objects.order_by('id').values_list('id', flat=True)[:20]
+        Order.objects.filter(id__in=list(tied)).update(order_date=Order.objects.earliest('order_date').order_date)
+        self.client.force_authenticate(user=self.user)
+    
+    def walk(self, url, params):
+        """اتباع روابط next حتى النهاية وإرجاع المعرفات بالترتيب"""
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+    
+    def test_page_number_clients_keep_working(self):
+        """اختبار بقاء استجابة الترقيم بالصفحات كما هي"""
+        response = self.client.get(reverse('order-list'), {'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 45)
+        self.assertEqual(len(response.data['results']), 20)
+        
+        reviews = self.client.get(reverse('dish-reviews', args=[self.dish.id]))
+        self.assertEqual(len(reviews.data), 45)
+    
+    def test_cursor_walks_orders_in_stable_order(self):
+        """اختبار المرور على كل الطلبات دون تكرار أو فقدان"""
+        expected = list(Order.objects.order_by('-order_date', '-id').values_list('id', flat=True))
+        for url in [reverse('order-list'), reverse('admin-order-list')]:
+            self.assertEqual(self.walk(url, {'pagination': 'cursor'}), expected)
+    
+    def test_cursor_page_skips_count(self):
+        """اختبار أن صفحة المؤشر استعلام واحد دون COUNT أو OFFSET"""
+        first = self.client.get(reverse('admin-order-list'), {'pagination': 'cursor'})
+        request = Request(APIRequestFactory().get(first.data['next']))
+        with self.assertNumQueries(1) as queries:
+            page = OrderPagination().paginate_queryset(Order.objects.all(), request)
+        self.assertEqual(len(page), 20)
+        self.assertNotIn('COUNT(', queries.captured_queries[0]['sql'])
+        self.assertNotIn('OFFSET', queries.captured_queries[0]['sql'])
+    
+    def test_cursor_reviews(self):
+        """اختبار الترقيم بالمؤشر لتقييمات الطبق"""
+        expected = list(DishRating.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        url = reverse('dish-reviews', args=[self.dish.id])
+        self.assertEqual(self.walk(url, {'pagination': 'cursor'}), expected)
+
+
+class SparseFieldsetTestCase(APITestCase):
+    """اختبار ?fields= و ?expand="""
+    
+    def setUp(self):
+        self.category = Category.objects.create(name="Pizza")
+        for i in range(3):
+            Dish.objects.create(
+                name=f"Dish {i}", price=Decimal('9.50'), category=self.category,
+                description="Long text " * 50, ingredients="Tomato, cheese"
+            )
+    
+    def test_fields_limit_response_and_columns(self):
+        """اختبار عدم تحميل الأعمدة الطويلة ولا الفئة المتداخلة"""
+        url = reverse('dish-list')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'id,name,price,image'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'price', 'image'})
+        
+        dish_queries = [q['sql'] for q in queries.captured_queries if 'FROM "restaurant_dish"' in q['sql']]
+        page_query = dish_queries[-1]
+        self.assertNotIn('"restaurant_dish"."description"', page_query)
+        self.assertNotIn('"restaurant_dish"."ingredients"', page_query)
+        self.assertNotIn('JOIN "restaurant_category"', page_query)
+    
+    def test_nested_relation_collapses_unless_expanded(self):
+        """اختبار تحويل الفئة إلى المعرف إلا عند طلب التوسيع"""
+        url = reverse('dish-list')
+        collapsed = self.client.get(url, {'fields': 'id,category'})
+        self.assertEqual(collapsed.data['results'][0]['category'], self.category.id)
+        
+        expanded = self.client.get(url, {'fields': 'id,category', 'expand': 'category'})
+        self.assertEqual(expanded.data['results'][0]['category']['name'], "Pizza")
+        self.assertEqual(expanded.data['results'][0]['category']['dishes_count'], 3)
+    
+    def test_without_fields_response_is_unchanged(self):
+        """اختبار بقاء الاستجابة الكاملة بدون ?fields="""
+        response = self.client.get(reverse('dish-list'))
+        dish = response.data['results'][0]
+        self.assertIn('description', dish)
+        self.assertEqual(dish['category']['name'], "Pizza")
+        
+        categories = self.client.get(reverse('category-list'), {'fields': 'id,name'})
+        self.assertEqual(set(categories.data['results'][0]), {'id', 'name'})
+    
+    def test_order_fields(self):
+        """اختبار ?fields= على الطلبات"""
+        user = User.objects.create_user(username='sparse', password='testpass123')
+        customer = Customer.objects.create(user=user, phone='1', address='Street')
+        order = Order.objects.create(customer=customer, total_amount=Decimal('9.50'), delivery_address='Street')
+        item = OrderItem.objects.create(order=order, dish=Dish.objects.first(), quantity=1, price=Decimal('9.50'))
+        self.client.force_authenticate(user=user)
+        
+        response = self.client.get(reverse('order-list'), {'fields': 'id,status,customer,items'})
+        self.assertEqual(response.data['results'][0], {
+            'id': order.id, 'status': 'pending', 'customer': customer.id, 'items': [item.id]
+        })
+        
+        expanded = self.client.get(reverse('order-list'), {'fields': 'id,items', 'expand': 'items'})
+        self.assertEqual(expanded.data['results'][0]['items'][0]['dish']['name'], item.dish.name)
+
+
+class CompiledDishSerializerTestCase(APITestCase):
+    """اختبار تطابق المسار السريع (values) مع DishSerializer"""
+    
+    def setUp(self):
+        self.category = Category.objects.create(name="Pizza", image='categories/pizza.png')
+        self.other = Category.objects.create(name="Drinks")
+        Dish.objects.create(
+            name="Margherita", price=Decimal('9.5'), category=self.category,
+            image='dishes/marg herita é.jpg', stock_quantity=3, calories=800
+        )
+        Dish.objects.create(name="Cola", price=Decimal('2.00'), category=self.other, stock_quantity=0)
+        Dish.objects.create(name="Hidden", price=Decimal('1.00'), category=self.other, is_available=False)
+        self.customer = Customer.objects.create(
+            user=User.objects.create_user(username='fast', password='testpass123'), phone='1', address='Street'
+        )
+        order = Order.objects.create(customer=self.customer, total_amount=Decimal('9.50'), delivery_address='Street')
+        for dish in Dish.objects.all():
+            OrderItem.objects.create(order=order, dish=dish, quantity=2, price=dish.price)
+    
+    def render(self, data):
+        return JSONRenderer().render(data)
+    
+    def test_rows_render_identically(self):
+        """اختبار تطابق JSON بايت ببايت مع وبدون request"""
+        request = Request(APIRequestFactory().get('/api/dishes/'))
+        for context in [{'request': request}, {}]:
+            queryset = Dish.objects.select_related('category').order_by('name')
+            expected = self.render(DishSerializer(queryset, many=True, context=dict(context)).data)
+            compiled = CompiledDishSerializer(dict(context))
+            self.assertEqual(self.render(compiled.serialize(compiled.values(queryset))), expected)
+    
+    def test_endpoints_match_drf_serializer(self):
+        """اختبار تطابق نقاط النهاية مع مسار DRF"""
+        request = Request(APIRequestFactory().get('/api/dishes/'))
+        available = Dish.objects.filter(is_available=True).select_related('category').order_by('name')
+        expected = self.render(DishSerializer(available, many=True, context={'request': request}).data)
+        response = self.client.get(reverse('dish-list'))
+        self.assertEqual(self.render(response.data['results']), expected)
+        
+        searched = self.client.get(reverse('dish-list'), {'search': 'marg'})
+        self.assertEqual([d['name'] for d in searched.data['results']], ["Margherita"])
+        
+        most_ordered = self.client.get(reverse('dish-most-ordered'))
+        by_id = DishSerializer(available.order_by('id'), many=True, context={'request': request}).data
+        self.assertEqual(self.render(most_ordered.data), self.render(by_id))
+        
+        overview = self.client.get(reverse('menu-overview'))
+        featured = DishSerializer(available, many=True, context={}).data
+        self.assertEqual(self.render(overview.data['featured_dishes']), self.render(featured))
+    
+    def test_sparse_request_uses_drf_path(self):
+        """اختبار الرجوع لمسار DRF عند ?fields="""
+        response = self.client.get(reverse('dish-list'), {'fields': 'id,name'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+
+
+class DishFacetsTestCase(APITestCase):
+    """اختبار أعداد الـ facets في فلتر الأطباق"""
+    
+    def setUp(self):
+        self.pizza = Category.objects.create(name="Pizza")
+        self.salad = Category.objects.create(name="Salad")
+        for name, price, category, veg, spicy, stock in [
+            ("Margherita", '9.00', self.pizza, True, False, 5),
+            ("Diavola", '12.00', self.pizza, False, True, 5),
+            ("Veggie Pizza", '15.00', self.pizza, True, True, 0),
+            ("Greek Salad", '8.00', self.salad, True, False, 5),
+            ("Chicken Salad", '25.00', self.salad, False, False, 5),
+        ]:
+            Dish.objects.create(
+                name=name, price=Decimal(price), category=category,
+                is_vegetarian=veg, is_spicy=spicy, stock_quantity=stock
+            )
+    
+    def get_facets(self, **params):
+        response = self.client.get(reverse('dish-list'), {'facets': 'true', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets']
+    
+    def test_facets_without_filters(self):
+        """اختبار الأعداد بدون فلاتر"""
+        facets = self.get_facets()
+        self.assertEqual(
+            [(c['name'], c['count']) for c in facets['category']], [("Pizza", 3), ("Salad", 2)]
+        )
+        self.assertEqual(facets['is_vegetarian'], {'true': 3, 'false': 2})
+        self.assertEqual(facets['is_spicy'], {'true': 2, 'false': 3})
+        self.assertEqual(facets['in_stock'], {'true': 4, 'false': 1})
+        self.assertEqual([b['count'] for b in facets['price']], [2, 2, 1, 0])
+    
+    def test_facet_ignores_its_own_filter(self):
+        """اختبار أن كل facet يطبق كل الفلاتر ما عدا فلتره"""
+        facets = self.get_facets(category=self.pizza.id, is_vegetarian='true', search='pizza')
+        # الفئات: نباتي + بحث "pizza" بدون فلتر الفئة
+        self.assertEqual([(c['name'], c['count']) for c in facets['category']], [("Pizza", 1)])
+        # النباتي: فئة البيتزا + البحث بدون فلتر النباتي
+        self.assertEqual(facets['is_vegetarian'], {'true': 1, 'false': 0})
+        self.assertEqual(facets['is_spicy'], {'true': 1, 'false': 0})
+        
+        facets = self.get_facets(category=self.pizza.id, price_max=10)
+        self.assertEqual([(c['name'], c['count']) for c in facets['category']], [("Pizza", 1), ("Salad", 1)])
+        # السعر: فئة البيتزا فقط (9, 12, 15) بدون فلتر السعر
+        self.assertEqual([b['count'] for b in facets['price']], [1, 2, 0, 0])
+        
+        from .search import reset_dish_trigram_index
+        reset_dish_trigram_index()
+        facets = self.get_facets(search='piza', fuzzy='true')
+        self.assertEqual(facets['category'][0]['name'], "Pizza")
+    
+    def test_facets_use_single_query(self):
+        """اختبار حساب كل الـ facets في استعلام واحد"""
+        with CaptureQueriesContext(connection) as without:
+            self.client.get(reverse('dish-list'), {'is_spicy': 'false'})
+        with CaptureQueriesContext(connection) as with_facets:
+            response = self.client.get(reverse('dish-list'), {'is_spicy': 'false', 'facets': 'true'})
+        self.assertEqual(len(with_facets), len(without) + 1)
+        self.assertNotIn('facets', self.client.get(reverse('dish-list')).data)
+        self.assertEqual(response.data['count'], 3)
+
+
+class CacheTagInvalidationTestCase(APITestCase):
+    """اختبار إبطال الـ cache عبر الوسوم"""
+    
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Pizza")
+        self.dish = Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=self.category)
+        user = User.objects.create_user(username='tags', password='testpass123')
+        self.customer = Customer.objects.create(user=user, phone='1', address='Street')
+    
+    def test_tagged_entry_goes_stale_when_tag_is_invalidated(self):
+        """اختبار أن إبطال وسم واحد يبطل كل المدخلات الموسومة به"""
+        set_cached('a', 1, 60, tags=['dish:1', 'menu'])
+        set_cached('b', 2, 60, tags=['dish:2'])
+        self.assertEqual(get_cached('a'), 1)
+        
+        invalidate_tags('dish:1')
+        self.assertIsNone(get_cached('a'))
+        self.assertEqual(get_cached('b'), 2)
+    
+    def test_popular_dishes_invalidated_for_any_limit(self):
+        """اختبار إبطال الأطباق الشعبية لأي limit عند إضافة عنصر طلب"""
+        self.assertEqual(get_popular_dishes(limit=7)[0]['order_count'], 0)
+        order = Order.objects.create(customer=self.customer, total_amount=Decimal('9.50'), delivery_address='Street')
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=order, dish=self.dish, quantity=1, price=self.dish.price)
+        self.assertEqual(get_popular_dishes(limit=7)[0]['order_count'], 1)
+    
+    def test_category_stats_invalidated_by_dish_change(self):
+        """اختبار إبطال إحصائيات الفئات عند تعديل طبق"""
+        self.assertEqual(get_category_stats()[0]['available_dishes_count'], 1)
+        self.dish.is_available = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dish.save()
+        self.assertEqual(get_category_stats()[0]['available_dishes_count'], 0)
+
+
+class CachedComputationTestCase(TestCase):
+    """اختبار منع تدافع إعادة الحساب (single-flight و stale-while-revalidate)"""
+    
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+    
+    def compute(self, value='fresh', delay=0):
+        self.calls += 1
+        time.sleep(delay)
+        return value
+    
+    def test_concurrent_misses_compute_once(self):
+        """اختبار أن الطلبات المتزامنة تنتظر حساباً واحداً بدلاً من التكرار"""
+        results = []
+        
+        def worker():
+            results.append(cached_computation('stats', lambda: self.compute(delay=0.3), 60))
+        
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['fresh'] * 5)
+    
+    def test_invalidation_during_compute_leaves_value_stale(self):
+        """اختبار أن الإبطال أثناء الحساب لا يختم القيمة القديمة بالجيل الجديد"""
+        def compute():
+            value = self.compute('before')
+            invalidate_tags('menu')  # تغيير في قاعدة البيانات بعد القراءة
+            return value
+        
+        self.assertEqual(cached_computation('stats', compute, 60, tags=['menu']), 'before')
+        self.assertEqual(cached_computation('stats', lambda: self.compute('after'), 60, tags=['menu']), 'after')
+        self.assertEqual(self.calls, 2)
+    
+    def test_stale_value_served_while_another_worker_recomputes(self):
+        """اختبار تقديم القيمة القديمة أثناء إعادة الحساب في worker آخر"""
+        cached_computation('stats', lambda: self.compute('old'), 60, tags=['menu'])
+        invalidate_tags('menu')
+        cache.add('stats:lock', True, 10)  # worker آخر يعيد الحساب
+        self.assertEqual(cached_computation('stats', self.compute, 60, tags=['menu']), 'old')
+        self.assertEqual(self.calls, 1)
+        
+        cache.delete('stats:lock')
+        self.assertEqual(cached_computation('stats', self.compute, 60, tags=['menu']), 'fresh')
+        self.assertEqual(self.calls, 2)
+    
+    def test_refresh_starts_before_expiry(self):
+        """اختبار إعادة الحساب المبكرة قبل انتهاء الصلاحية (XFetch)"""
+        cached_computation('stats', lambda: self.compute('old'), 60)
+        with mock.patch('restaurant.caching.random.random', return_value=0.5):
+            self.assertEqual(cached_computation('stats', self.compute, 60), 'old')
+        self.assertEqual(self.calls, 1)
+        
+        # random() قريب من 1 مع beta كبير يجعل الحساب المبكر مؤكداً
+        with mock.patch('restaurant.caching.random.random', return_value=1 - 1e-12):
+            self.assertEqual(cached_computation('stats', self.compute, 60, beta=1e9), 'fresh')
+        self.assertEqual(self.calls, 2)
+
+
+class WarmCachesTestCase(TransactionTestCase):
+    """اختبار تسخين الـ cache بعد النشر"""
+    
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Pizza")
+        Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=category)
+    
+    def test_command_fills_shared_cache(self):
+        """اختبار أن الأمر يحسب الإحصائيات والـ schema مسبقاً"""
+        out = StringIO()
+        call_command('warm_caches', stdout=out)
+        self.assertIn('Warmed 3/3 caches', out.getvalue())
+        self.assertNotIn('menu_snapshot', out.getvalue())
+        self.assertIsNotNone(cache.get(schema_cache_key()))
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(get_popular_dishes(limit=10)[0]['name'], 'Margherita')
+            self.assertEqual(get_category_stats()[0]['dishes_count'], 1)
+            self.assertIn('paths', get_openapi_schema())
+        
+        response = self.client.get('/api/schema/', HTTP_ACCEPT='application/vnd.oai.openapi+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/api/dishes/', response.json()['paths'])
+    
+    def test_budget_stops_waiting_for_slow_warmer(self):
+        """اختبار عدم الانتظار بعد انتهاء الميزانية الزمنية"""
+        release = threading.Event()
+        slow = {'slow': (lambda: release.wait(5), False), 'fail': (lambda: 1 / 0, False)}
+        with mock.patch.dict(WARMERS, slow):
+            start = time.monotonic()
+            results = warm_caches(['slow', 'fail', 'category_stats'], budget=0.3)
+            self.assertLess(time.monotonic() - start, 2)
+        release.set()
+        
+        statuses = {result['name']: result['status'] for result in results}
+        self.assertEqual(statuses, {'slow': 'timeout', 'fail': 'failed', 'category_stats': 'ok'})
+    
+    @override_settings(CACHE_WARMUP_ORIGINS=['https://menu.example.com'], ALLOWED_HOSTS=['menu.example.com'])
+    def test_menu_snapshot_for_configured_origin(self):
+        """اختبار بناء الـ snapshot لكل origin دون طلب حقيقي"""
+        from .menu_snapshot import clear_menu_snapshots, get_menu_snapshot
+        clear_menu_snapshots()
+        self.addCleanup(clear_menu_snapshots)
+        request = OriginRequest('https://menu.example.com')
+        self.assertEqual(request.build_absolute_uri(), 'https://menu.example.com/api/menu/')
+        
+        warm_menu_snapshot()
+        with self.assertNumQueries(0):
+            snapshot = get_menu_snapshot(request)
+        self.assertIn(b'Margherita', snapshot.body)
+
+
+class IdentityResolutionTestCase(APITestCase):
+    """اختبار حل هوية المستخدم من الجلسة مرة واحدة لكل طلب"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ident', password='testpass123', email='ident@example.com')
+        self.customer = Customer.objects.create(user=self.user, phone='1', address='Street')
+        self.category = Category.objects.create(name="Pizza")
+        self.dish = Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=self.category)
+        login_client = APIClient()
+        login_client.login(username='ident', password='testpass123')
+        self.session_key = login_client.cookies['sessionid'].value
+    
+    def test_resolved_once_with_profiles_joined(self):
+        """اختبار تحميل الجلسة والمستخدم وملفاته مرة واحدة ثم إعادة الاستخدام"""
+        request = APIRequestFactory().get('/api/orders/', HTTP_X_SESSION_KEY=self.session_key)
+        with self.assertNumQueries(2):  # الجلسة (مع تاريخ انتهائها) والمستخدم مع ملفاته
+            identity = get_identity(request)
+            self.assertEqual(identity.user, self.user)
+            self.assertEqual(identity.customer, self.customer)
+            self.assertIsNone(identity.admin_profile)
+        with self.assertNumQueries(0):
+            self.assertIs(get_identity(Request(request)), identity)
+    
+    def test_cached_principal_needs_no_queries(self):
+        """اختبار أن الطلبات التالية لنفس الجلسة لا تحتاج قاعدة البيانات للمصادقة"""
+        get_identity(APIRequestFactory().get('/', HTTP_X_SESSION_KEY=self.session_key))
+        with self.assertNumQueries(0):
+            identity = get_identity(APIRequestFactory().get('/', HTTP_X_SESSION_KEY=self.session_key))
+            self.assertEqual(identity.user.pk, self.user.pk)
+            self.assertEqual(identity.user.username, 'ident')
+            self.assertEqual(identity.customer.pk, self.customer.pk)
+            self.assertFalse(identity.is_admin)
+    
+    def test_logout_forgets_cached_principal(self):
+        """اختبار أن تسجيل الخروج يبطل الجلسة المخزنة فوراً"""
+        response = self.client.get('/api/check-user-type/', HTTP_X_SESSION_KEY=self.session_key)
+        self.assertTrue(response.data['is_authenticated'])
+        # في الـ cache المشترك مباشرة وليس في L1 هذا الـ worker
+        key = f'session_principal:{self.session_key}'
+        self.assertIsNotNone(caches['shared'].get(key))
+        self.assertNotIn(cache.make_key(key), cache._entries)
+        self.client.post('/api/logout/', HTTP_X_SESSION_KEY=self.session_key)
+        self.assertIsNone(caches['shared'].get(key))
+        response = self.client.get('/api/check-user-type/', HTTP_X_SESSION_KEY=self.session_key)
+        self.assertFalse(response.data['is_authenticated'])
+    
+    def test_views_share_header_session(self):
+        """اختبار أن الـ views تستخدم نفس الهوية من X-Session-Key"""
+        response = self.client.get('/api/check-user-type/', HTTP_X_SESSION_KEY=self.session_key)
+        self.assertTrue(response.data['is_authenticated'])
+        self.assertTrue(response.data['is_customer'])
+        self.assertFalse(response.data['is_admin'])
+        
+        response = self.client.post(
+            '/api/add-rating/', {'dish_id': self.dish.id, 'rating': 4}, format='json',
+            HTTP_X_SESSION_KEY=self.session_key
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(DishRating.objects.get().customer, self.customer)
+    
+    def test_password_change_invalidates_session(self):
+        """اختبار أن تغيير كلمة المرور يبطل الجلسات القديمة (حتى المخزنة في الـ cache)"""
+        response = self.client.get('/api/check-user-type/', HTTP_X_SESSION_KEY=self.session_key)
+        self.assertTrue(response.data['is_authenticated'])
+        self.user.set_password('changed123')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.get('/api/check-user-type/', HTTP_X_SESSION_KEY=self.session_key)
+        self.assertFalse(response.data['is_authenticated'])
+        self.assertEqual(self.client.get('/api/orders/', HTTP_X_SESSION_KEY=self.session_key).data['results'], [])
+
+
+@override_settings(AUTH_TOKENS_ENABLED=True)
+class SignedTokenTestCase(APITestCase):
+    """اختبار رموز الدخول الموقعة (بدون جدول الجلسات)"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='tok', password='testpass123', email='tok@example.com')
+        self.customer = Customer.objects.create(user=self.user, phone='1', address='Street')
+    
+    def login(self):
+        response = self.client.post(
+            '/api/login/', {'identity': 'tok', 'password': 'testpass123'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.client.cookies.clear()  # الرمز فقط، بدون cookie الجلسة
+        return response.json()
+    
+    def test_login_issues_tokens_verified_without_queries(self):
+        """اختبار أن رمز الدخول يصادق بدون أي استعلام لقاعدة البيانات"""
+        tokens = self.login()
+        self.assertEqual(tokens['token_type'], 'Bearer')
+        
+        request = Request(
+            APIRequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {tokens['access_token']}"),
+            authenticators=[SignedTokenAuthentication()]
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(request.user.pk, self.user.pk)
+            self.assertEqual(request.user.customer.pk, self.customer.pk)
+            self.assertEqual(request.auth['roles'], ['customer'])
+        
+        response = self.client.get('/api/check-user-type/', HTTP_AUTHORIZATION=f"Bearer {tokens['access_token']}")
+        self.assertTrue(response.data['is_authenticated'])
+        self.assertTrue(response.data['is_customer'])
+    
+    def test_tampered_or_expired_token_rejected(self):
+        """اختبار رفض الرمز المعدل أو المنتهي"""
+        access = issue_tokens(self.user)['access_token']
+        response = self.client.get('/api/orders/', HTTP_AUTHORIZATION=f'Bearer {access[:-2]}xx')
+        self.assertEqual(response.status_code, 401)
+        with override_settings(AUTH_ACCESS_TOKEN_LIFETIME=-1):
+            response = self.client.get('/api/orders/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, 401)
+    
+    def test_refresh_revoked_by_password_change(self):
+        """اختبار تجديد الرموز وإبطال رمز التجديد عند تغيير كلمة المرور"""
+        refresh = self.login()['refresh_token']
+        response = self.client.post('/api/token/refresh/', {'refresh_token': refresh}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access_token', response.data)
+        
+        self.user.set_password('changed123')
+        self.user.save()
+        response = self.client.post('/api/token/refresh/', {'refresh_token': refresh}, format='json')
+        self.assertEqual(response.status_code, 401)
+    
+    def test_access_token_carries_ids_and_roles_only(self):
+        """اختبار أن الرمز المقروء لا يحمل البريد أو اسم المستخدم"""
+        from django.core import signing
+        admin = User.objects.create_superuser(username='boss', password='testpass123', email='boss@example.com')
+        profile = AdminProfile.objects.create(user=admin, admin_email='boss@example.com', is_super_admin=True)
+        access = issue_tokens(admin)['access_token']
+        payload = signing.loads(access, salt='restaurant.tokens.access')
+        self.assertEqual(payload, {
+            'typ': 'access', 'uid': admin.pk, 'cid': None, 'aid': profile.pk,
+            'roles': ['admin', 'super_admin', 'staff', 'superuser'],
+        })
+        self.assertNotIn(b'boss', signing.b64_decode(access.split(':')[0].encode()))
+        
+        # الأعمدة الأخرى تُقرأ عند الحاجة فقط
+        response = self.client.get('/api/check-user-type/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertTrue(response.data['is_authenticated'])
+        self.assertTrue(response.data['is_admin'])
+    
+    def test_logout_revokes_refresh_tokens(self):
+        """اختبار أن تسجيل الخروج يبطل رموز التجديد الصادرة"""
+        tokens = self.login()
+        response = self.client.post('/api/logout/', HTTP_AUTHORIZATION=f"Bearer {tokens['access_token']}")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/token/refresh/', {'refresh_token': tokens['refresh_token']}, format='json')
+        self.assertEqual(response.status_code, 401)
+        
+        # تسجيل دخول جديد يصدر رموزاً صالحة
+        response = self.client.post('/api/token/refresh/', {'refresh_token': self.login()['refresh_token']}, format='json')
+        self.assertEqual(response.status_code, 200)
+    
+    @override_settings(AUTH_TOKENS_ENABLED=False)
+    def test_disabled_by_default(self):
+        """اختبار أن الرموز معطلة ما لم يتم تفعيلها"""
+        response = self.client.post('/api/login/', {'identity': 'tok', 'password': 'testpass123'}, format='json')
+        self.assertNotIn('access_token', response.json())
+        self.client.cookies.clear()
+        access = issue_tokens(self.user)['access_token']
+        response = self.client.get('/api/check-user-type/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertFalse(response.data['is_authenticated'])
+
+
+class TieredCacheTestCase(TestCase):
+    """اختبار الـ cache ذو المستويين (L1 في الذاكرة أمام الـ cache المشترك)"""
+    
+    def setUp(self):
+        caches['shared'].clear()
+    
+    def make_cache(self, **options):
+        options = {'L2': 'shared', **options}
+        return TieredCache('', {'OPTIONS': options})
+    
+    def test_hot_key_served_from_memory(self):
+        """اختبار قراءة المفتاح المتكرر من الذاكرة دون الرجوع للـ L2"""
+        tiered = self.make_cache()
+        tiered.set('popular', [1, 2, 3])
+        caches['shared'].delete('popular')  # تجاوز الـ L1 مباشرة
+        self.assertEqual(tiered.get('popular'), [1, 2, 3])
+        self.assertEqual(tiered.stats()['hits'], 1)
+        self.assertEqual(tiered.stats()['l2_hits'], 0)
+    
+    def test_write_in_other_worker_keeps_l1(self):
+        """اختبار أن الكتابة من worker آخر لا تفرغ الـ L1 للـ workers الآخرين"""
+        worker_a, worker_b = self.make_cache(), self.make_cache()
+        worker_b.set('menu', 'cached')
+        worker_a.set('stats', 1)
+        worker_a.delete('other')
+        self.assertEqual(worker_b.get('menu'), 'cached')
+        self.assertEqual(worker_b.stats()['hits'], 1)
+        self.assertEqual(worker_b.stats()['flushes'], 0)
+    
+    def test_short_l1_timeout_per_prefix(self):
+        """اختبار أن مفاتيح أجيال الوسوم ترى كتابة الـ worker الآخر فوراً مع مهلة L1 صفرية"""
+        options = {'L1_TIMEOUTS': {'tag_generation:': 0}}
+        worker_a, worker_b = self.make_cache(**options), self.make_cache(**options)
+        worker_a.set('tag_generation:menu', 1)
+        worker_b.set('dish', 'cached')
+        self.assertEqual(worker_b.get('tag_generation:menu'), 1)
+        
+        worker_a.set('tag_generation:menu', 2)
+        self.assertEqual(worker_b.get('tag_generation:menu'), 2)
+        self.assertEqual(worker_b.stats()['entries'], 1)  # 'dish' فقط
+    
+    def test_tag_invalidation_in_other_worker(self):
+        """اختبار أن إبطال وسم في worker آخر يجعل المدخل في الـ L1 قديماً"""
+        worker_a, worker_b = self.make_cache(), self.make_cache(L1_TIMEOUTS={'tag_generation:': 0})
+        with mock.patch('restaurant.caching.cache', worker_b):
+            set_cached('dish_detail:1', 'old', 60, tags=['dish:1'])
+            self.assertEqual(get_cached('dish_detail:1'), 'old')
+        with mock.patch('restaurant.caching.cache', worker_a):
+            invalidate_tags('dish:1')
+        with mock.patch('restaurant.caching.cache', worker_b):
+            self.assertIsNone(get_cached('dish_detail:1'))
+    
+    def test_byte_budget_evicts_least_recently_used(self):
+        """اختبار حذف الأقدم استخداماً عند تجاوز الحجم"""
+        tiered = self.make_cache(MAX_BYTES=300)
+        for key in ['a', 'b', 'c']:
+            tiered.set(key, 'x' * 100)
+        stats = tiered.stats()
+        self.assertLessEqual(stats['bytes'], 300)
+        self.assertEqual(stats['evictions'], 1)
+        # المفتاح الأقدم ما زال في الـ L2
+        self.assertEqual(tiered.get('a'), 'x' * 100)
+        self.assertEqual(tiered.stats()['l2_hits'], 1)
+    
+    def test_l1_entries_expire(self):
+        """اختبار انتهاء صلاحية مدخلات الـ L1"""
+        tiered = self.make_cache(L1_TIMEOUT=0)
+        tiered.set('key', 'value')
+        self.assertEqual(tiered.get('key'), 'value')
+        self.assertEqual(tiered.stats()['l2_hits'], 1)
+    
+    def test_stats_exact_under_threads(self):
+        """اختبار أن العدادات لا تفقد زيادات مع قراءات متوازية"""
+        tiered = self.make_cache()
+        tiered.set('hot', 'value')
+        
+        def read():
+            for _ in range(500):
+                tiered.get('hot')
+                tiered.get_many(['hot'])
+        
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tiered.stats()['hits'], 8000)
+        self.assertEqual(tiered.stats()['sets'], 1)
+
+
+class CacheMetricsTestCase(APITestCase):
+    """اختبار مقاييس الـ cache لكل عائلة مفاتيح"""
+    
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+    
+    def test_key_family_replaces_ids(self):
+        """اختبار تجميع المفاتيح حسب البادئة قبل المعرف"""
+        self.assertEqual(key_family('popular_dishes_10'), 'popular_dishes_*')
+        self.assertEqual(key_family('tag_generation:dish:7'), 'tag_generation:dish:*')
+        self.assertEqual(key_family('admin_dashboard_stats_2026-01-31'), 'admin_dashboard_stats_*')
+        self.assertEqual(key_family('category_stats'), 'category_stats')
+    
+    def test_hits_misses_and_bytes_per_family(self):
+        """اختبار عد القراءات والكتابات والحجم لكل عائلة"""
+        cache.set('popular_dishes_5', ['a'] * 10)
+        cache.get('popular_dishes_5')
+        cache.get('popular_dishes_10')
+        cache.get_many(['popular_dishes_5', 'category_stats'])
+        
+        families = metrics.snapshot()['default']
+        popular = families['popular_dishes_*']
+        self.assertEqual((popular['hits'], popular['misses'], popular['sets']), (2, 1, 1))
+        self.assertEqual(popular['bytes_read'], 2 * popular['bytes_written'])
+        self.assertGreater(popular['bytes_written'], 0)
+        self.assertAlmostEqual(popular['hit_ratio'], 2 / 3, places=3)
+        self.assertEqual(families['category_stats']['misses'], 1)
+        
+        # الـ L2: الكتابة وقراءات الـ L1 الفائتة فقط
+        shared = metrics.snapshot()['shared']
+        self.assertEqual(
+            (shared['popular_dishes_*']['sets'], shared['popular_dishes_*']['misses'], shared['category_stats']['misses']),
+            (1, 1, 1),
+        )
+        self.assertEqual(shared['popular_dishes_*']['hits'], 0)
+    
+    @override_settings(RATELIMIT_BACKEND='restaurant.ratelimit.CacheBackend', RATELIMIT_CACHE='shared')
+    def test_direct_shared_cache_traffic_is_counted(self):
+        """اختبار ظهور الوصول المباشر للـ cache المشترك (الـ rate limiter) في المقاييس"""
+        hit('login', 'ip:10.0.0.1', rate='5/m')
+        limiter = metrics.snapshot()['shared']['ratelimit:login:ip:*:*']
+        self.assertEqual((limiter['sets'], limiter['misses']), (2, 1))  # add ثم incr، والـ bucket السابق فارغ
+        self.assertNotIn('ratelimit:login:ip:*:*', metrics.snapshot().get('default', {}))
+    
+    def test_endpoint_is_admin_only(self):
+        """اختبار أن نقطة المقاييس للمدير فقط وتدعم صيغة Prometheus"""
+        url = reverse('admin-cache-metrics')
+        self.assertIn(self.client.get(url).status_code, (401, 403))
+        
+        user = User.objects.create_user(username='plain', password='testpass123')
+        self.client.force_authenticate(user=user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        
+        admin = User.objects.create_superuser(username='boss', password='testpass123', email='boss@example.com')
+        self.client.force_authenticate(user=admin)
+        get_popular_dishes(limit=3)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('popular_dishes_*', response.json()['caches']['default'])
+        self.assertIn('popular_dishes_*', response.json()['caches']['shared'])
+        self.assertIn('hit_ratio', response.json()['l1'])
+        
+        response = self.client.get(url, {'format': 'prometheus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('restaurant_cache_misses_total{cache="default",family="popular_dishes_*"} 1', response.content.decode())
+
+
+class SQLiteCacheTestCase(TestCase):
+    """اختبار الـ cache المشترك المخزن في ملف SQLite"""
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+    
+    def make_cache(self, **options):
+        return SQLiteCache(os.path.join(self.directory, 'cache.sqlite3'), {'OPTIONS': options})
+    
+    def test_tests_do_not_use_the_real_cache(self):
+        """اختبار أن الاختبارات لا تلمس ملف الـ cache الحقيقي"""
+        real = os.path.join(settings.BASE_DIR, 'cache')
+        self.assertFalse(os.path.abspath(caches['shared'].path).startswith(os.path.abspath(real)))
+        self.assertIs(cache.l2, caches['shared'])
+    
+    def test_basic_operations(self):
+        """اختبار العمليات الأساسية وانتهاء الصلاحية"""
+        sqlite_cache = self.make_cache()
+        sqlite_cache.set('a', {'x': 1})
+        sqlite_cache.set('expired', 1, timeout=-1)
+        self.assertEqual(sqlite_cache.get('a'), {'x': 1})
+        self.assertIsNone(sqlite_cache.get('expired'))
+        
+        self.assertFalse(sqlite_cache.add('a', 2))
+        self.assertTrue(sqlite_cache.add('expired', 2))
+        self.assertEqual(sqlite_cache.get('expired'), 2)
+        
+        sqlite_cache.set_many({'b': 1, 'c': None})
+        self.assertEqual(sqlite_cache.get_many(['a', 'b', 'c', 'missing']), {'a': {'x': 1}, 'b': 1, 'c': None})
+        self.assertEqual(sqlite_cache.incr('b', 5), 6)
+        with self.assertRaises(ValueError):
+            sqlite_cache.incr('missing')
+        
+        self.assertTrue(sqlite_cache.delete('a'))
+        self.assertFalse(sqlite_cache.has_key('a'))
+        sqlite_cache.clear()
+        self.assertIsNone(sqlite_cache.get('b'))
+    
+    def test_culls_least_recently_used(self):
+        """اختبار حذف الأقل استخداماً عند تجاوز MAX_ENTRIES"""
+        sqlite_cache = self.make_cache(MAX_ENTRIES=10, CULL_FREQUENCY=5, ACCESS_UPDATE_INTERVAL=0)
+        for i in range(10):
+            sqlite_cache.set(f'key{i}', i)
+            time.sleep(0.002)
+        sqlite_cache.get('key0')  # يصبح الأحدث استخداماً
+        sqlite_cache.set('key10', 10)
+        
+        remaining = sqlite_cache.get_many([f'key{i}' for i in range(11)])
+        self.assertEqual(len(remaining), 9)
+        self.assertIn('key0', remaining)
+        self.assertNotIn('key1', remaining)
+        self.assertNotIn('key2', remaining)
+    
+    def test_concurrent_increments_across_connections(self):
+        """اختبار سلامة incr مع عدة اتصالات (كما في عدة workers)"""
+        self.make_cache().set('counter', 0)
+        
+        def work():
+            worker_cache = self.make_cache()
+            for _ in range(50):
+                worker_cache.incr('counter')
+        
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.make_cache().get('counter'), 200)
+
+
+class CoalescedSessionTestCase(APITestCase):
+    """اختبار أن الجلسات غير المعدلة لا تُكتب وأن تمديد الانتهاء يُجمع"""
+    
+    def setUp(self):
+        cache.clear()
+        reset_expiry_tracking()
+        self.addCleanup(reset_expiry_tracking)
+        User.objects.create_user(username='sess', password='testpass123')
+        self.client.login(username='sess', password='testpass123')
+        self.session_key = self.client.cookies['sessionid'].value
+    
+    def session_writes(self, queries):
+        return [
+            q['sql'] for q in queries.captured_queries
+            if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')
+        ]
+    
+    def test_read_only_requests_do_not_write(self):
+        """اختبار أن الطلبات للقراءة فقط لا تكتب الجلسة"""
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(5):
+                response = self.client.get('/api/check-user-type/')
+                self.assertTrue(response.data['is_authenticated'])
+        self.assertEqual(self.session_writes(queries), [])
+        self.assertEqual(pending_expiry_bumps(), 0)
+        
+        # تاريخ الانتهاء معروف لهذا الـ worker - لا حاجة حتى لقراءة الصف
+        with self.assertNumQueries(0):
+            SessionStore(self.session_key).save()
+    
+    def test_modified_session_is_written(self):
+        """اختبار أن تعديل بيانات الجلسة يُكتب فوراً"""
+        session = SessionStore(self.session_key)
+        session['cart'] = [1, 2]
+        session.save()
+        self.assertEqual(SessionStore(self.session_key)['cart'], [1, 2])
+    
+    @override_settings(SESSION_EXPIRY_BATCH_SIZE=2, SESSION_EXPIRY_FLUSH_INTERVAL=3600)
+    def test_expiry_bumps_are_batched(self):
+        """اختبار تمديد الجلسات القريبة من الانتهاء بـ UPDATE واحد"""
+        from django.contrib.sessions.models import Session
+        from django.utils import timezone
+        from datetime import timedelta
+        
+        other = SessionStore()
+        other['user_id'] = 1
+        other.create()
+        soon = timezone.now() + timedelta(seconds=600)
+        Session.objects.update(expire_date=soon)
+        reset_expiry_tracking()
+        flush_expiry_bumps()  # يبدأ فترة التجميع الآن
+        
+        with CaptureQueriesContext(connection) as queries:
+            SessionStore(self.session_key).save()
+            self.assertEqual(pending_expiry_bumps(), 1)
+            self.assertEqual(Session.objects.get(session_key=self.session_key).expire_date, soon)
+            SessionStore(other.session_key).save()
+        self.assertEqual(pending_expiry_bumps(), 0)
+        writes = self.session_writes(queries)
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('UPDATE'))
+        for session in Session.objects.all():
+            self.assertGreater(session.expire_date, timezone.now() + timedelta(seconds=86000))
+    
+    @override_settings(SESSION_EXPIRY_FLUSH_INTERVAL=7)
+    def test_queued_bump_flushed_by_timer(self):
+        """اختبار أن التمديد المنتظر يُكتب بعد الفترة حتى دون طلب آخر"""
+        from django.contrib.sessions.models import Session
+        from django.utils import timezone
+        from datetime import timedelta
+        
+        Session.objects.update(expire_date=timezone.now() + timedelta(seconds=600))
+        reset_expiry_tracking()
+        flush_expiry_bumps()
+        with mock.patch('restaurant.sessions.threading.Timer') as timer, \
+                mock.patch('restaurant.sessions.connections'):
+            SessionStore(self.session_key).save()
+            SessionStore(self.session_key).save()
+            self.assertEqual(pending_expiry_bumps(), 1)
+            timer.assert_called_once()  # timer واحد لكل دفعة
+            interval, flush = timer.call_args[0]
+            self.assertEqual(interval, 7)
+            flush()
+        self.assertEqual(pending_expiry_bumps(), 0)
+        self.assertGreater(
+            Session.objects.get(session_key=self.session_key).expire_date, timezone.now() + timedelta(seconds=86000)
+        )
+    
+    def test_logout_still_deletes_session(self):
+        """اختبار أن تسجيل الخروج يحذف الجلسة ولا يعيدها تمديد لاحق"""
+        from django.contrib.sessions.models import Session
+        
+        self.client.get('/api/check-user-type/')
+        self.client.post('/api/logout/')
+        self.assertFalse(Session.objects.filter(session_key=self.session_key).exists())
+        flush_expiry_bumps()
+        self.assertFalse(Session.objects.filter(session_key=self.session_key).exists())
+
+
+class AdminRosterTestCase(APITestCase):
+    """اختبار قائمة المدراء المخزنة وإبطالها بالإشارات"""
+    
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='boss', password='testpass123', email='boss@example.com', is_staff=True)
+        self.profile = AdminProfile.objects.create(user=self.admin, admin_email='boss@example.com')
+        self.staff = User.objects.create_user(username='clerk', password='testpass123', is_staff=True)
+        self.customer = User.objects.create_user(username='guest', password='testpass123', email='guest@example.com')
+    
+    def test_checks_and_fan_out_need_no_roster_queries(self):
+        """اختبار أن فحص الصلاحية لا يحتاج استعلاماً وأن الإشعارات INSERT واحد"""
+        get_admin_roster()
+        with self.assertNumQueries(0):
+            self.assertTrue(is_restaurant_admin(self.admin))
+            self.assertFalse(is_restaurant_admin(self.customer))
+            self.assertEqual(staff_user_ids(), [self.admin.pk, self.staff.pk])
+        with self.assertNumQueries(1):
+            send_notification_to_admins("Title", "Message", 'stock_low')
+        self.assertEqual(
+            sorted(Notification.objects.values_list('user_id', flat=True)), [self.admin.pk, self.staff.pk]
+        )
+    
+    def test_admin_profile_changes_invalidate(self):
+        """اختبار أن حذف ملف المدير يسحب الصلاحية فوراً"""
+        self.client.login(username='boss', password='testpass123')
+        self.assertEqual(self.client.get(reverse('admin-cache-metrics')).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.delete()
+        self.assertFalse(is_restaurant_admin(self.admin))
+        self.assertIn(self.client.get(reverse('admin-cache-metrics')).status_code, (401, 403))
+    
+    def test_invalidation_while_loading_is_not_cached(self):
+        """اختبار أن حذف ملف المدير أثناء تحميل القائمة لا يبقي الصلاحية"""
+        from . import roster
+        load = roster._load_roster
+        
+        def load_then_delete():
+            loaded = load()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.profile.delete()
+            return loaded
+        
+        with mock.patch('restaurant.roster._load_roster', load_then_delete):
+            self.assertTrue(is_restaurant_admin(self.admin))
+        self.assertFalse(is_restaurant_admin(self.admin))
+    
+    def test_staff_flag_changes_invalidate(self):
+        """اختبار أن ترقية أو إزالة staff تحدث قائمة المستلمين"""
+        get_admin_roster()
+        self.customer.is_staff = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.save()
+        self.assertIn(self.customer.pk, staff_user_ids())
+        
+        self.staff.is_staff = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.staff.save()
+        self.assertNotIn(self.staff.pk, staff_user_ids())
+    
+    def test_customer_signup_keeps_roster(self):
+        """اختبار أن تسجيل عميل جديد لا يبطل القائمة"""
+        get_admin_roster()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(username='another', password='testpass123')
+        with self.assertNumQueries(0):
+            get_admin_roster()
+
+
+class LoginHashingTestCase(APITestCase):
+    """اختبار التحقق من كلمة المرور خارج الـ worker وحد الطلبات المتزامنة"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='hash', password='testpass123', email='hash@example.com')
+        Customer.objects.create(user=self.user, phone='1', address='Street')
+    
+    def login(self, password='testpass123'):
+        return self.client.post('/api/login/', {'identity': 'hash@example.com', 'password': password}, format='json')
+    
+    def test_login_verified_in_pool(self):
+        """اختبار تسجيل الدخول عبر مجموعة العمليات"""
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(self.login().status_code, 200)
+    
+    @override_settings(LOGIN_HASH_PROCESSES=0)
+    def test_outdated_hash_is_upgraded(self):
+        """اختبار تحديث الـ hash القديم بعد تسجيل دخول ناجح"""
+        from django.contrib.auth.hashers import make_password
+        User.objects.filter(pk=self.user.pk).update(password=make_password('testpass123', hasher='pbkdf2_sha1'))
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+    
+    @override_settings(LOGIN_MAX_PENDING=0)
+    def test_excess_logins_rejected(self):
+        """اختبار رفض تسجيل الدخول بـ 429 عند امتلاء الحد"""
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+    
+    def test_email_lookup_indexed(self):
+        """اختبار وجود فهرس auth_user.email"""
+        with connection.cursor() as cursor:
+            indexes = connection.introspection.get_constraints(cursor, 'auth_user')
+        self.assertTrue(any(index['columns'] == ['email'] and index['index'] for index in indexes.values()))
+
+
+@override_settings(
+    RATELIMIT_BACKEND='restaurant.ratelimit.LocalBackend',
+    RATELIMIT_RATES={'login': '2/m', 'rating': '2/m', 'test': '4/m'},
+)
+class RateLimitTestCase(APITestCase):
+    """اختبار تحديد المعدل بنافذة منزلقة"""
+    
+    def setUp(self):
+        cache.clear()
+        get_backend().reset()
+    
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('10/m'), (10, 60))
+        self.assertEqual(parse_rate('5/10m'), (5, 600))
+        with self.assertRaises(ValueError):
+            parse_rate('often')
+    
+    def test_sliding_window_weights_previous_bucket(self):
+        """اختبار أن الـ bucket السابق يُحسب بقدر تداخله مع النافذة"""
+        with mock.patch('restaurant.ratelimit.time.time', return_value=6000.0):
+            self.assertEqual([hit('test', 'a')[0] for _ in range(5)], [True, True, True, True, False])
+            self.assertTrue(hit('test', 'b')[0])  # عميل آخر
+        # بعد منتصف النافذة التالية: 5 * 0.5 + 1 = 3.5 <= 4
+        with mock.patch('restaurant.ratelimit.time.time', return_value=6090.0):
+            self.assertTrue(hit('test', 'a')[0])
+            allowed, wait = hit('test', 'a')
+            self.assertFalse(allowed)  # 2.5 + 2 > 4
+            self.assertGreaterEqual(wait, 1)
+    
+    def test_cache_backend_shared_between_workers(self):
+        """اختبار أن العدادات في الـ cache مشتركة بين نسخ مختلفة (workers)"""
+        first, second = CacheBackend(), CacheBackend()
+        self.assertEqual(first.incr('ratelimit:test:shared', 60), 1)
+        self.assertEqual(second.incr('ratelimit:test:shared', 60), 2)
+        self.assertEqual(first.get('ratelimit:test:shared'), 2)
+    
+    def test_drf_throttle_per_user(self):
+        """اختبار تحديد معدل التقييمات لكل مستخدم"""
+        category = Category.objects.create(name="Pizza")
+        dish = Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=category)
+        user = User.objects.create_user(username='rater', password='testpass123')
+        Customer.objects.create(user=user, phone='1', address='Street')
+        self.client.force_authenticate(user)
+        
+        statuses = [
+            self.client.post('/api/add-rating/', {'dish_id': dish.id, 'rating': 4}, format='json').status_code
+            for _ in range(3)
+        ]
+        self.assertNotIn(429, statuses[:2])
+        self.assertEqual(statuses[2], 429)
+    
+    def test_login_decorator(self):
+        """اختبار تحديد معدل تسجيل الدخول لكل IP"""
+        statuses = [
+            self.client.post('/api/login/', {'identity': 'nobody', 'password': 'x'}, format='json')
+            for _ in range(3)
+        ]
+        self.assertEqual([r.status_code for r in statuses], [401, 401, 429])
+        self.assertIn('Retry-After', statuses[2])
+    
+    def test_forged_forwarded_for_shares_one_bucket(self):
+        """اختبار أن X-Forwarded-For المزور لا يعطي العميل هوية جديدة"""
+        statuses = [
+            self.client.post(
+                '/api/login/', {'identity': 'nobody', 'password': 'x'}, format='json',
+                HTTP_X_FORWARDED_FOR=f'10.0.0.{i}',
+            ).status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [401, 401, 429])
+        request = APIRequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.2.3.4', REMOTE_ADDR='192.0.2.1')
+        self.assertEqual(ip_key(request), 'ip:192.0.2.1')
+        # خلف proxy موثوق واحد: العنوان الذي أضافه الـ proxy
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            request = APIRequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 203.0.113.7')
+            self.assertEqual(ip_key(request), 'ip:203.0.113.7')
+    
+    @override_settings(RATELIMIT_ENABLED=False)
+    def test_disabled(self):
+        self.assertTrue(all(hit('test', 'a')[0] for _ in range(10)))
+
+
+class BulkOrderCreationTestCase(APITestCase):
+    """اختبار إنشاء الطلب بعدد ثابت من الاستعلامات"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='bulk', password='testpass123')
+        self.customer = Customer.objects.create(user=self.user, phone='1', address='Street')
+        category = Category.objects.create(name="Pizza")
+        self.dishes = [
+            Dish.objects.create(name=f"Dish {i}", price=Decimal('2.50') + i, category=category, stock_quantity=50)
+            for i in range(30)
+        ]
+        self.client.force_authenticate(self.user)
+    
+    def order(self, dishes, quantity=2):
+        return self.client.post(reverse('order-list'), {
+            'delivery_address': 'Street',
+            'items': [{'dish_id': dish.id, 'quantity': quantity} for dish in dishes],
+        }, format='json')
+    
+    def test_query_count_independent_of_items(self):
+        """اختبار أن طلب 30 طبقاً يكلف نفس عدد استعلامات طلب بطبق واحد"""
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(self.order(self.dishes[:1]).status_code, 201)
+        with CaptureQueriesContext(connection) as thirty:
+            response = self.order(self.dishes)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(thirty), len(one))
+        self.assertEqual([item['dish']['id'] for item in response.data['items']], [dish.id for dish in self.dishes])
+        
+        order = Order.objects.order_by('-id').first()
+        self.assertEqual(order.orderitem_set.count(), 30)
+        self.assertEqual(order.total_amount, sum((dish.price * 2 for dish in self.dishes), Decimal('0')))
+    
+    def test_client_price_ignored(self):
+        """اختبار أن السعر يؤخذ من الطبق وليس من العميل"""
+        response = self.client.post(reverse('order-list'), {
+            'delivery_address': 'Street',
+            'items': [{'dish_id': self.dishes[0].id, 'quantity': 1, 'price': '0.01'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(OrderItem.objects.get().price, self.dishes[0].price)
+    
+    def test_invalid_items_create_nothing(self):
+        """اختبار رفض الطبق غير الموجود أو الكمية الزائدة دون إنشاء أي شيء"""
+        response = self.client.post(reverse('order-list'), {
+            'delivery_address': 'Street', 'items': [{'dish_id': 99999, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        # نفس الطبق في سطرين: المجموع يتجاوز المخزون
+        self.assertEqual(self.order([self.dishes[0], self.dishes[0]], quantity=30).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+    
+    def test_enhanced_serializer_reduces_stock(self):
+        serializer = EnhancedOrderCreateSerializer(data={
+            'delivery_address': 'Street', 'items': [{'dish_id': self.dishes[0].id, 'quantity': 3}],
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        order = serializer.save(customer=self.customer)
+        self.assertEqual(order.total_amount, Decimal('7.50'))
+        self.dishes[0].refresh_from_db()
+        self.assertEqual(self.dishes[0].stock_quantity, 47)
+
+
+class StockReservationTestCase(APITestCase):
+    """اختبار تقليل المخزون الشرطي الذري لكل عناصر الطلب"""
+    
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Pizza")
+        self.margherita = Dish.objects.create(
+            name="Margherita", price=Decimal('9.50'), category=category, stock_quantity=10, low_stock_threshold=5
+        )
+        self.diavola = Dish.objects.create(name="Diavola", price=Decimal('11.00'), category=category, stock_quantity=3)
+    
+    def test_single_conditional_update(self):
+        """اختبار تحديث كل الأطباق بـ UPDATE واحد"""
+        with CaptureQueriesContext(connection) as queries:
+            dishes = Dish.reserve_stock({self.margherita.id: 4, self.diavola.id: 3})
+        self.assertEqual(dishes[self.margherita.id].stock_quantity, 6)
+        self.assertEqual(dishes[self.diavola.id].stock_quantity, 0)
+        self.assertEqual(len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+    
+    def test_all_or_nothing(self):
+        """اختبار أن نقص طبق واحد لا يغير مخزون أي طبق"""
+        self.assertIsNone(Dish.reserve_stock({self.margherita.id: 4, self.diavola.id: 4}))
+        self.assertEqual(
+            dict(Dish.objects.values_list('name', 'stock_quantity')), {"Margherita": 10, "Diavola": 3}
+        )
+    
+    def test_low_stock_alert_once_when_crossing(self):
+        """اختبار تنبيه المخزون المنخفض عند عبور الحد مرة واحدة"""
+        User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        user = User.objects.create_user(username='buyer', password='testpass123')
+        Customer.objects.create(user=user, phone='1', address='Street')
+        self.client.force_authenticate(user)
+        
+        def order(quantity):
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(reverse('order-list'), {
+                    'delivery_address': 'Street', 'items': [{'dish_id': self.margherita.id, 'quantity': quantity}],
+                }, format='json')
+        
+        self.assertEqual(order(4).status_code, 201)  # 6 متبقية - فوق الحد
+        self.assertFalse(Notification.objects.filter(notification_type='stock_low').exists())
+        self.assertEqual(order(2).status_code, 201)  # 4 متبقية - عبور الحد
+        self.assertEqual(Notification.objects.filter(notification_type='stock_low').count(), 1)
+        self.assertEqual(order(1).status_code, 201)  # ما زال منخفضاً - لا تنبيه جديد
+        self.assertEqual(Notification.objects.filter(notification_type='stock_low').count(), 1)
+        self.assertEqual(order(9).status_code, 400)
+        self.margherita.refresh_from_db()
+        self.assertEqual(self.margherita.stock_quantity, 3)
+
+
+class StripeOrderStockTestCase(TestCase):
+    """اختبار حجز المخزون لطلبات Stripe المدفوعة"""
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='payer', password='testpass123')
+        self.customer = Customer.objects.create(user=self.user, phone='1', address='Street')
+        category = Category.objects.create(name="Pizza")
+        self.dish = Dish.objects.create(name="Margherita", price=Decimal('10.00'), category=category, stock_quantity=3)
+    
+    def session(self, quantity):
+        return {
+            'id': 'cs_test_1',
+            'metadata': {
+                'customer_id': str(self.customer.id),
+                'delivery_address': 'Street',
+                'items': json.dumps([{'dish_id': self.dish.id, 'quantity': quantity}]),
+                'total_amount': str(10.0 * quantity + 3.99),
+            },
+        }
+    
+    def test_paid_order_reserves_stock(self):
+        """اختبار أن الطلب المدفوع يخصم من المخزون مرة واحدة"""
+        order, _ = _create_order_from_stripe_session(self.session(2))
+        self.assertEqual(order.status, 'pending')
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.stock_quantity, 1)
+        
+        # الـ webhook وصفحة النجاح يصلان لنفس الجلسة
+        again, _ = _create_order_from_stripe_session(self.session(2))
+        self.assertEqual(again, order)
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.stock_quantity, 1)
+    
+    def test_shortage_cancels_paid_order_and_notifies(self):
+        """اختبار أن نقص المخزون بعد الدفع يلغي الطلب ويطلب الاسترداد دون خصم"""
+        admin = User.objects.create_user(username='boss', password='testpass123', is_staff=True)
+        order, message = _create_order_from_stripe_session(self.session(5))
+        
+        self.assertEqual((order.status, order.payment_status), ('cancelled', 'paid'))
+        self.assertIn('refunded', message)
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.stock_quantity, 3)
+        self.assertTrue(Notification.objects.filter(user=self.user, title="Order Cancelled").exists())
+        self.assertTrue(Notification.objects.filter(user=admin, title="Refund Needed").exists())
+
+
+class ConcurrentCheckoutTestCase(TransactionTestCase):
+    """اختبار عدم بيع أكثر من المخزون مع طلبات متوازية عبر مسار إنشاء الطلب كاملاً"""
+    
+    # قاعدة SQLite المشتركة في الذاكرة ترفض الأقفال فوراً بدل الانتظار
+    MAX_ATTEMPTS = 50
+    
+    def checkout(self, customer, items):
+        """'created' أو 'rejected' أو 'locked' بعد MAX_ATTEMPTS محاولة"""
+        for attempt in range(self.MAX_ATTEMPTS):
+            serializer = EnhancedOrderCreateSerializer(data={'delivery_address': 'Street', 'items': items})
+            try:
+                if not serializer.is_valid():
+                    return 'rejected'
+                serializer.save(customer=customer)
+                return 'created'
+            except serializers.ValidationError:
+                return 'rejected'
+            except OperationalError:
+                # المعاملة تراجعت بالكامل - إعادتها آمنة
+                time.sleep(0.002 * (attempt + 1))
+        return 'locked'
+    
+    def test_parallel_checkouts_never_oversell(self):
+        category = Category.objects.create(name="Pizza")
+        margherita = Dish.objects.create(name="Margherita", price=Decimal('9.50'), category=category, stock_quantity=25)
+        diavola = Dish.objects.create(name="Diavola", price=Decimal('11.00'), category=category, stock_quantity=40)
+        user = User.objects.create_user(username='buyer', password='testpass123')
+        customer = Customer.objects.create(user=user, phone='1', address='Street')
+        # لا موظفين: تنبيه المخزون بعد الـ commit لا يلمس قاعدة البيانات
+        get_admin_roster()
+        items = [{'dish_id': margherita.id, 'quantity': 1}, {'dish_id': diavola.id, 'quantity': 2}]
+        start = threading.Barrier(8)
+        results = []
+        
+        def worker():
+            start.wait()
+            try:
+                for _ in range(10):
+                    results.append(self.checkout(customer, items))
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        # 80 محاولة: diavola (40 / 2) يسمح بـ 20 طلباً فقط
+        self.assertEqual(len(results), 80)
+        self.assertEqual(results.count('locked'), 0)
+        self.assertEqual(results.count('created'), 20)
+        self.assertEqual(Order.objects.count(), 20)
+        self.assertEqual(OrderItem.objects.count(), 40)
+        margherita.refresh_from_db()
+        diavola.refresh_from_db()
+        self.assertEqual((margherita.stock_quantity, diavola.stock_quantity), (5, 0))
@@ -0,0 +1,146 @@
+"""
+Signed access and refresh tokens (opt-in with ``AUTH_TOKENS_ENABLED``).
+
+Access tokens are ``django.core.signing`` payloads carrying the user id,
+the roles and the ids of the customer and admin profiles - no name or email,
+the payload is only signed, not encrypted. They are verified with the HMAC
+signature and timestamp alone - no session row, cache or database read - so
+any worker sharing ``SECRET_KEY`` can authenticate them; other user columns
+are loaded on first access. They cannot be revoked and therefore live for
+``AUTH_ACCESS_TOKEN_LIFETIME`` seconds only.
+
+Refresh tokens live for ``AUTH_REFRESH_TOKEN_LIFETIME`` seconds. Refreshing
+reads the user from the database, refuses inactive users, tokens issued
+before a password change and tokens issued before the user's last logout
+(``revoke_tokens`` bumps the per-user ``TokenVersion``; a logout on one
+device therefore ends the token sessions of every device), and returns a
+new pair.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .identity import build_principal
+
+User = get_user_model()
+
+ACCESS_SALT = 'restaurant.tokens.access'
+REFRESH_SALT = 'restaurant.tokens.refresh'
+
+
+def tokens_enabled():
+    return getattr(settings, 'AUTH_TOKENS_ENABLED', False)
+
+
+def roles_for(principal):
+    roles = []
+    if principal['customer_id'] is not None:
+        roles.append('customer')
+    if principal['admin_profile'] is not None or principal['user']['is_superuser']:
+        roles.append('admin')
+    if principal['admin_profile'] is not None and principal['admin_profile']['is_super_admin']:
+        roles.append('super_admin')
+    if principal['user']['is_staff']:
+        roles.append('staff')
+    if principal['user']['is_superuser']:
+        roles.append('superuser')
+    return roles
+
+
+def access_principal(payload):
+    """Principal of a verified access token for ``identity.user_from_principal`` (other columns deferred)"""
+    roles = payload['roles']
+    return {
+        'user': {
+            'id': payload['uid'], 'is_active': True,
+            'is_staff': 'staff' in roles, 'is_superuser': 'superuser' in roles,
+        },
+        'customer_id': payload['cid'],
+        'admin_profile': {
+            'id': payload['aid'], 'is_super_admin': 'super_admin' in roles,
+        } if payload['aid'] is not None else None,
+    }
+
+
+def _password_fingerprint(user):
+    # يتغير مع كلمة المرور، ولا يكشف الـ hash نفسه
+    return salted_hmac(REFRESH_SALT, user.password, algorithm='sha256').hexdigest()[:16]
+
+
+def _token_version(user):
+    from .models import TokenVersion
+
+    try:
+        return user.tokenversion.version
+    except TokenVersion.DoesNotExist:
+        return 0
+
+
+def revoke_tokens(user):
+    """Invalidate every refresh token issued to ``user`` so far (logout)"""
+    from .models import TokenVersion
+
+    if not TokenVersion.objects.filter(user_id=user.pk).update(version=F('version') + 1):
+        TokenVersion.objects.get_or_create(user_id=user.pk, defaults={'version': 1})
+
+
+def issue_tokens(user, admin_profile=None):
+    """A new access/refresh pair for ``user``, shaped for a login response"""
+    principal = build_principal(user, admin_profile)
+    access = signing.dumps({
+        'typ': 'access',
+        'uid': user.pk,
+        'roles': roles_for(principal),
+        'cid': principal['customer_id'],
+        'aid': principal['admin_profile']['id'] if principal['admin_profile'] else None,
+    }, salt=ACCESS_SALT)
+    refresh = signing.dumps({
+        'typ': 'refresh', 'uid': user.pk, 'pwd': _password_fingerprint(user), 'ver': _token_version(user),
+    }, salt=REFRESH_SALT)
+    return {
+        'access_token': access,
+        'refresh_token': refresh,
+        'token_type': 'Bearer',
+        'expires_in': settings.AUTH_ACCESS_TOKEN_LIFETIME,
+    }
+
+
+def verify_access_token(token):
+    """
+    The payload of a valid access token. Raises ``signing.SignatureExpired``
+    or ``signing.BadSignature``.
+    """
+    payload = signing.loads(token, salt=ACCESS_SALT, max_age=settings.AUTH_ACCESS_TOKEN_LIFETIME)
+    if payload.get('typ') != 'access':
+        raise signing.BadSignature('Not an access token')
+    return payload
+
+
+def refresh_tokens(token):
+    """
+    A new token pair for a valid refresh token. Raises ``signing.BadSignature``
+    (including expiry) when the token or its user is no longer valid.
+    """
+    from .models import AdminProfile
+
+    payload = signing.loads(token, salt=REFRESH_SALT, max_age=settings.AUTH_REFRESH_TOKEN_LIFETIME)
+    if payload.get('typ') != 'refresh':
+        raise signing.BadSignature('Not a refresh token')
+
+    user = (
+        User.objects.select_related('customer', 'adminprofile', 'tokenversion')
+        .filter(pk=payload['uid'], is_active=True).first()
+    )
+    if (
+        user is None
+        or not constant_time_compare(payload['pwd'], _password_fingerprint(user))
+        or payload.get('ver', 0) != _token_version(user)
+    ):
+        raise signing.BadSignature('Refresh token revoked')
+
+    admin_profile = getattr(user, 'adminprofile', None)
+    if admin_profile is None:
+        admin_profile = AdminProfile.objects.filter(admin_email=user.email).first()
+    return issue_tokens(user, admin_profile)
@@ -1,8 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from django.http import JsonResponse
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
+from drf_spectacular.views import SpectacularSwaggerView, SpectacularRedocView
 from . import views
+from .schema import CachedSpectacularAPIView
 
 def api_root(request):
     """API Root - Welcome message and available endpoints"""
@@ -18,6 +19,7 @@ def api_root(request):
             'register': '/api/register/',
             'dishes': '/api/dishes/',
             'categories': '/api/categories/',
+            'menu': '/api/menu/',
             'orders': '/api/orders/',
             'stripe_checkout': '/api/stripe/create-checkout-session/',
             'stripe_config': '/api/stripe/config/',
@@ -51,17 +53,20 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/restaurant-info/', views.restaurant_info, name='restaurant-info'),
     path('api/menu-overview/', views.menu_overview, name='menu-overview'),
+    path('api/menu/', views.menu_snapshot, name='menu-snapshot'),
     path('api/homepage-stats/', views.homepage_stats, name='homepage-stats'),
     path('api/register/', views.register_user, name='register'),
     path('api/send-verification/', views.send_verification_code, name='send-verification'),
     path('api/verify-code/', views.verify_code, name='verify-code'),
     path('api/login/', views.customer_login, name='customer-login'),
     path('api/logout/', views.user_logout, name='user-logout'),
+    path('api/token/refresh/', views.refresh_access_token, name='token-refresh'),
     path('api/profile/', views.user_profile, name='profile'),
     
     # 🛡️ Admin API
     path('api/admin/', include(admin_router.urls)),
     path('api/admin/dashboard/', views.admin_dashboard_stats, name='admin-dashboard'),
+    path('api/admin/cache-metrics/', views.cache_metrics_view, name='admin-cache-metrics'),
     path('api/admin/login/', views.admin_login, name='admin-login'),
     
     # 🔐 Authentication
@@ -80,7 +85,7 @@ urlpatterns = [
     path('api/stripe/webhook/', views.stripe_webhook, name='stripe-webhook'),
     
     # 📚 API Documentation
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('api/schema/', CachedSpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
 ] 
\ No newline at end of file
@@ -1,24 +1,22 @@
 from django.core.cache import cache
 from django.contrib.auth.models import User
-from django.db.models import Count, Sum, Avg
+from django.db.models import Count, Sum, Avg, Q
 from django.utils import timezone
 from datetime import datetime, timedelta
 import logging
 from django.utils.deprecation import MiddlewareMixin
 
 from .models import Dish, Category, Order, OrderAnalytics, Notification
+from .caching import cached_computation, get_tag_generation, invalidate_tags
+from .roster import staff_user_ids
 
 logger = logging.getLogger('restaurant')
 
 # ===== CACHING UTILITIES =====
 
 def get_popular_dishes(limit=10):
-    """الحصول على الأطباق الشعبية مع caching"""
-    cache_key = f'popular_dishes_{limit}'
-    dishes = cache.get(cache_key)
-    
-    if not dishes:
-        from django.db.models import Count
+    """الحصول على الأطباق الشعبية مع caching (إعادة الحساب في worker واحد فقط)"""
+    def compute():
         dishes = list(
             Dish.objects
             .filter(is_available=True)
@@ -26,43 +24,52 @@ def get_popular_dishes(limit=10):
             .order_by('-order_count')[:limit]
             .values('id', 'name', 'price', 'order_count')
         )
-        cache.set(cache_key, dishes, 1800)  # 30 minutes
         logger.info(f"Popular dishes cached: {len(dishes)} items")
+        return dishes
     
-    return dishes
+    return cached_computation(f'popular_dishes_{limit}', compute, 1800, tags=['menu', 'order_items'])  # 30 minutes
+
+def annotate_dish_counts(queryset):
+    """إضافة عدد الأطباق والأطباق المتاحة لكل فئة في نفس الاستعلام"""
+    return queryset.annotate(
+        dishes_count=Count('dish'),
+        available_dishes_count=Count('dish', filter=Q(dish__is_available=True))
+    )
+
+def get_category_dish_counts():
+    """عدد الأطباق لكل الفئات في استعلام واحد مجمع: {category_id: (total, available)}"""
+    rows = (
+        Dish.objects
+        .order_by()
+        .values('category_id')
+        .annotate(total=Count('id'), available=Count('id', filter=Q(is_available=True)))
+    )
+    return {row['category_id']: (row['total'], row['available']) for row in rows}
 
 def get_category_stats():
-    """إحصائيات الفئات مع caching"""
-    cache_key = 'category_stats'
-    stats = cache.get(cache_key)
-    
-    if not stats:
+    """إحصائيات الفئات مع caching (إعادة الحساب في worker واحد فقط)"""
+    def compute():
         stats = list(
-            Category.objects
-            .filter(is_active=True)
-            .annotate(
-                dishes_count=Count('dish'),
-                available_dishes_count=Count('dish', filter=models.Q(dish__is_available=True))
-            )
+            annotate_dish_counts(Category.objects.filter(is_active=True))
             .values('id', 'name', 'dishes_count', 'available_dishes_count')
         )
-        cache.set(cache_key, stats, 900)  # 15 minutes
         logger.info(f"Category stats cached: {len(stats)} categories")
+        return stats
     
-    return stats
+    return cached_computation('category_stats', compute, 900, tags=['menu'])  # 15 minutes
+
+def get_catalog_version():
+    """نسخة الكتالوج (الفئات والأطباق) المشتركة بين كل الـ workers - هي generation وسم menu"""
+    return str(get_tag_generation('menu'))
+
+def bump_catalog_version():
+    """تغيير نسخة الكتالوج عند أي تعديل على الأطباق أو الفئات"""
+    invalidate_tags('menu')
+    return get_catalog_version()
 
 def invalidate_dish_cache(dish_id):
-    """إلغاء cache الطبق عند التحديث"""
-    cache_keys = [
-        f'dish_ratings_count_{dish_id}',
-        'popular_dishes_10',
-        'popular_dishes_5',
-        'category_stats',
-    ]
-    
-    for key in cache_keys:
-        cache.delete(key)
-    
+    """إلغاء cache الطبق عند التحديث (كل المدخلات الموسومة بالطبق أو بالقائمة)"""
+    invalidate_tags(f'dish:{dish_id}', 'menu')
     logger.info(f"Cache invalidated for dish {dish_id}")
 
 # ===== NOTIFICATION UTILITIES =====
@@ -93,37 +100,34 @@ def send_order_notifications(order):
     )
     
     # إشعار للإدارة
-    admin_users = User.objects.filter(is_staff=True)
-    for admin in admin_users:
-        admin_notification = create_notification(
-            user=admin,
-            title="طلب جديد",
-            message=f"طلب جديد #{order.id} من {order.customer.user.get_full_name()}",
-            notification_type="order_placed"
-        )
+    send_notification_to_admins(
+        title="طلب جديد",
+        message=f"طلب جديد #{order.id} من {order.customer.user.get_full_name()}",
+        notification_type="order_placed"
+    )
 
 def send_stock_alert(dish):
     """إرسال تنبيه انخفاض المخزون"""
     if dish.is_low_stock:
-        admin_users = User.objects.filter(is_staff=True)
-        for admin in admin_users:
-            create_notification(
-                user=admin,
-                title="تنبيه: مخزون منخفض",
-                message=f"الطبق '{dish.name}' مخزونه منخفض ({dish.stock_quantity} قطعة)",
-                notification_type="stock_low"
-            )
+        send_notification_to_admins(
+            title="تنبيه: مخزون منخفض",
+            message=f"الطبق '{dish.name}' مخزونه منخفض ({dish.stock_quantity} قطعة)",
+            notification_type="stock_low"
+        )
 
 def send_notification_to_admins(title, message, notification_type):
-    """Helper to send a notification to all staff users."""
-    admin_users = User.objects.filter(is_staff=True)
-    for admin in admin_users:
-        create_notification(
-            user=admin,
-            title=title,
-            message=message,
-            notification_type=notification_type
-        )
+    """Helper to send a notification to all staff users (cached roster + one INSERT)."""
+    admin_ids = staff_user_ids()
+    try:
+        notifications = Notification.objects.bulk_create([
+            Notification(user_id=user_id, title=title, message=message, notification_type=notification_type)
+            for user_id in admin_ids
+        ])
+        logger.info(f"Notification created for {len(notifications)} admins: {title}")
+        return notifications
+    except Exception as e:
+        logger.error(f"Error creating admin notifications: {e}")
+        return []
 
 # ===== ANALYTICS UTILITIES =====
 
@@ -1,20 +1,28 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_http_methods
 from django.contrib.auth import login, authenticate
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import (
+    action, api_view, authentication_classes, permission_classes, renderer_classes, throttle_classes
+)
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from django.utils.decorators import method_decorator
 from django.middleware.csrf import get_token
 from django.conf import settings
+from django.core import signing
 import stripe
 import json
 import logging
+import os
 import time
 from .models import (
     Category, Dish, Customer, Order, OrderItem, DishRating, 
@@ -26,11 +34,25 @@ from .serializers import (
     RestaurantSerializer, UserSerializer, NotificationSerializer,
     OrderAnalyticsSerializer, EnhancedOrderCreateSerializer
 )
-from .filters import DishFilter, CategoryFilter, OrderFilter, DishRatingFilter
+from .filters import DishFilter, CategoryFilter, OrderFilter, DishRatingFilter, SearchRankOrderingFilter
+from django_filters.rest_framework import DjangoFilterBackend
 from .utils import (
     get_popular_dishes, send_order_notifications, send_stock_alert,
-    calculate_daily_analytics, invalidate_dish_cache, send_notification_to_admins
+    calculate_daily_analytics, invalidate_dish_cache, send_notification_to_admins,
+    annotate_dish_counts
 )
+from .caching import cached_computation
+from .identity import get_identity, get_or_create_customer, get_request_user
+from .roster import is_admin_email, is_restaurant_admin
+from .passwords import LoginBusy, acheck_user_password
+from .ratelimit import CheckoutThrottle, RatingThrottle, RegisterThrottle, VerificationThrottle, ratelimit
+from .tokens import issue_tokens, refresh_tokens, revoke_tokens, tokens_enabled
+from .cache_metrics import metrics as cache_metrics, prometheus_text
+from .menu_snapshot import get_menu_snapshot
+from .conditional import ConditionalGetMixin, catalog_validators, not_modified_response, set_validators
+from .sparse import SparseQuerysetMixin
+from .fast_serializers import CompiledDishSerializer, CompiledListMixin
+from .pagination import DishRatingPagination, NotificationPagination, OrderPagination
 from django.db.models import Count, Avg, Sum
 
 # Configure logging
@@ -53,36 +75,59 @@ class IsRestaurantAdmin(permissions.BasePermission):
         if not request.user or not request.user.is_authenticated:
             return False
         
-        # Check if user has admin profile with valid admin email
-        return AdminProfile.is_admin_email(request.user.email) or request.user.is_superuser
+        # Check if user has admin profile with valid admin email (cached roster - no query)
+        return is_restaurant_admin(request.user)
 
 # ========================================
 # 🎯 CUSTOMER VIEWS (Public & Customer)
 # ========================================
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Category.objects.filter(is_active=True).prefetch_related('dish_set')
+class CategoryViewSet(ConditionalGetMixin, SparseQuerysetMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = annotate_dish_counts(Category.objects.filter(is_active=True))
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
     filterset_class = CategoryFilter
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'created_at']
     ordering = ['name']
+    
+    def get_validator_querysets(self):
+        # أعداد الأطباق جزء من الاستجابة
+        return [Category.objects.all(), Dish.objects.all()]
 
-class DishViewSet(viewsets.ReadOnlyModelViewSet):
+class DishViewSet(ConditionalGetMixin, SparseQuerysetMixin, CompiledListMixin, viewsets.ReadOnlyModelViewSet):
     queryset = (
         Dish.objects
         .filter(is_available=True)
         .select_related('category')
-        .prefetch_related('dishrating_set')
     )
     serializer_class = DishSerializer
+    compiled_serializer_class = CompiledDishSerializer
     permission_classes = [AllowAny]
+    # البحث (?search=) يتم عبر DishFilter وفهرس FTS5 بدلاً من SearchFilter
+    filter_backends = [DjangoFilterBackend, SearchRankOrderingFilter]
     filterset_class = DishFilter
-    search_fields = ['name', 'description', 'ingredients']
     ordering_fields = ['name', 'price', 'created_at', 'average_rating']
     ordering = ['name']
     
+    def get_validator_querysets(self):
+        # كل الأطباق (وليس المتاحة فقط) حتى يظهر إخفاء طبق، والفئات المتداخلة
+        return [Dish.objects.all(), Category.objects.all()]
+    
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        facets = self.get_facets()
+        if facets is not None:
+            response.data['facets'] = facets
+        return response
+    
+    def get_facets(self):
+        """أعداد الـ facets للبحث الحالي عند طلب ?facets=true"""
+        filterset = DjangoFilterBackend().get_filterset(self.request, self.get_queryset(), self)
+        if filterset is None or not filterset.is_valid() or not filterset.form.cleaned_data.get('facets'):
+            return None
+        return filterset.get_facets()
+    
     @action(detail=False, methods=['get'])
     def popular(self, request):
         """الأطباق الشعبية"""
@@ -100,9 +145,12 @@ class DishViewSet(viewsets.ReadOnlyModelViewSet):
             order_count=Count('orderitem')
         ).filter(
             total_ordered__isnull=False
-        ).order_by('-total_ordered')[:10]
+        ).order_by('-total_ordered', 'id')
         
-        serializer = self.get_serializer(dishes, many=True)
+        compiled = CompiledDishSerializer(self.get_serializer_context())
+        if compiled.supported:
+            return Response(compiled.serialize(compiled.values(dishes)[:10]))
+        serializer = self.get_serializer(dishes[:10], many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
@@ -130,7 +178,13 @@ class DishViewSet(viewsets.ReadOnlyModelViewSet):
         dish = self.get_object()
         
         if request.method == 'GET':
-            ratings = DishRating.objects.filter(dish=dish).order_by('-created_at')
+            ratings = DishRating.objects.filter(dish=dish).order_by('-created_at', '-id')
+            # الترقيم بالمؤشر اختياري هنا حتى لا تتغير الاستجابة (قائمة كاملة) للعملاء الحاليين
+            paginator = DishRatingPagination()
+            if paginator.use_cursor(request):
+                page = paginator.paginate_queryset(ratings, request)
+                serializer = DishRatingSerializer(page, many=True)
+                return paginator.get_paginated_response(serializer.data)
             serializer = DishRatingSerializer(ratings, many=True)
             return Response(serializer.data)
         
@@ -149,19 +203,19 @@ class DishViewSet(viewsets.ReadOnlyModelViewSet):
                     address=''
                 )
             
-            # Create the review
+            # Create the review (aggregates on the dish are updated by DishRating.save)
             data = request.data.copy()
-            data['dish'] = dish.id
-            data['customer'] = customer.id
+            data['dish_id'] = dish.id
             
             serializer = DishRatingSerializer(data=data)
             if serializer.is_valid():
-                serializer.save()
+                serializer.save(dish=dish, customer=customer)
+                dish.refresh_from_db(fields=['rating_count', 'rating_sum', 'average_rating'])
                 return Response(serializer.data, status=201)
             else:
                 return Response(serializer.errors, status=400)
 
-class RestaurantViewSet(viewsets.ReadOnlyModelViewSet):
+class RestaurantViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Restaurant.objects.filter(is_active=True)
     serializer_class = RestaurantSerializer
     permission_classes = [AllowAny]
@@ -170,10 +224,12 @@ class RestaurantViewSet(viewsets.ReadOnlyModelViewSet):
 class NotificationViewSet(viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NotificationPagination
+    ordering = ['-created_at', '-id']
     
     def get_queryset(self):
         """عرض إشعارات المستخدم فقط"""
-        return Notification.objects.filter(user=self.request.user).order_by('-created_at')
+        return Notification.objects.filter(user=self.request.user).order_by('-created_at', '-id')
     
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
@@ -218,41 +274,25 @@ class OrderAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
         serializer = self.get_serializer(analytics)
         return Response(serializer.data)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [AllowAny]  # Changed to handle session authentication manually
+    pagination_class = OrderPagination
+    ordering = ['-order_date', '-id']
     
     def get_queryset(self):
-        # Try to get authenticated user
-        current_user = self.request.user
-        
-        # If not authenticated, try session-based authentication
-        if not current_user or current_user.is_anonymous:
-            session_key = self.request.headers.get('X-Session-Key')
-            if session_key:
-                try:
-                    from django.contrib.sessions.models import Session
-                    session = Session.objects.get(session_key=session_key)
-                    session_data = session.get_decoded()
-                    user_id = session_data.get('_auth_user_id')
-                    if user_id:
-                        current_user = User.objects.get(id=user_id)
-                        logger.info(f"Found user via session: {current_user.username}")
-                except Exception as e:
-                    logger.warning(f"Session authentication failed: {e}")
-                    return Order.objects.none()
+        # المستخدم من المصادقة أو من الجلسة (يُحل مرة واحدة لكل طلب)
+        current_user = get_request_user(self.request)
         
         # If still no user, return empty
-        if not current_user or current_user.is_anonymous:
+        if current_user is None:
             logger.warning("No authenticated user found for orders")
             return Order.objects.none()
             
         # Get customer and their orders
         try:
             customer = current_user.customer
-            orders = Order.objects.filter(customer=customer).order_by('-order_date')
-            logger.info(f"Found {orders.count()} orders for user {current_user.username}")
-            return orders
+            return Order.objects.filter(customer=customer).order_by('-order_date', '-id')
         except Customer.DoesNotExist:
             logger.warning(f"No customer found for user {current_user.username}")
             # Try to create customer profile if missing
@@ -264,14 +304,14 @@ class OrderViewSet(viewsets.ModelViewSet):
                 )
                 logger.info(f"Created customer profile for user {current_user.username}")
                 # Return orders after creating customer
-                return Order.objects.filter(customer__user=current_user).order_by('-order_date')
+                return Order.objects.filter(customer__user=current_user).order_by('-order_date', '-id')
             except Exception as e:
                 logger.error(f"Failed to create customer for user {current_user.username}: {e}")
                 return Order.objects.none()
     
     def get_serializer_class(self):
         if self.action == 'create':
-            return OrderCreateSerializer
+            return EnhancedOrderCreateSerializer
         return OrderSerializer
     
     def perform_create(self, serializer):
@@ -295,18 +335,15 @@ class DishRatingViewSet(viewsets.ModelViewSet):
         return DishRating.objects.none()
     
     def perform_create(self, serializer):
-        customer, created = Customer.objects.get_or_create(
-            user=self.request.user,
-            defaults={'phone': '', 'address': ''}
-        )
+        customer = get_or_create_customer(self.request.user)
         serializer.save(customer=customer)
 
 # ========================================
 # 🛡️ ADMIN VIEWS (Staff Only)
 # ========================================
 
-class AdminCategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all()
+class AdminCategoryViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
+    queryset = annotate_dish_counts(Category.objects.all())
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]  # Temporarily allow any for testing
 
@@ -314,7 +351,7 @@ class AdminCategoryViewSet(viewsets.ModelViewSet):
         kwargs['partial'] = True
         return super().update(request, *args, **kwargs)
 
-class AdminDishViewSet(viewsets.ModelViewSet):
+class AdminDishViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Dish.objects.all()
     serializer_class = DishSerializer
     permission_classes = [AllowAny]  # Temporarily allow any for testing
@@ -374,10 +411,12 @@ class AdminDishViewSet(viewsets.ModelViewSet):
             'is_available': dish.is_available
         })
 
-class AdminOrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+class AdminOrderViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.order_by('-order_date', '-id')
     serializer_class = OrderSerializer
     permission_classes = [AllowAny]  # Temporarily allow any for testing
+    pagination_class = OrderPagination
+    ordering = ['-order_date', '-id']
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
@@ -450,26 +489,82 @@ class AdminRestaurantViewSet(viewsets.ModelViewSet):
 @permission_classes([AllowAny])
 def restaurant_info(request):
     """Get basic restaurant information"""
+    etag, last_modified = catalog_validators(request, Restaurant.objects.all())
+    not_modified = not_modified_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    
     restaurant = Restaurant.objects.filter(is_active=True).first()
     if restaurant:
         serializer = RestaurantSerializer(restaurant)
-        return Response(serializer.data)
+        return set_validators(Response(serializer.data), etag, last_modified)
     return Response({'message': 'Restaurant information not available'}, status=404)
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def menu_overview(request):
     """Get menu overview with categories and featured dishes"""
-    categories = Category.objects.filter(is_active=True)
-    featured_dishes = Dish.objects.filter(is_available=True)[:6]
+    categories = annotate_dish_counts(Category.objects.filter(is_active=True))
+    featured_dishes = Dish.objects.filter(is_available=True)
+    # context مشترك حتى تُحسب أعداد الأطباق مرة واحدة فقط للطلب
+    context = {}
+    compiled = CompiledDishSerializer(context)
     
     return Response({
-        'categories': CategorySerializer(categories, many=True).data,
-        'featured_dishes': DishSerializer(featured_dishes, many=True).data
+        'categories': CategorySerializer(categories, many=True, context=context).data,
+        'featured_dishes': compiled.serialize(compiled.values(featured_dishes)[:6])
     })
 
+def _accepts_gzip(accept_encoding):
+    """Whether ``Accept-Encoding`` allows gzip (``gzip;q=0`` refuses it)"""
+    accepted = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted.get('gzip', accepted.get('*', 0.0)) > 0
+
+@require_http_methods(['GET', 'HEAD'])
+def menu_snapshot(request):
+    """
+    Full menu (active categories + available dishes) served from the
+    in-memory snapshot with a strong ETag - no database queries.
+    """
+    snapshot = get_menu_snapshot(request)
+    use_gzip = _accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = snapshot.gzip_etag if use_gzip else snapshot.etag
+    
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        client_etags = parse_etags(if_none_match)
+        if '*' in client_etags or etag in client_etags:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response['Vary'] = 'Accept-Encoding'
+            return response
+    
+    response = HttpResponse(
+        snapshot.gzip_body if use_gzip else snapshot.body,
+        content_type='application/json'
+    )
+    if use_gzip:
+        response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'no-cache'
+    response['X-Menu-Version'] = snapshot.version
+    return response
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RegisterThrottle])
 def register_user(request):
     """Register a new user with enhanced validation and phone verification"""
     data = request.data
@@ -551,6 +646,7 @@ def register_user(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([VerificationThrottle])
 def send_verification_code(request):
     """Send verification code to phone or email"""
     import random
@@ -604,6 +700,7 @@ def send_verification_code(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([VerificationThrottle])
 def verify_code(request):
     """Verify phone or email verification code"""
     from django.utils import timezone
@@ -765,78 +862,112 @@ def admin_dashboard_stats(request):
     from django.utils import timezone
     from datetime import timedelta
     
-    now = timezone.now()
-    today = now.date()
-    yesterday = today - timedelta(days=1)
-    week_ago = now - timedelta(days=7)
-    
-    # Optimize multiple queries into single aggregations
-    order_stats = Order.objects.aggregate(
-        total_orders=Count('id'),
-        today_orders=Count('id', filter=Q(order_date__date=today)),
-        yesterday_orders=Count('id', filter=Q(order_date__date=yesterday)),
-        recent_orders=Count('id', filter=Q(order_date__gte=week_ago)),
-        pending_orders=Count('id', filter=Q(status='pending')),
-        delivered_orders=Count('id', filter=Q(status='delivered')),
-        total_revenue=Sum('total_amount', filter=Q(payment_status='paid')),
-        today_revenue=Sum('total_amount', filter=Q(order_date__date=today, payment_status='paid')),
-        yesterday_revenue=Sum('total_amount', filter=Q(order_date__date=yesterday, payment_status='paid')),
-        recent_revenue=Sum('total_amount', filter=Q(order_date__gte=week_ago, payment_status='paid')),
-        avg_order_value=Avg('total_amount', filter=Q(payment_status='paid'))
-    )
-    
-    # Basic counts in single queries
-    total_customers = Customer.objects.count()
-    total_dishes = Dish.objects.count()
-    total_categories = Category.objects.count()
-    active_customers = Customer.objects.filter(user__last_login__gte=week_ago).count()
-    
-    # Order status breakdown
-    order_statuses = Order.objects.values('status').annotate(count=Count('id'))
-    
-    # Top dishes by orders
-    top_dishes = OrderItem.objects.select_related('dish').values('dish__name').annotate(
-        total_ordered=Sum('quantity')
-    ).order_by('-total_ordered')[:5]
+    def compute():
+        now = timezone.now()
+        today = now.date()
+        yesterday = today - timedelta(days=1)
+        week_ago = now - timedelta(days=7)
+    
+        # Optimize multiple queries into single aggregations
+        order_stats = Order.objects.aggregate(
+            total_orders=Count('id'),
+            today_orders=Count('id', filter=Q(order_date__date=today)),
+            yesterday_orders=Count('id', filter=Q(order_date__date=yesterday)),
+            recent_orders=Count('id', filter=Q(order_date__gte=week_ago)),
+            pending_orders=Count('id', filter=Q(status='pending')),
+            delivered_orders=Count('id', filter=Q(status='delivered')),
+            total_revenue=Sum('total_amount', filter=Q(payment_status='paid')),
+            today_revenue=Sum('total_amount', filter=Q(order_date__date=today, payment_status='paid')),
+            yesterday_revenue=Sum('total_amount', filter=Q(order_date__date=yesterday, payment_status='paid')),
+            recent_revenue=Sum('total_amount', filter=Q(order_date__gte=week_ago, payment_status='paid')),
+            avg_order_value=Avg('total_amount', filter=Q(payment_status='paid'))
+        )
     
-    # Average rating
-    avg_rating = DishRating.objects.aggregate(avg=Avg('rating'))['avg'] or 0
+        # Basic counts in single queries
+        total_customers = Customer.objects.count()
+        total_dishes = Dish.objects.count()
+        total_categories = Category.objects.count()
+        active_customers = Customer.objects.filter(user__last_login__gte=week_ago).count()
+    
+        # Order status breakdown
+        order_statuses = Order.objects.values('status').annotate(count=Count('id'))
+    
+        # Top dishes by orders
+        top_dishes = OrderItem.objects.select_related('dish').values('dish__name').annotate(
+            total_ordered=Sum('quantity')
+        ).order_by('-total_ordered')[:5]
+    
+        # Average rating
+        avg_rating = DishRating.objects.aggregate(avg=Avg('rating'))['avg'] or 0
+    
+        # Calculate percentage changes
+        orders_change = ((order_stats['today_orders'] - order_stats['yesterday_orders']) / max(order_stats['yesterday_orders'], 1)) * 100 if order_stats['yesterday_orders'] else 0
+        revenue_change = ((order_stats['today_revenue'] or 0) - (order_stats['yesterday_revenue'] or 0)) / max(order_stats['yesterday_revenue'] or 1, 1) * 100 if order_stats['yesterday_revenue'] else 0
+    
+        return {
+            'overview': {
+                'total_orders': order_stats['total_orders'],
+                'total_customers': total_customers,
+                'total_dishes': total_dishes,
+                'total_categories': total_categories,
+                'total_revenue': float(order_stats['total_revenue'] or 0),
+                'average_rating': round(float(avg_rating), 2)
+            },
+            'today_stats': {
+                'today_orders': order_stats['today_orders'],
+                'today_revenue': float(order_stats['today_revenue'] or 0),
+                'yesterday_orders': order_stats['yesterday_orders'],
+                'yesterday_revenue': float(order_stats['yesterday_revenue'] or 0),
+                'orders_change': round(float(orders_change), 1),
+                'revenue_change': round(float(revenue_change), 1)
+            },
+            'recent_stats': {
+                'recent_orders': order_stats['recent_orders'],
+                'recent_revenue': float(order_stats['recent_revenue'] or 0),
+                'active_customers': active_customers,
+                'pending_orders': order_stats['pending_orders']
+            },
+            'performance': {
+                'delivered_orders': order_stats['delivered_orders'],
+                'average_order_value': round(float(order_stats['avg_order_value'] or 0), 2),
+                'completion_rate': round((order_stats['delivered_orders'] / max(order_stats['total_orders'], 1)) * 100, 1)
+            },
+            'order_statuses': list(order_statuses),
+            'top_dishes': list(top_dishes)
+        }
     
-    # Calculate percentage changes
-    orders_change = ((order_stats['today_orders'] - order_stats['yesterday_orders']) / max(order_stats['yesterday_orders'], 1)) * 100 if order_stats['yesterday_orders'] else 0
-    revenue_change = ((order_stats['today_revenue'] or 0) - (order_stats['yesterday_revenue'] or 0)) / max(order_stats['yesterday_revenue'] or 1, 1) * 100 if order_stats['yesterday_revenue'] else 0
+    # يُحسب مرة واحدة لكل فترة (single-flight) - الإحصائيات تخص اليوم الحالي
+    today = timezone.now().date()
+    stats = cached_computation(
+        f'admin_dashboard_stats_{today}', compute, 60, tags=['menu', 'order_items', 'orders']
+    )
+    return Response(stats)
+
+class PrometheusRenderer(BaseRenderer):
+    """Prometheus text format for ?format=prometheus"""
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if 'caches' not in data:  # أخطاء الصلاحيات وغيرها
+            return ''.join(f'# {key}: {value}\n' for key, value in data.items())
+        return prometheus_text(data['caches'])
+
+@api_view(['GET'])
+@permission_classes([IsRestaurantAdmin])
+@renderer_classes([JSONRenderer, PrometheusRenderer])
+def cache_metrics_view(request):
+    """
+    Hits, misses, sets, bytes and latency per cache and key family for this
+    worker process (JSON, or Prometheus text with ?format=prometheus).
+    """
+    from django.core.cache import cache
     
-    return Response({
-        'overview': {
-            'total_orders': order_stats['total_orders'],
-            'total_customers': total_customers,
-            'total_dishes': total_dishes,
-            'total_categories': total_categories,
-            'total_revenue': float(order_stats['total_revenue'] or 0),
-            'average_rating': round(float(avg_rating), 2)
-        },
-        'today_stats': {
-            'today_orders': order_stats['today_orders'],
-            'today_revenue': float(order_stats['today_revenue'] or 0),
-            'yesterday_orders': order_stats['yesterday_orders'],
-            'yesterday_revenue': float(order_stats['yesterday_revenue'] or 0),
-            'orders_change': round(float(orders_change), 1),
-            'revenue_change': round(float(revenue_change), 1)
-        },
-        'recent_stats': {
-            'recent_orders': order_stats['recent_orders'],
-            'recent_revenue': float(order_stats['recent_revenue'] or 0),
-            'active_customers': active_customers,
-            'pending_orders': order_stats['pending_orders']
-        },
-        'performance': {
-            'delivered_orders': order_stats['delivered_orders'],
-            'average_order_value': round(float(order_stats['avg_order_value'] or 0), 2),
-            'completion_rate': round((order_stats['delivered_orders'] / max(order_stats['total_orders'], 1)) * 100, 1)
-        },
-        'order_statuses': list(order_statuses),
-        'top_dishes': list(top_dishes)
-    })
+    data = {'pid': os.getpid(), 'caches': cache_metrics.snapshot()}
+    if hasattr(cache, 'stats'):
+        data['l1'] = cache.stats()
+    return Response(data)
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -846,28 +977,34 @@ def homepage_stats(request):
     from django.utils import timezone
     from datetime import timedelta
     
-    # Total customers count
-    total_customers = Customer.objects.count()
+    def compute():
+        # Total customers count
+        total_customers = Customer.objects.count()
     
-    # Today's dishes served (total order items for today)
-    today = timezone.now().date()
-    dishes_served_today = OrderItem.objects.filter(
-        order__order_date__date=today,
-        order__status__in=['confirmed', 'preparing', 'ready', 'delivered']
-    ).aggregate(total=Sum('quantity'))['total'] or 0
+        # Today's dishes served (total order items for today)
+        today = timezone.now().date()
+        dishes_served_today = OrderItem.objects.filter(
+            order__order_date__date=today,
+            order__status__in=['confirmed', 'preparing', 'ready', 'delivered']
+        ).aggregate(total=Sum('quantity'))['total'] or 0
     
-    # Total menu items available
-    menu_items = Dish.objects.filter(is_available=True).count()
+        # Total menu items available
+        menu_items = Dish.objects.filter(is_available=True).count()
     
-    # Average rating across all dishes
-    avg_rating = DishRating.objects.aggregate(avg=Avg('rating'))['avg'] or 0
+        # Average rating across all dishes
+        avg_rating = DishRating.objects.aggregate(avg=Avg('rating'))['avg'] or 0
     
-    return Response({
-        'total_customers': total_customers,
-        'dishes_served_today': dishes_served_today,
-        'menu_items': menu_items,
-        'average_rating': round(float(avg_rating), 1)
-    })
+        return {
+            'total_customers': total_customers,
+            'dishes_served_today': dishes_served_today,
+            'menu_items': menu_items,
+            'average_rating': round(float(avg_rating), 1)
+        }
+    
+    stats = cached_computation(
+        f'homepage_stats_{timezone.now().date()}', compute, 300, tags=['menu', 'order_items', 'orders']
+    )
+    return Response(stats)
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -891,9 +1028,91 @@ def get_csrf_token(request):
     
     return response
 
+def _login_busy_response():
+    response = JsonResponse({'error': 'Too many login attempts, please retry shortly'}, status=429)
+    response['Retry-After'] = '1'
+    return response
+
+def _find_customer_login_user(identity):
+    """Find the user by email or username (indexed lookups)"""
+    logger = logging.getLogger(__name__)
+    user = None
+    if '@' in identity:
+        try:
+            user = User.objects.select_related('customer').get(email=identity)
+            logger.info(f"📧 Found user by email: {user.username}")
+        except User.DoesNotExist:
+            logger.warning(f"❌ No user found with email: {identity}")
+    else:
+        try:
+            user = User.objects.select_related('customer').get(username=identity)
+            logger.info(f"👤 Found user by username: {user.username}")
+        except User.DoesNotExist:
+            logger.warning(f"❌ No user found with username: {identity}")
+    return user
+
+def _complete_customer_login(request, user):
+    """Log the verified user in and build the login response"""
+    logger = logging.getLogger(__name__)
+    
+    # Ensure user has customer profile (allow admin users if they have customer profile)
+    if not hasattr(user, 'customer'):
+        logger.warning(f"❌ User has no customer profile: {user.username}")
+        return JsonResponse({'error': 'User is not a customer'}, status=403)
+    
+    # Log the user in
+    login(request, user)
+    
+    # Session is automatically created by login(), no need to force it
+    request.session['user_id'] = user.id
+    request.session['is_customer'] = True
+    request.session['customer_email'] = user.email
+    request.session.save()
+    
+    session_key = request.session.session_key
+    logger.info(f"✅ User logged in successfully: {user.username}, session: {session_key}")
+    logger.info(f"🔍 Session data: {dict(request.session)}")
+    
+    response_data = {
+        'message': 'Login successful',
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'is_admin': user.is_staff or user.is_superuser,
+            'is_customer': hasattr(user, 'customer')
+        },
+        'session_key': session_key
+    }
+    if tokens_enabled():
+        response_data.update(issue_tokens(user))
+    
+    response = JsonResponse(response_data)
+    response['Access-Control-Allow-Credentials'] = 'true'
+    
+    # Set session cookie explicitly
+    response.set_cookie(
+        'sessionid',
+        session_key,
+        max_age=86400,  # 24 hours
+        httponly=True,
+        secure=False,  # Development mode
+        samesite='Lax',
+        path='/'
+    )
+    
+    return response
+
 @csrf_exempt
-def customer_login(request):
-    """Customer login endpoint"""
+@ratelimit('login')
+async def customer_login(request):
+    """
+    Customer login endpoint.
+    Async: the password hash runs in the hashing pool (restaurant/passwords.py),
+    not on a request worker; a burst beyond LOGIN_MAX_PENDING gets 429.
+    """
     logger = logging.getLogger(__name__)
     
     if request.method != 'POST':
@@ -910,75 +1129,21 @@ def customer_login(request):
             return JsonResponse({'error': 'Identity and password are required'}, status=400)
         
         # Try to find user by username or email
-        user = None
-        if '@' in identity:
-            try:
-                user = User.objects.get(email=identity)
-                logger.info(f"📧 Found user by email: {user.username}")
-            except User.DoesNotExist:
-                logger.warning(f"❌ No user found with email: {identity}")
-        else:
-            try:
-                user = User.objects.get(username=identity)
-                logger.info(f"👤 Found user by username: {user.username}")
-            except User.DoesNotExist:
-                logger.warning(f"❌ No user found with username: {identity}")
-        
+        user = await sync_to_async(_find_customer_login_user)(identity)
         if not user:
             return JsonResponse({'error': 'Invalid credentials'}, status=401)
         
         # Check password
-        if not user.check_password(password):
+        try:
+            password_ok = await acheck_user_password(user, password)
+        except LoginBusy:
+            logger.warning(f"⏳ Login rejected, too many in flight: {identity}")
+            return _login_busy_response()
+        if not password_ok:
             logger.warning(f"❌ Invalid password for user: {user.username}")
             return JsonResponse({'error': 'Invalid credentials'}, status=401)
         
-        # Ensure user has customer profile (allow admin users if they have customer profile)
-        if not hasattr(user, 'customer'):
-            logger.warning(f"❌ User has no customer profile: {user.username}")
-            return JsonResponse({'error': 'User is not a customer'}, status=403)
-        
-        # Log the user in
-        login(request, user)
-        
-        # Session is automatically created by login(), no need to force it
-        request.session['user_id'] = user.id
-        request.session['is_customer'] = True
-        request.session['customer_email'] = user.email
-        request.session.save()
-        
-        session_key = request.session.session_key
-        logger.info(f"✅ User logged in successfully: {user.username}, session: {session_key}")
-        logger.info(f"🔍 Session data: {dict(request.session)}")
-        
-        response_data = {
-            'message': 'Login successful',
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-                'is_admin': user.is_staff or user.is_superuser,
-                'is_customer': hasattr(user, 'customer')
-            },
-            'session_key': session_key
-        }
-        
-        response = JsonResponse(response_data)
-        response['Access-Control-Allow-Credentials'] = 'true'
-        
-        # Set session cookie explicitly
-        response.set_cookie(
-            'sessionid',
-            session_key,
-            max_age=86400,  # 24 hours
-            httponly=True,
-            secure=False,  # Development mode
-            samesite='Lax',
-            path='/'
-        )
-        
-        return response
+        return await sync_to_async(_complete_customer_login)(request, user)
         
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error: {str(e)}")
@@ -987,9 +1152,86 @@ def customer_login(request):
         logger.error(f"Login error: {str(e)}")
         return JsonResponse({'error': 'Login failed'}, status=500)
 
+def _find_admin_login_user(email):
+    """The user of an admin email, or an error response"""
+    logger = logging.getLogger(__name__)
+    
+    # Check if email is admin
+    if not is_admin_email(email):
+        logger.warning(f"❌ Not an admin email: {email}")
+        return None, JsonResponse({'error': 'Unauthorized: Not an admin email'}, status=403)
+    
+    # Find user
+    try:
+        user = User.objects.select_related('customer').get(email=email)
+        logger.info(f"📧 Found admin user: {user.username}")
+    except User.DoesNotExist:
+        logger.warning(f"❌ No user found with email: {email}")
+        return None, JsonResponse({'error': 'Invalid credentials'}, status=401)
+    return user, None
+
+def _complete_admin_login(request, user, email):
+    """Log the verified admin in and build the login response"""
+    logger = logging.getLogger(__name__)
+    
+    # Log the user in
+    login(request, user)
+    
+    # Check if admin also has customer profile
+    has_customer = hasattr(user, 'customer')
+    logger.info(f"🔍 Admin user has customer profile: {has_customer}")
+    
+    # Session is automatically created by login(), no need to force it
+    request.session['user_id'] = user.id
+    request.session['is_admin'] = True
+    request.session['is_customer'] = has_customer  # Add customer flag for dual-role users
+    request.session['admin_email'] = email
+    request.session.save()
+    
+    session_key = request.session.session_key
+    logger.info(f"✅ Admin logged in successfully: {user.username}, session: {session_key}")
+    logger.info(f"🔍 Session data: {dict(request.session)}")
+    
+    # Get admin profile
+    admin_profile = AdminProfile.objects.get(admin_email=email)
+    
+    response_data = {
+        'message': 'Login successful',
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'is_admin': True,
+            'is_customer': has_customer,
+            'is_super_admin': admin_profile.is_super_admin
+        },
+        'session_key': session_key
+    }
+    if tokens_enabled():
+        response_data.update(issue_tokens(user, admin_profile))
+    
+    response = JsonResponse(response_data)
+    response['Access-Control-Allow-Credentials'] = 'true'
+    
+    # Set session cookie explicitly
+    response.set_cookie(
+        'sessionid',
+        session_key,
+        max_age=86400,  # 24 hours
+        httponly=True,
+        secure=False,  # Development mode
+        samesite='Lax',
+        path='/'
+    )
+    
+    return response
+
 @csrf_exempt
-def admin_login(request):
-    """Admin login endpoint"""
+@ratelimit('login')
+async def admin_login(request):
+    """Admin login endpoint (async, see customer_login)"""
     logger = logging.getLogger(__name__)
     
     if request.method != 'POST':
@@ -1005,75 +1247,21 @@ def admin_login(request):
         if not email or not password:
             return JsonResponse({'error': 'Email and password are required'}, status=400)
         
-        # Check if email is admin
-        if not AdminProfile.is_admin_email(email):
-            logger.warning(f"❌ Not an admin email: {email}")
-            return JsonResponse({'error': 'Unauthorized: Not an admin email'}, status=403)
-        
-        # Find user
-        try:
-            user = User.objects.get(email=email)
-            logger.info(f"📧 Found admin user: {user.username}")
-        except User.DoesNotExist:
-            logger.warning(f"❌ No user found with email: {email}")
-            return JsonResponse({'error': 'Invalid credentials'}, status=401)
+        user, error_response = await sync_to_async(_find_admin_login_user)(email)
+        if error_response is not None:
+            return error_response
         
         # Check password
-        if not user.check_password(password):
+        try:
+            password_ok = await acheck_user_password(user, password)
+        except LoginBusy:
+            logger.warning(f"⏳ Admin login rejected, too many in flight: {email}")
+            return _login_busy_response()
+        if not password_ok:
             logger.warning(f"❌ Invalid password for admin: {user.username}")
             return JsonResponse({'error': 'Invalid credentials'}, status=401)
         
-        # Log the user in
-        login(request, user)
-        
-        # Check if admin also has customer profile
-        has_customer = hasattr(user, 'customer')
-        logger.info(f"🔍 Admin user has customer profile: {has_customer}")
-        
-        # Session is automatically created by login(), no need to force it
-        request.session['user_id'] = user.id
-        request.session['is_admin'] = True
-        request.session['is_customer'] = has_customer  # Add customer flag for dual-role users
-        request.session['admin_email'] = email
-        request.session.save()
-        
-        session_key = request.session.session_key
-        logger.info(f"✅ Admin logged in successfully: {user.username}, session: {session_key}")
-        logger.info(f"🔍 Session data: {dict(request.session)}")
-        
-        # Get admin profile
-        admin_profile = AdminProfile.objects.get(admin_email=email)
-        
-        response_data = {
-            'message': 'Login successful',
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-                'is_admin': True,
-                'is_customer': has_customer,
-                'is_super_admin': admin_profile.is_super_admin
-            },
-            'session_key': session_key
-        }
-        
-        response = JsonResponse(response_data)
-        response['Access-Control-Allow-Credentials'] = 'true'
-        
-        # Set session cookie explicitly
-        response.set_cookie(
-            'sessionid',
-            session_key,
-            max_age=86400,  # 24 hours
-            httponly=True,
-            secure=False,  # Development mode
-            samesite='Lax',
-            path='/'
-        )
-        
-        return response
+        return await sync_to_async(_complete_admin_login)(request, user, email)
         
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error: {str(e)}")
@@ -1088,74 +1276,11 @@ def check_user_type(request):
     """Check if current user is admin or customer"""
     logger = logging.getLogger(__name__)
     
-    logger.info(f"🔍 Checking user type for request")
-    logger.info(f"🔍 Session key: {request.session.session_key}")
-    logger.info(f"🔍 Session data: {dict(request.session)}")
-    logger.info(f"🔍 User authenticated: {request.user.is_authenticated}")
-    logger.info(f"🔍 User: {request.user}")
+    # X-Session-Key أولاً ثم cookie الجلسة - نفس الـ identity التي حلتها المصادقة
+    identity = get_identity(request)
+    user = get_request_user(request)
     
-    # Check for X-Session-Key header first
-    session_key_header = request.headers.get('X-Session-Key')
-    if session_key_header:
-        logger.info(f"🔑 Found X-Session-Key header: {session_key_header[:10]}...")
-        
-        try:
-            from django.contrib.sessions.models import Session
-            session = Session.objects.get(session_key=session_key_header)
-            session_data = session.get_decoded()
-            logger.info(f"🔍 Session data from header: {session_data}")
-            
-            user_id = session_data.get('user_id')
-            if user_id:
-                try:
-                    user = User.objects.get(id=user_id)
-                    logger.info(f"✅ Found user from X-Session-Key: {user.username}")
-                    
-                    # Get admin/customer status from session
-                    is_admin = session_data.get('is_admin', False)
-                    is_customer = session_data.get('is_customer', False)
-                    
-                    response_data = {
-                        'user_id': user.id,
-                        'username': user.username,
-                        'email': user.email,
-                        'first_name': user.first_name,
-                        'last_name': user.last_name,
-                        'is_admin': is_admin,
-                        'is_customer': is_customer,
-                        'is_authenticated': True
-                    }
-                    
-                    if is_admin:
-                        try:
-                            admin_profile = AdminProfile.objects.get(admin_email=user.email)
-                            response_data['is_super_admin'] = admin_profile.is_super_admin
-                            logger.info(f"✅ Super admin status: {admin_profile.is_super_admin}")
-                        except AdminProfile.DoesNotExist:
-                            logger.warning(f"⚠️ AdminProfile not found for {user.email}")
-                    
-                    logger.info(f"✅ Final response data from X-Session-Key: {response_data}")
-                    return Response(response_data)
-                    
-                except User.DoesNotExist:
-                    logger.warning(f"❌ User not found for ID from session: {user_id}")
-        except Exception as e:
-            logger.error(f"❌ Error reading X-Session-Key: {e}")
-    
-    # Fallback to Django session middleware
-    user = request.user
-    if not user.is_authenticated:
-        # Try to get user from current session
-        user_id = request.session.get('user_id')
-        if user_id:
-            try:
-                user = User.objects.get(id=user_id)
-                logger.info(f"🔍 Found user from Django session: {user.username}")
-            except User.DoesNotExist:
-                logger.warning(f"❌ User not found in Django session: {user_id}")
-                user = None
-    
-    if not user or not user.is_authenticated:
+    if user is None:
         logger.info("❌ User not authenticated")
         return Response({
             'user_id': None,
@@ -1168,29 +1293,13 @@ def check_user_type(request):
             'is_authenticated': False
         })
     
-    is_admin = False
+    session = identity.session if identity.session is not None else request.session
+    logger.info(f"🔍 Checking user type for {user.username} (session from {identity.source or 'request'})")
     
-    # Check if admin from session first
-    if request.session.get('is_admin'):
-        is_admin = True
-        logger.info(f"✅ Admin status from Django session: {is_admin}")
-    else:
-        # Fallback to email check
-        try:
-            is_admin = AdminProfile.is_admin_email(user.email)
-            logger.info(f"✅ Admin check result for {user.email}: {is_admin}")
-        except Exception as e:
-            logger.warning(f"⚠️ Admin check failed: {e}")
-    
-    # Check customer status
-    has_customer = False
-    if request.session.get('is_customer'):
-        has_customer = True
-        logger.info(f"✅ Customer status from Django session: {has_customer}")
-    else:
-        # Fallback to model check
-        has_customer = hasattr(user, 'customer')
-        logger.info(f"✅ Customer check result for {user.username}: {has_customer}")
+    # Admin/customer status from the session first, then from the profiles
+    admin_profile = getattr(user, 'adminprofile', None)
+    is_admin = bool(session.get('is_admin')) or admin_profile is not None or is_admin_email(user.email)
+    has_customer = bool(session.get('is_customer')) or getattr(user, 'customer', None) is not None
     
     response_data = {
         'user_id': user.id,
@@ -1204,16 +1313,33 @@ def check_user_type(request):
     }
     
     if is_admin:
-        try:
-            admin_profile = AdminProfile.objects.get(admin_email=user.email)
+        if admin_profile is None or admin_profile.admin_email != user.email:
+            admin_profile = AdminProfile.objects.filter(admin_email=user.email).first() or admin_profile
+        if admin_profile is not None:
             response_data['is_super_admin'] = admin_profile.is_super_admin
-            logger.info(f"✅ Super admin status: {admin_profile.is_super_admin}")
-        except AdminProfile.DoesNotExist:
+        else:
             logger.warning(f"⚠️ AdminProfile not found for {user.email}")
     
-    logger.info(f"✅ Final response data from Django session: {response_data}")
+    logger.info(f"✅ User type: admin={is_admin}, customer={has_customer}")
     return Response(response_data)
 
+@csrf_exempt
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@authentication_classes([])
+def refresh_access_token(request):
+    """New access/refresh token pair for a refresh token (AUTH_TOKENS_ENABLED only)"""
+    if not tokens_enabled():
+        return Response({'error': 'Token authentication is disabled'}, status=404)
+    
+    token = request.data.get('refresh_token')
+    if not token:
+        return Response({'error': 'refresh_token is required'}, status=400)
+    try:
+        return Response(refresh_tokens(token))
+    except signing.BadSignature:
+        return Response({'error': 'Invalid or expired refresh token'}, status=401)
+
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -1224,42 +1350,32 @@ def user_logout(request):
     
     from django.contrib.auth import logout
     
+    identity = get_identity(request)
+    user = get_request_user(request)
+    if user is not None and tokens_enabled():
+        # رموز التجديد لا تنتهي بحذف الجلسة - تُبطل كلها (كل الأجهزة)
+        revoke_tokens(user)
     logout(request)
+    if identity.source == 'header':
+        # جلسة X-Session-Key ليست request.session - تُحذف هي أيضاً
+        identity.session.flush()
     return Response({'message': 'Logout successful'})
 
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RatingThrottle])
 def submit_rating_simple(request):
     """Simple rating submission without CSRF checks"""
     try:
-        # Manual authentication check and user finding
-        current_user = request.user
-        
-        # If user not authenticated but we have session info, try to find the user
-        if not current_user.is_authenticated or current_user.is_anonymous:
-            session_key = request.headers.get('X-Session-Key')
-            if session_key:
-                try:
-                    from django.contrib.sessions.models import Session
-                    session = Session.objects.get(session_key=session_key)
-                    session_data = session.get_decoded()
-                    user_id = session_data.get('_auth_user_id')
-                    if user_id:
-                        current_user = User.objects.get(id=user_id)
-                except Exception as e:
-                    logger.warning(f"Session user error: {e}")
-        
-        if not current_user or current_user.is_anonymous:
+        current_user = get_request_user(request)
+        if current_user is None:
             return Response({'error': 'Authentication required'}, status=401)
         
         data = request.data
         
         # Get or create customer
-        customer, created = Customer.objects.get_or_create(
-            user=current_user,
-            defaults={'phone': '', 'address': ''}
-        )
+        customer = get_or_create_customer(current_user)
         
         # Create rating
         rating = DishRating.objects.create(
@@ -1279,6 +1395,7 @@ def submit_rating_simple(request):
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RatingThrottle])
 def add_rating(request):
     """Simple rating add function without any middleware issues"""
     try:
@@ -1288,28 +1405,12 @@ def add_rating(request):
         comment = data.get('comment', '')
         
         # Find user by session
-        session_key = request.headers.get('X-Session-Key')
-        current_user = None
-        
-        if session_key:
-            try:
-                from django.contrib.sessions.models import Session
-                session = Session.objects.get(session_key=session_key)
-                session_data = session.get_decoded()
-                user_id = session_data.get('_auth_user_id')
-                if user_id:
-                    current_user = User.objects.get(id=user_id)
-            except Exception as e:
-                logger.warning(f"Error finding user: {e}")
-        
+        current_user = get_request_user(request)
         if not current_user:
             return Response({'error': 'User not found'}, status=401)
         
         # Get or create customer
-        customer, created = Customer.objects.get_or_create(
-            user=current_user,
-            defaults={'phone': '', 'address': ''}
-        )
+        customer = get_or_create_customer(current_user)
         
         # Always create new rating (allow multiple ratings from same user)
         rating = DishRating.objects.create(
@@ -1332,6 +1433,7 @@ def add_rating(request):
 @csrf_exempt
 @api_view(['PUT'])
 @permission_classes([AllowAny])
+@throttle_classes([RatingThrottle])
 def update_rating(request, rating_id):
     """Update existing rating"""
     try:
@@ -1340,27 +1442,13 @@ def update_rating(request, rating_id):
         comment = data.get('comment', '')
         
         # Find user by session
-        session_key = request.headers.get('X-Session-Key')
-        current_user = None
-        
-        if session_key:
-            try:
-                from django.contrib.sessions.models import Session
-                session = Session.objects.get(session_key=session_key)
-                session_data = session.get_decoded()
-                user_id = session_data.get('_auth_user_id')
-                if user_id:
-                    current_user = User.objects.get(id=user_id)
-            except Exception as e:
-                logger.warning(f"Error finding user: {e}")
-        
+        current_user = get_request_user(request)
         if not current_user:
             return Response({'error': 'User not found'}, status=401)
         
-        # Get customer
-        try:
-            customer = Customer.objects.get(user=current_user)
-        except Customer.DoesNotExist:
+        # Get customer (محمل مع المستخدم)
+        customer = getattr(current_user, 'customer', None)
+        if customer is None:
             return Response({'error': 'Customer not found'}, status=404)
         
         # Find and update rating
@@ -1390,6 +1478,7 @@ def update_rating(request, rating_id):
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([CheckoutThrottle])
 def create_checkout_session(request):
     """Create Stripe Checkout Session for complete payment flow"""
     # Force CSRF exemption
@@ -1409,29 +1498,12 @@ def create_checkout_session(request):
         if not items:
             return Response({'error': 'No items provided'}, status=400)
         
-        # Get authenticated user
-        current_user = request.user
-        logger.info(f"Initial user: {current_user}, authenticated: {current_user.is_authenticated}")
-        
-        # If user is not authenticated, check cookies
-        if not current_user.is_authenticated:
-            sessionid = request.COOKIES.get('sessionid')
-            logger.info(f"Checking sessionid cookie: {sessionid}")
-            if sessionid:
-                try:
-                    from django.contrib.sessions.models import Session
-                    session = Session.objects.get(session_key=sessionid)
-                    session_data = session.get_decoded()
-                    user_id = session_data.get('_auth_user_id')
-                    if user_id:
-                        current_user = User.objects.get(id=user_id)
-                        logger.info(f"Found user via sessionid cookie: {current_user}")
-                except Exception as e:
-                    logger.warning(f"Sessionid cookie error: {e}")
+        # Get authenticated user (header أو cookie الجلسة)
+        current_user = get_request_user(request)
         
         # If no authenticated user found, DO NOT create a guest user.
         # Let Stripe handle guest checkout by passing customer_email.
-        if not current_user or current_user.is_anonymous:
+        if current_user is None:
             logger.warning("No authenticated user found for checkout.")
             # We can proceed with a temporary customer email for Stripe if needed,
             # but we won't create a User object.
@@ -1442,11 +1514,8 @@ def create_checkout_session(request):
             logger.info(f"Using authenticated user: {current_user} (ID: {current_user.id})")
         
         # Get or create customer for authenticated user
-        customer, created = Customer.objects.get_or_create(
-            user=current_user,
-            defaults={'phone': '', 'address': delivery_address}
-        )
-        logger.info(f"Customer: {customer} (ID: {customer.id}, created: {created})")
+        customer = get_or_create_customer(current_user, address=delivery_address)
+        logger.info(f"Customer: {customer} (ID: {customer.id})")
         
         # Build line items for Stripe
         line_items = []
@@ -1456,6 +1525,12 @@ def create_checkout_session(request):
             try:
                 dish = Dish.objects.get(id=item_data['dish_id'])
                 quantity = int(item_data['quantity'])
+                # فحص مبكر قبل أخذ الدفع - الحجز الفعلي عند إنشاء الطلب
+                if dish.stock_quantity < quantity:
+                    return Response(
+                        {'error': f"Insufficient stock for '{dish.name}'. Available: {dish.stock_quantity}"},
+                        status=400
+                    )
                 price_cents = int(dish.price * 100)  # Convert to cents
                 
                 line_items.append({
@@ -1548,7 +1623,9 @@ def stripe_success(request):
         if session.payment_status == 'paid':
             order, message = _create_order_from_stripe_session(session)
             
-            if order:
+            if order and order.status == 'cancelled':
+                return Response({'error': message, 'order_id': order.id}, status=409)
+            elif order:
                 return Response({
                     'success': True,
                     'order_id': order.id,
@@ -1641,6 +1718,11 @@ def _create_order_from_stripe_session(session):
     """
     Helper function to create an order from a Stripe session object.
     This avoids code duplication between webhook and success view.
+    
+    The ordered quantities are taken out of stock (Dish.reserve_stock) in the
+    order's transaction. The payment is already taken at this point, so a
+    shortage does not drop the order: it is recorded as cancelled but paid,
+    and the customer and the admins are told that a refund is due.
     """
     metadata = session.get('metadata', {})
     customer_id = metadata.get('customer_id')
@@ -1675,30 +1757,56 @@ def _create_order_from_stripe_session(session):
         logger.info(f"Order #{existing_order.id} already exists for this payment.")
         return existing_order, "Order already created"
 
-    # Create the order
-    order = Order.objects.create(
-        customer=customer,
-        total_amount=total_amount,
-        delivery_address=delivery_address,
-        special_instructions=special_instructions,
-        status='pending',  # As requested by user
-        payment_status='paid'
-    )
-    
-    # Create order items
+    # Create the order and its items (one dish query, one bulk insert)
+    dishes = Dish.objects.in_bulk({item_data['dish_id'] for item_data in items if 'dish_id' in item_data})
+    lines = []
     for item_data in items:
-        try:
-            dish = Dish.objects.get(id=item_data['dish_id'])
-            OrderItem.objects.create(
-                order=order,
-                dish=dish,
-                quantity=item_data['quantity'],
-                price=dish.price,
-                special_instructions=item_data.get('special_instructions', '')
-            )
-        except Dish.DoesNotExist:
+        dish = dishes.get(item_data.get('dish_id'))
+        if dish is None:
             logger.warning(f"Dish with id {item_data.get('dish_id')} not found during order creation.")
             continue
+        lines.append((dish, item_data['quantity'], item_data.get('special_instructions', '')))
+    
+    quantities = {}
+    for dish, quantity, _ in lines:
+        quantities[dish.id] = quantities.get(dish.id, 0) + int(quantity)
+    
+    with transaction.atomic():
+        reserved = Dish.reserve_stock(quantities)
+        order = Order.create_with_items(
+            lines,
+            total_amount=total_amount,
+            customer=customer,
+            delivery_address=delivery_address,
+            special_instructions=special_instructions,
+            # As requested by user; ملغي عند نقص المخزون لكن الدفع تم
+            status='pending' if reserved is not None else 'cancelled',
+            payment_status='paid'
+        )
+    
+    if reserved is None:
+        logger.error(f"Insufficient stock for paid Stripe session {session.get('id')}: order #{order.id} cancelled, refund needed.")
+        try:
+            Notification.objects.create(
+                user=customer.user,
+                title="Order Cancelled",
+                message=f"Some items of your order #{order.id} ran out of stock before it could be placed. Your payment of ${order.total_amount} will be refunded.",
+                notification_type='payment_received'
+            )
+            send_notification_to_admins(
+                title="Refund Needed",
+                message=f"Paid order #{order.id} by {customer.user.username} was cancelled for insufficient stock. Refund ${order.total_amount} (Stripe session {session.get('id')}).",
+                notification_type='payment_received'
+            )
+        except Exception as e:
+            logger.error(f"Failed to send notifications for order #{order.id}: {e}")
+        return order, "Insufficient stock - the order was cancelled and the payment will be refunded"
+    
+    for dish_id, quantity in quantities.items():
+        dish = reserved[dish_id]
+        # تنبيه واحد عند عبور الحد وليس مع كل طلب بعده
+        if dish.is_low_stock and dish.stock_quantity + quantity > dish.low_stock_threshold:
+            send_stock_alert(dish)
             
     logger.info(f"Order #{order.id} created successfully for customer {customer.user.username}.")
     
@@ -0,0 +1,147 @@
+"""
+Cache warm-up after a deploy.
+
+Every warmer precomputes one expensive cached value: the aggregates and the
+OpenAPI schema go to the shared cache, the menu snapshot and the fuzzy search
+index to the memory of the current worker. ``warm_caches`` runs them in parallel and stops waiting once
+the time budget is spent - a warmer still running then finishes in the
+background while the caller carries on.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger('restaurant')
+
+
+class OriginRequest(HttpRequest):
+    """Bare GET of the menu on ``origin`` - what the serializers need to build absolute URLs"""
+
+    def __init__(self, origin, path='/api/menu/'):
+        super().__init__()
+        url = urlsplit(origin)
+        self._origin_scheme = url.scheme or 'http'
+        self.method = 'GET'
+        self.path = self.path_info = path
+        self.META = {
+            'HTTP_HOST': url.netloc,
+            'SERVER_NAME': url.hostname or '',
+            'SERVER_PORT': str(url.port or (443 if self._origin_scheme == 'https' else 80)),
+        }
+
+    def _get_scheme(self):
+        return self._origin_scheme
+
+
+def warm_menu_snapshot():
+    """Snapshot for every configured origin (in this worker's memory)"""
+    from .menu_snapshot import get_menu_snapshot
+
+    for origin in getattr(settings, 'CACHE_WARMUP_ORIGINS', []):
+        get_menu_snapshot(OriginRequest(origin))
+
+
+def warm_dish_trigram_index():
+    """Fuzzy search index of this worker, so the first fuzzy query does not build it"""
+    from .search import get_dish_trigram_index
+    get_dish_trigram_index()
+
+
+def warm_popular_dishes():
+    from .utils import get_popular_dishes
+    get_popular_dishes(limit=10)
+
+
+def warm_category_stats():
+    from .utils import get_category_stats
+    get_category_stats()
+
+
+def warm_openapi_schema():
+    """Regenerate the schema: the cached copy may come from the previous deploy"""
+    from .schema import get_openapi_schema
+    get_openapi_schema(refresh=True)
+
+
+# name -> (warmer, per_worker)
+WARMERS = {
+    'menu_snapshot': (warm_menu_snapshot, True),
+    'dish_trigram_index': (warm_dish_trigram_index, True),
+    'popular_dishes': (warm_popular_dishes, False),
+    'category_stats': (warm_category_stats, False),
+    'openapi_schema': (warm_openapi_schema, False),
+}
+
+
+def _run(name, warmer):
+    start = time.perf_counter()
+    try:
+        warmer()
+        error = None
+    except Exception as e:
+        logger.exception(f"Cache warm-up of {name} failed")
+        error = str(e)
+    finally:
+        # كل warmer يعمل في thread خاص به - لا نترك اتصالات قاعدة البيانات مفتوحة
+        connections.close_all()
+    return time.perf_counter() - start, error
+
+
+def warm_caches(names=None, budget=None, max_workers=4):
+    """
+    Run the given warmers (default: all) in parallel.
+
+    Returns ``[{'name', 'status', 'seconds', 'error'}]`` in ``WARMERS``
+    order; ``status`` is ``ok``, ``failed`` or ``timeout`` (still running
+    when ``budget`` seconds had passed).
+    """
+    names = list(WARMERS) if names is None else list(names)
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cache-warmup')
+    futures = {name: executor.submit(_run, name, WARMERS[name][0]) for name in names}
+    wait(futures.values(), timeout=budget)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for name, future in futures.items():
+        if future.done() and not future.cancelled():
+            seconds, error = future.result()
+            results.append({
+                'name': name, 'status': 'failed' if error else 'ok',
+                'seconds': seconds, 'error': error,
+            })
+        else:
+            results.append({
+                'name': name, 'status': 'timeout',
+                'seconds': time.perf_counter() - start, 'error': None,
+            })
+
+    logger.info("Cache warm-up: " + ", ".join(
+        f"{result['name']} {result['status']} {result['seconds'] * 1000:.0f}ms" for result in results
+    ))
+    return results
+
+
+def warm_caches_on_startup():
+    """
+    Warm-up for ``RestaurantConfig.ready()``. Database queries are not allowed
+    while the apps are still loading, so the warmers run in a background
+    thread once loading has finished and never delay startup; the budget
+    bounds how long that thread keeps waiting for them.
+    """
+    budget = getattr(settings, 'CACHE_WARMUP_BUDGET_SECONDS', 5)
+
+    def run():
+        deadline = time.monotonic() + budget
+        while not apps.ready and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if apps.ready:
+            warm_caches(budget=max(deadline - time.monotonic(), 0))
+
+    threading.Thread(target=run, name='cache-warmup', daemon=True).start()